@@ -0,0 +1,254 @@
+"""
+Native async versions of the auth and user list views, for ASGI deployments.
+
+They keep the responses of their api.views counterparts but never block the
+event loop: the ORM is used through its async API and password hashing and
+checking run in the bounded pool of api.passwords.get_password_executor.
+Enable them with API_ASYNC_VIEWS in lms/settings.py.
+"""
+import json
+import math
+
+from asgiref.sync import sync_to_async
+from django.db import IntegrityError
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.decorators import method_decorator
+from django.utils.http import http_date
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import status
+from rest_framework.exceptions import APIException, Throttled
+from rest_framework.throttling import BaseThrottle
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+from .audit import audit_log
+from .authentication import CachedJWTAuthentication
+from .conf import api_setting
+from .filters import InvalidFilter, filter_users
+from .models import AuthAuditEvent, User
+from .pagination import InvalidCursor, JSONEnvelopeStream, KeysetPaginator, encode_cursor
+from .passwords import run_in_password_executor
+from .permissions import CanViewUsers
+from .renderers import FastJSONRenderer
+from .serializers import (
+    DUPLICATE_EMAIL,
+    AuthUserLoginSerializer,
+    AuthUserRegistrationSerializer,
+    UserListSerializer
+)
+from .throttling import login_throttle
+from .user_cache import user_resolver
+from .user_version import aget_users_version, variant_key
+
+def json_response(data, status_code):
+    # Same bytes as the DRF views render
+    return HttpResponse(FastJSONRenderer().render(data), status=status_code,
+                        content_type='application/json')
+
+
+def set_validators(response, variant, last_modified):
+    response['ETag'] = '"%s"' % variant
+    response['Last-Modified'] = http_date(last_modified.timestamp())
+    return response
+
+
+def parse_body(request):
+    """
+    Reads a JSON or form encoded body, returning None when it is malformed
+    """
+    if request.content_type == 'application/json':
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError:
+            return None
+        return data if isinstance(data, dict) else None
+    return request.POST.dict()
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncAuthUserRegistrationView(View):
+    serializer_class = AuthUserRegistrationSerializer
+
+    async def post(self, request):
+        data = parse_body(request)
+        if data is None:
+            return json_response({'detail': 'Malformed request.'}, status.HTTP_400_BAD_REQUEST)
+
+        # Field rules and the password policy are pure CPU, uniqueness is left
+        # to the INSERT
+        serializer = self.serializer_class(data=data)
+        if not serializer.is_valid():
+            return json_response(serializer.errors, status.HTTP_400_BAD_REQUEST)
+
+        email = User.objects.normalize_email(serializer.validated_data['email'])
+        try:
+            user = await User.objects.acreate_user(email, serializer.validated_data['password'])
+        except IntegrityError:
+            return json_response({'email': [DUPLICATE_EMAIL]}, status.HTTP_400_BAD_REQUEST)
+        audit_log.record(AuthAuditEvent.REGISTRATION, user.pk, user.email, request)
+
+        status_code = status.HTTP_201_CREATED
+        response = {
+            'success': True,
+            'statusCode': status_code,
+            'message': 'User successfully registered!',
+            'user': {'email': user.email}
+        }
+        return json_response(response, status_code)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncAuthUserLoginView(View):
+    serializer_class = AuthUserLoginSerializer
+
+    async def post(self, request):
+        data = parse_body(request)
+        if data is None:
+            return json_response({'detail': 'Malformed request.'}, status.HTTP_400_BAD_REQUEST)
+
+        # Throttled attempts are turned away before any password is hashed
+        email = data.get('email')
+        # Only touches the cache, so it need not wait for the shared sync thread
+        wait = await sync_to_async(login_throttle.check, thread_sensitive=False)(
+            BaseThrottle().get_ident(request), email if isinstance(email, str) else None)
+        if wait is not None:
+            response = json_response({'detail': Throttled(wait).detail}, status.HTTP_429_TOO_MANY_REQUESTS)
+            response['Retry-After'] = '%d' % math.ceil(wait)
+            return response
+
+        # Validation runs authenticate(), so PBKDF2 and its lookup go to the pool
+        serializer = self.serializer_class(data=data, context={'request': request})
+        if not await run_in_password_executor(serializer.is_valid):
+            return json_response(serializer.errors, status.HTTP_400_BAD_REQUEST)
+
+        status_code = status.HTTP_200_OK
+        response = {
+            'success': True,
+            'statusCode': status_code,
+            'message': 'User logged in successfully',
+            'access': serializer.data['access'],
+            'refresh': serializer.data['refresh'],
+            'authenticatedUser': {
+                'email': serializer.data['email'],
+                'role': serializer.data['role']
+            }
+        }
+        return json_response(response, status_code)
+
+
+class AsyncUserListView(View):
+    serializer_class = UserListSerializer
+    authentication_class = CachedJWTAuthentication
+
+    async def authenticate(self, request):
+        """
+        JWT authentication with the user resolved through the async ORM.
+        Returns the user or None when no token was sent.
+        """
+        authenticator = self.authentication_class()
+        header = authenticator.get_header(request)
+        if header is None:
+            return None
+        raw_token = authenticator.get_raw_token(header)
+        if raw_token is None:
+            return None
+        validated_token = authenticator.get_validated_token(raw_token)
+
+        user = await user_resolver.aget(validated_token.get(jwt_settings.USER_ID_CLAIM))
+        if user is None:
+            raise AuthenticationFailed('User not found', code='user_not_found')
+        if not user.is_active:
+            raise AuthenticationFailed('User is inactive', code='user_inactive')
+        return user
+
+    async def get(self, request):
+        try:
+            user = await self.authenticate(request)
+        except APIException as exc:
+            return json_response({'detail': exc.detail}, exc.status_code)
+        if user is None:
+            return json_response(
+                {'detail': 'Authentication credentials were not provided.'},
+                status.HTTP_401_UNAUTHORIZED
+            )
+
+        if not await CanViewUsers().aallows(user):
+            response = {
+                'success': False,
+                'status_code': status.HTTP_403_FORBIDDEN,
+                'message': 'You are not authorized to perform this action'
+            }
+            return json_response(response, status.HTTP_403_FORBIDDEN)
+
+        token, last_modified = await aget_users_version()
+        variant = variant_key(token, request.GET)
+        not_modified = get_conditional_response(
+            request, etag='"%s"' % variant, last_modified=int(last_modified.timestamp())
+        )
+        if not_modified is not None:
+            return set_validators(not_modified, variant, last_modified)
+
+        paginator = KeysetPaginator(
+            api_setting('USER_LIST', 'PAGE_SIZE'),
+            api_setting('USER_LIST', 'MAX_PAGE_SIZE'),
+        )
+        try:
+            users = filter_users(User.objects.all(), request.GET)
+            users = paginator.seek(users, request.GET.get('cursor'))
+        except (InvalidCursor, InvalidFilter) as e:
+            response = {
+                'success': False,
+                'status_code': status.HTTP_400_BAD_REQUEST,
+                'message': str(e) if isinstance(e, InvalidFilter) else 'Invalid cursor'
+            }
+            return json_response(response, status.HTTP_400_BAD_REQUEST)
+
+        if request.GET.get('stream') in ('1', 'true'):
+            return set_validators(self.stream(users), variant, last_modified)
+
+        limit = paginator.get_limit(request.GET.get('limit'))
+        rows = users.values_list(*self.serializer_class.Meta.fields, *paginator.ordering)
+        page = [row async for row in rows[:limit + 1]]
+        next_cursor = None
+        if len(page) > limit:
+            page = page[:limit]
+            next_cursor = encode_cursor(*page[-1][-len(paginator.ordering):])
+        response = {
+            'success': True,
+            'status_code': status.HTTP_200_OK,
+            'message': 'Successfully fetched users',
+            'next': next_cursor,
+            'users': self.serializer_class.serialize_rows(page)
+        }
+        return set_validators(json_response(response, status.HTTP_200_OK), variant, last_modified)
+
+    def stream(self, users):
+        chunk_size = api_setting('USER_LIST', 'STREAM_CHUNK_SIZE')
+
+        rows = users.values_list(*self.serializer_class.Meta.fields)
+
+        async def chunks():
+            chunk = []
+            async for row in rows.aiterator(chunk_size=chunk_size):
+                chunk.append(row)
+                if len(chunk) == chunk_size:
+                    yield self.serializer_class.serialize_rows(chunk)
+                    chunk = []
+            yield self.serializer_class.serialize_rows(chunk)
+
+        async def content():
+            envelope = {
+                'success': True,
+                'status_code': status.HTTP_200_OK,
+                'message': 'Successfully fetched users',
+            }
+            stream = JSONEnvelopeStream(envelope, 'users')
+            yield stream.head
+            async for chunk in chunks():
+                if chunk:
+                    yield stream.encode_chunk(chunk)
+            yield stream.tail
+
+        return StreamingHttpResponse(content(), content_type='application/json')
@@ -0,0 +1,205 @@
+"""
+Authentication audit log written off the request path.
+
+Auth code calls audit_log.record(), which only puts an unsaved
+AuthAuditEvent on a bounded in-process queue. A background worker, started
+by each serving process (see api.lifecycle), drains it into bulk_create
+batches and writes what is left when that process stops. Without a worker
+(tests, management commands) the queue is drained once each request has
+been answered (see api.signals). Nothing is written at exit otherwise: the
+test runner and benchmark_api discard the events of the databases they drop
+(see api.buffers.discard_buffers()).
+"""
+import logging
+import os
+import queue
+import threading
+
+from django.db import DatabaseError, close_old_connections
+from rest_framework.throttling import BaseThrottle
+
+from .conf import api_setting
+from .models import AuthAuditEvent
+
+logger = logging.getLogger(__name__)
+
+DROP_NEWEST = 'drop_newest'
+DROP_OLDEST = 'drop_oldest'
+BLOCK = 'block'
+
+_STOP = object()
+
+
+def client_ip(request):
+    """
+    The client address as the throttles see it, honouring NUM_PROXIES
+    """
+    if request is None:
+        return ''
+    return (BaseThrottle().get_ident(request) or '')[:64]
+
+
+class AuditLog:
+    """
+    Bounded queue of audit events. When it is full, DROP_POLICY decides:
+    'drop_newest' discards the new event, 'drop_oldest' discards the oldest
+    queued one, and 'block' waits up to BLOCK_TIMEOUT seconds for room before
+    discarding the new event. Dropped events are counted.
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue(maxsize=api_setting('AUDIT_LOG', 'MAX_QUEUE'))
+        self._worker = None
+        self._pid = None
+        self._lock = threading.Lock()
+        # Serializes writes between the worker and flush()
+        self._write_lock = threading.Lock()
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def __len__(self):
+        return self._queue.qsize()
+
+    def record(self, event, user_id=None, email='', request=None):
+        """
+        Queues an event, never touching the database
+        """
+        if not api_setting('AUDIT_LOG', 'ENABLED'):
+            return
+        self._put(AuthAuditEvent(event=event, user_id=user_id, email=(email or '')[:254],
+                                 ip=client_ip(request)))
+
+    def _put(self, entry):
+        policy = api_setting('AUDIT_LOG', 'DROP_POLICY')
+        try:
+            if policy == BLOCK:
+                self._queue.put(entry, timeout=api_setting('AUDIT_LOG', 'BLOCK_TIMEOUT'))
+            else:
+                self._queue.put_nowait(entry)
+            return
+        except queue.Full:
+            pass
+        if policy == DROP_OLDEST:
+            try:
+                self._queue.get_nowait()
+                self._queue.put_nowait(entry)
+            except (queue.Empty, queue.Full):
+                pass
+        with self._lock:
+            self.dropped += 1
+
+    def _take(self, limit, timeout=None):
+        """
+        Takes up to ``limit`` queued events, waiting up to ``timeout`` seconds
+        for the first one. Returns the events and whether the stop marker was seen.
+        """
+        batch = []
+        try:
+            entry = self._queue.get(timeout=timeout) if timeout else self._queue.get_nowait()
+            while True:
+                if entry is _STOP:
+                    return batch, True
+                batch.append(entry)
+                if len(batch) >= limit:
+                    break
+                entry = self._queue.get_nowait()
+        except queue.Empty:
+            pass
+        return batch, False
+
+    def _write(self, batch):
+        if not batch:
+            return
+        with self._write_lock:
+            try:
+                AuthAuditEvent.objects.bulk_create(batch)
+            except DatabaseError:
+                logger.exception('Could not write %d audit events', len(batch))
+                with self._lock:
+                    self.failed += len(batch)
+                return
+        with self._lock:
+            self.written += len(batch)
+
+    def flush(self):
+        """
+        Writes every queued event from the calling thread, returns how many
+        were taken off the queue
+        """
+        taken = 0
+        while True:
+            batch, stop = self._take(api_setting('AUDIT_LOG', 'BATCH_SIZE'))
+            self._write(batch)
+            taken += len(batch)
+            if not batch and not stop:
+                return taken
+
+    def discard(self):
+        """
+        Drops every queued event, returns how many were dropped
+        """
+        dropped = 0
+        while True:
+            batch, stop = self._take(api_setting('AUDIT_LOG', 'BATCH_SIZE'))
+            dropped += len(batch)
+            if not batch and not stop:
+                return dropped
+
+    def worker_running(self):
+        return self._worker is not None and self._worker.is_alive() and self._pid == os.getpid()
+
+    def start(self):
+        """
+        Starts the background writer of this process, once
+        """
+        with self._lock:
+            # A forked child inherits the flag but not the thread
+            if self.worker_running():
+                return
+            self._pid = os.getpid()
+            self._worker = threading.Thread(target=self._run, name='audit-log-writer', daemon=True)
+            self._worker.start()
+
+    def stop(self, timeout=5):
+        """
+        Stops the background writer after it has written what was queued
+        """
+        worker = self._worker
+        if worker is None or not worker.is_alive():
+            return
+        # Must get in even when the queue is full
+        while True:
+            try:
+                self._queue.put(_STOP, timeout=0.1)
+                break
+            except queue.Full:
+                if not worker.is_alive():
+                    return
+        worker.join(timeout)
+
+    def _run(self):
+        while True:
+            batch, stop = self._take(api_setting('AUDIT_LOG', 'BATCH_SIZE'),
+                                     timeout=api_setting('AUDIT_LOG', 'FLUSH_INTERVAL'))
+            if batch:
+                close_old_connections()
+                self._write(batch)
+                # Hands a pooled connection back while idle
+                close_old_connections()
+            if stop:
+                self.flush()
+                return
+
+    def stats(self):
+        with self._lock:
+            return {
+                'queued': len(self),
+                'written': self.written,
+                'dropped': self.dropped,
+                'failed': self.failed,
+                'worker_running': self.worker_running(),
+            }
+
+
+audit_log = AuditLog()
@@ -0,0 +1,122 @@
+import uuid
+
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.utils.crypto import salted_hmac
+from django.utils.translation import gettext_lazy as _
+from rest_framework.authentication import BasicAuthentication
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+from .conf import api_setting
+from .token_cache import token_cache
+from .user_cache import user_resolver
+
+_BASIC_AUTH_SALT = 'api.authentication.CachedBasicAuthentication'
+
+
+def _basic_auth_cache():
+    return caches[api_setting('BASIC_AUTH_CACHE', 'CACHE')]
+
+
+def _credentials_key(userid, password):
+    # Keyed by SECRET_KEY so a leaked cache reveals nothing about the credentials
+    digest = salted_hmac(_BASIC_AUTH_SALT, '%s\0%s' % (userid, password), algorithm='sha256')
+    return 'basic-auth:%s' % digest.hexdigest()
+
+
+def _user_salt_key(pk):
+    return 'basic-auth:salt:%s' % pk
+
+
+def _user_salt(cache, pk):
+    # Replaced by every invalidation, and lost on eviction, so either way the
+    # checks cached under the previous salt stop matching
+    salt = cache.get(_user_salt_key(pk))
+    if salt is None:
+        cache.add(_user_salt_key(pk), uuid.uuid4().hex, None)
+        salt = cache.get(_user_salt_key(pk))
+    return salt
+
+
+def invalidate_basic_auth_cache(pk):
+    """
+    Forgets every cached credential check of the given user
+    """
+    _basic_auth_cache().set(_user_salt_key(pk), uuid.uuid4().hex, None)
+
+
+class CachedBasicAuthentication(BasicAuthentication):
+    """
+    Basic authentication that remembers successful credential checks for
+    BASIC_AUTH_CACHE['TTL'] seconds, so repeated requests from scripted clients
+    skip the password hasher. A check is stored with the user's salt and only
+    trusted while the salt is current; the salt is replaced when the user's
+    password or active status changes (see api.signals). BASIC_AUTH_CACHE['CACHE']
+    must be shared by every worker (see api.checks).
+    """
+
+    def authenticate_credentials(self, userid, password, request=None):
+        cache = _basic_auth_cache()
+        key = _credentials_key(userid, password)
+        cached = cache.get(key)
+        if cached is not None:
+            pk, salt = cached
+            if salt == cache.get(_user_salt_key(pk)):
+                user = user_resolver.get(pk)
+                if user is not None and user.is_active:
+                    return (user, None)
+            cache.delete(key)
+
+        ttl = api_setting('BASIC_AUTH_CACHE', 'TTL')
+        entry = None
+        if ttl:
+            # The salt is read before the password is checked: a change made
+            # meanwhile replaces it, so the check cached below is never trusted
+            user_model = get_user_model()
+            pk = (user_model._default_manager.filter(**{user_model.USERNAME_FIELD: userid})
+                  .values_list('pk', flat=True).first())
+            if pk is not None:
+                entry = (pk, _user_salt(cache, pk))
+
+        user, auth = super().authenticate_credentials(userid, password, request)
+
+        if entry is not None and entry[0] == user.pk:
+            cache.set(key, entry, ttl)
+        return (user, auth)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that memoizes validated tokens in token_cache and
+    resolves the token's user through user_resolver, so a repeated token costs
+    neither a signature check nor a user query
+    """
+
+    def get_validated_token(self, raw_token):
+        key = token_cache.key(raw_token)
+        validated_token = token_cache.get(key)
+        if validated_token is None:
+            validated_token = super().get_validated_token(raw_token)
+            token_cache.set(key, validated_token)
+        return validated_token
+
+    def get_user(self, validated_token):
+        if jwt_settings.CHECK_REVOKE_TOKEN or jwt_settings.USER_ID_FIELD != 'id':
+            # Needs the password hash or another lookup field, which we do not cache
+            return super().get_user(validated_token)
+
+        try:
+            user_id = validated_token[jwt_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        user = user_resolver.get(user_id)
+        if user is None:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+
+        if not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        return user
@@ -0,0 +1,248 @@
+"""
+Batch jobs changing many users without long locks, used by the
+run_batch_job command.
+
+A job walks the user table in primary key ranges of ``chunk_size`` ids,
+updating the matching users of each range in its own short transaction and
+sleeping between ranges, so logins keep getting through. The range reached
+is checkpointed after each one (BatchJobCheckpoint) and an interrupted job
+resumes from there, provided it is given the same options: the ranges done
+were selected by those. Dry runs only count the users each range would change.
+"""
+import datetime
+import json
+import time
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import F, Max, Q
+from django.utils import timezone
+
+from .conf import api_setting
+from .managers import users_bulk_updated
+from .models import BatchJobCheckpoint, User, UserStatistic
+
+# Registered jobs, name -> class
+JOBS = {}
+
+
+def job(cls):
+    JOBS[cls.name] = cls
+    return cls
+
+
+class JobStats:
+
+    def __init__(self, start_id, end_id):
+        self.start_id = start_id
+        self.end_id = end_id
+        self.last_id = start_id
+        self.chunks = 0
+        self.rows = 0
+        self.started = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def rows_per_second(self):
+        elapsed = self.elapsed
+        return self.rows / elapsed if elapsed else 0.0
+
+    @property
+    def progress(self):
+        """
+        Fraction of the id range done
+        """
+        total = self.end_id - self.start_id
+        return (self.last_id - self.start_id) / total if total else 1.0
+
+
+class BatchJob:
+    """
+    Sets ``values()`` on the users of ``queryset()``. Subclasses define both
+    and a unique ``name``, used for the checkpoint.
+
+    ``sleep`` seconds are waited after each range, and longer if needed to
+    stay under ``max_rows_per_second``. ``progress(stats)`` is called after
+    every range.
+    """
+    name = None
+    # Keyword arguments of the job's own, set from its command line options
+    # and kept as attributes of the same names
+    options = ()
+
+    def __init__(self, chunk_size=None, sleep=None, max_rows_per_second=None, dry_run=False,
+                 progress=None):
+        self.chunk_size = chunk_size or api_setting('BATCH_JOBS', 'CHUNK_SIZE')
+        self.sleep = api_setting('BATCH_JOBS', 'SLEEP') if sleep is None else sleep
+        self.max_rows_per_second = max_rows_per_second or api_setting('BATCH_JOBS', 'MAX_ROWS_PER_SECOND')
+        self.dry_run = dry_run
+        self.progress = progress
+
+    @classmethod
+    def add_arguments(cls, parser):
+        """
+        Adds the job's own options to its run_batch_job subcommand
+        """
+
+    def option_values(self):
+        """
+        The job's own options as stored with its checkpoint
+        """
+        values = {name: getattr(self, name) for name in self.options}
+        return json.loads(json.dumps(values, cls=DjangoJSONEncoder))
+
+    def queryset(self):
+        raise NotImplementedError
+
+    def values(self):
+        raise NotImplementedError
+
+    def run(self, restart=False):
+        checkpoint = self.checkpoint(restart)
+        stats = JobStats(checkpoint.last_id, checkpoint.end_id)
+        while stats.last_id < stats.end_id:
+            started = time.perf_counter()
+            high = min(stats.last_id + self.chunk_size, stats.end_id)
+            rows = self.process(stats.last_id, high)
+            stats.last_id = high
+            stats.chunks += 1
+            stats.rows += rows
+            if not self.dry_run:
+                BatchJobCheckpoint.objects.filter(pk=checkpoint.pk).update(
+                    last_id=high, rows_updated=F('rows_updated') + rows, updated_date=timezone.now())
+            if self.progress is not None:
+                self.progress(stats)
+            if stats.last_id < stats.end_id:
+                self.pause(rows, time.perf_counter() - started)
+        if not self.dry_run:
+            BatchJobCheckpoint.objects.filter(pk=checkpoint.pk).update(finished_date=timezone.now())
+        return stats
+
+    def checkpoint(self, restart):
+        """
+        The unfinished run to resume, or a new run up to the current highest id
+        """
+        checkpoint = BatchJobCheckpoint.objects.filter(name=self.name).first()
+        options = self.option_values()
+        if checkpoint is not None and checkpoint.finished_date is None and not restart:
+            if checkpoint.options != options:
+                raise ValueError(
+                    'The unfinished %s run was started with %s, not %s; resume it with the same '
+                    'options or start over with --restart' % (
+                        self.name, json.dumps(checkpoint.options, sort_keys=True),
+                        json.dumps(options, sort_keys=True)))
+            return checkpoint
+        now = timezone.now()
+        checkpoint = checkpoint or BatchJobCheckpoint(name=self.name)
+        checkpoint.last_id = 0
+        checkpoint.end_id = User.objects.aggregate(end=Max('id'))['end'] or 0
+        checkpoint.rows_updated = 0
+        checkpoint.options = options
+        checkpoint.started_date = checkpoint.updated_date = now
+        checkpoint.finished_date = None
+        if not self.dry_run:
+            checkpoint.save()
+        return checkpoint
+
+    def process(self, low, high):
+        """
+        Updates the users with ids in (low, high], returns how many
+        """
+        users = self.queryset().filter(pk__gt=low, pk__lte=high)
+        if self.dry_run:
+            return users.count()
+
+        values = self.values()
+        with transaction.atomic():
+            # Locks only this range's matching rows, for one short transaction
+            changed = list(users.select_for_update().only('id', *UserStatistic.USER_FIELDS))
+            if not changed:
+                return 0
+            User.objects.filter(pk__in=[user.pk for user in changed]).update(**values)
+
+        for user in changed:
+            for field, value in values.items():
+                if not hasattr(value, 'resolve_expression'):
+                    setattr(user, field, value)
+        # UPDATE sends no post_save, caches are invalidated from this (see api.signals)
+        users_bulk_updated.send(sender=User, users=changed, update_fields=list(values))
+        return len(changed)
+
+    def pause(self, rows, elapsed):
+        delay = self.sleep
+        if self.max_rows_per_second:
+            delay = max(delay, rows / self.max_rows_per_second - elapsed)
+        if delay > 0:
+            time.sleep(delay)
+
+
+@job
+class DeactivateGraduatesJob(BatchJob):
+    """
+    Deactivates the active students who joined before ``joined_before``,
+    i.e. the cohorts that have graduated
+    """
+    name = 'deactivate_graduates'
+    options = ('joined_before', )
+
+    def __init__(self, joined_before, **kwargs):
+        super().__init__(**kwargs)
+        self.joined_before = joined_before
+        self.cutoff = timezone.make_aware(datetime.datetime.combine(joined_before, datetime.time()))
+
+    @classmethod
+    def add_arguments(cls, parser):
+        parser.add_argument('--joined-before', required=True, type=datetime.date.fromisoformat,
+                            help='Students who joined before this date (YYYY-MM-DD) have graduated')
+
+    def queryset(self):
+        return User.objects.filter(role=User.STUDENT, is_active=True, created_date__lt=self.cutoff)
+
+    def values(self):
+        return {'is_active': False, 'modified_date': timezone.now()}
+
+
+@job
+class ExpireDormantJob(BatchJob):
+    """
+    Deactivates the active accounts, admins aside, that have not logged in
+    for ``days`` days, or never have and are older than that
+    """
+    name = 'expire_dormant'
+    options = ('days', )
+
+    def __init__(self, days, **kwargs):
+        super().__init__(**kwargs)
+        self.days = days
+        self.cutoff = timezone.now() - datetime.timedelta(days=days)
+
+    @classmethod
+    def add_arguments(cls, parser):
+        parser.add_argument('--days', type=int, default=365,
+                            help='Days without a login after which an account expires')
+
+    def queryset(self):
+        return (User.objects.filter(is_active=True)
+                .exclude(role=User.ADMIN).exclude(is_superuser=True)
+                .filter(Q(last_login__lt=self.cutoff) | Q(last_login=None, created_date__lt=self.cutoff)))
+
+    def values(self):
+        return {'is_active': False, 'modified_date': timezone.now()}
+
+
+@job
+class BackfillModifiedDateJob(BatchJob):
+    """
+    Sets modified_date to created_date where it is earlier, as left on rows
+    whose created_date was set after the fact
+    """
+    name = 'backfill_modified_date'
+
+    def queryset(self):
+        return User.objects.filter(modified_date__lt=F('created_date'))
+
+    def values(self):
+        return {'modified_date': F('created_date')}
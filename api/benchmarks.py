@@ -0,0 +1,412 @@
+"""
+In-process benchmarks of the api endpoints.
+
+Requests go through Django's full handler stack with the test client, from a
+thread pool to get concurrency. The queries of each request are read from the
+Server-Timing header of RequestTimingMiddleware. Used by the benchmark_api
+management command, which runs them against a throwaway test database.
+"""
+import datetime
+import functools
+import itertools
+import json
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.password_validation import (
+    CommonPasswordValidator,
+    get_password_validators,
+    validate_password,
+)
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .models import Course, Section, User
+from .password_validation import CompactCommonPasswordValidator
+from .renderers import FastJSONRenderer
+from .scheduling import enroll, find_room_conflicts, load_slots
+from .serializers import AuthUserRegistrationSerializer, UserListSerializer
+
+BENCHMARK_PASSWORD = 'b3nchm4rk!Pass'
+ADMIN_EMAIL = 'bench-admin@bench.local'
+
+# Registered scenarios, name -> class
+SCENARIOS = {}
+
+
+def scenario(cls):
+    SCENARIOS[cls.name] = cls
+    return cls
+
+
+def seed_users(total, batch_size=5000):
+    """
+    Tops the user table up to ``total`` students plus one admin. Every seeded
+    user shares one precomputed hash, so seeding a million rows takes seconds.
+    """
+    password = make_password(BENCHMARK_PASSWORD)
+    if not User.objects.filter(email=ADMIN_EMAIL).exists():
+        User.objects.create(email=ADMIN_EMAIL, password=password, role=User.ADMIN,
+                            is_superuser=True)
+    existing = User.objects.filter(email__startswith='seed-').count()
+    for start in range(existing, total, batch_size):
+        User.objects.bulk_create(
+            [User(email='seed-%d@bench.local' % i, password=password)
+             for i in range(start, min(total, start + batch_size))],
+            batch_size=batch_size,
+        )
+
+
+class Scenario:
+    """
+    One benchmarked endpoint. prepare() runs untimed before the requests,
+    request() issues request number ``index`` with ``client``.
+    """
+    name = None
+    expected_status = 200
+
+    def prepare(self, count):
+        pass
+
+    def request(self, client, index):
+        raise NotImplementedError
+
+
+@scenario
+class RegisterScenario(Scenario):
+    name = 'register'
+    expected_status = 201
+
+    def prepare(self, count):
+        self.run_id = '%x' % time.time_ns()
+
+    def request(self, client, index):
+        data = {'email': 'register-%s-%d@bench.local' % (self.run_id, index),
+                'password': BENCHMARK_PASSWORD}
+        return client.post(reverse('register'), data)
+
+
+@scenario
+class LoginScenario(Scenario):
+    name = 'login'
+
+    def prepare(self, count):
+        self.users = max(1, User.objects.filter(email__startswith='seed-').count())
+
+    def request(self, client, index):
+        data = {'email': 'seed-%d@bench.local' % (index % self.users), 'password': BENCHMARK_PASSWORD}
+        return client.post(reverse('login'), data)
+
+
+@scenario
+class TokenObtainScenario(LoginScenario):
+    name = 'token_create'
+
+    def request(self, client, index):
+        data = {'email': 'seed-%d@bench.local' % (index % self.users), 'password': BENCHMARK_PASSWORD}
+        return client.post(reverse('token_create'), data)
+
+
+@scenario
+class TokenRefreshScenario(Scenario):
+    name = 'token_refresh'
+
+    def prepare(self, count):
+        # Refresh tokens are single use once rotated, so each request gets its own
+        admin = User.objects.get(email=ADMIN_EMAIL)
+        self.tokens = [str(RefreshToken.for_user(admin)) for _ in range(count)]
+
+    def request(self, client, index):
+        return client.post(reverse('token_refresh'), {'refresh': self.tokens[index]})
+
+
+@scenario
+class UserListScenario(Scenario):
+    name = 'users'
+
+    def prepare(self, count):
+        admin = User.objects.get(email=ADMIN_EMAIL)
+        self.authorization = 'JWT %s' % RefreshToken.for_user(admin).access_token
+
+    def request(self, client, index):
+        return client.get(reverse('users'), HTTP_AUTHORIZATION=self.authorization)
+
+
+def _queries(response):
+    """
+    Reads the query count from the Server-Timing header, if there is one
+    """
+    for metric in response.get('Server-Timing', '').split(', '):
+        if metric.startswith('db;'):
+            desc = metric.rsplit('desc="', 1)[-1]
+            return int(desc.split(' ', 1)[0])
+    return None
+
+
+def _percentile(ordered, fraction):
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))
+    return ordered[index]
+
+
+def run_scenario(name, requests, concurrency):
+    """
+    Issues ``requests`` requests of scenario ``name`` from ``concurrency``
+    threads and returns throughput, latency percentiles and queries per request
+    """
+    bench = SCENARIOS[name]()
+    bench.prepare(requests)
+
+    local = threading.local()
+    counter = itertools.count()
+
+    def issue(_):
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = Client()
+        index = next(counter)
+        start = time.perf_counter()
+        response = bench.request(client, index)
+        elapsed = (time.perf_counter() - start) * 1000
+        return elapsed, response.status_code == bench.expected_status, _queries(response)
+
+    # Every request comes from the same client, which login throttling would
+    # stop; queries are read from Server-Timing, off by default
+    with override_settings(LOGIN_THROTTLE={'IP_RATE': None, 'EMAIL_RATE': None},
+                           REQUEST_PROFILING={'ENABLED': True, 'SERVER_TIMING': True}):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(issue, range(requests)))
+        wall = time.perf_counter() - start
+
+    latencies = sorted(result[0] for result in results)
+    queries = [result[2] for result in results if result[2] is not None]
+    return {
+        'scenario': name,
+        'requests': requests,
+        'concurrency': concurrency,
+        'errors': sum(not result[1] for result in results),
+        'throughput_rps': requests / wall if wall else None,
+        'latency_ms': {
+            'mean': statistics.fmean(latencies) if latencies else None,
+            'p50': _percentile(latencies, 0.5),
+            'p95': _percentile(latencies, 0.95),
+            'p99': _percentile(latencies, 0.99),
+            'max': latencies[-1] if latencies else None,
+        },
+        'queries_per_request': statistics.fmean(queries) if queries else None,
+    }
+
+
+def run_serialization_benchmark(rows):
+    """
+    Times rendering a users list response of ``rows`` users with the
+    ModelSerializer and DRF's JSONRenderer, against the values_list fast path
+    and FastJSONRenderer. Both must produce the same bytes.
+    """
+    seed_users(rows)
+    queryset = User.objects.order_by('created_date', 'id')[:rows]
+
+    def envelope(users):
+        return {
+            'success': True,
+            'status_code': 200,
+            'message': 'Successfully fetched users',
+            'next': None,
+            'users': users,
+        }
+
+    start = time.perf_counter()
+    model_path = JSONRenderer().render(envelope(UserListSerializer(queryset, many=True).data))
+    model_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    values = queryset.values_list(*UserListSerializer.Meta.fields)
+    fast_path = FastJSONRenderer().render(envelope(UserListSerializer.serialize_rows(values)))
+    fast_seconds = time.perf_counter() - start
+
+    return {
+        'rows': rows,
+        'identical_output': model_path == fast_path,
+        'model_serializer_seconds': model_seconds,
+        'fast_path_seconds': fast_seconds,
+        'speedup': model_seconds / fast_seconds if fast_seconds else None,
+    }
+
+
+@functools.lru_cache(maxsize=None)
+def baseline_password_validators():
+    return get_password_validators([
+        {'NAME': 'django.contrib.auth.password_validation.%s' % name}
+        for name in ('UserAttributeSimilarityValidator', 'MinimumLengthValidator',
+                     'CommonPasswordValidator', 'NumericPasswordValidator')
+    ])
+
+
+class BaselineRegistrationSerializer(serializers.ModelSerializer):
+    """
+    Registration as it was before the single round trip path: a uniqueness
+    query ahead of the INSERT and Django's stock password validators
+    """
+    password = serializers.CharField(write_only=True)
+
+    class Meta:
+        model = User
+        fields = ('email', 'password')
+
+    def validate_password(self, value):
+        try:
+            validate_password(value, password_validators=baseline_password_validators())
+        except ValidationError as e:
+            raise serializers.ValidationError(str(e))
+        return value
+
+    def create(self, validated_data):
+        return User.objects.create_user(**validated_data)
+
+
+def run_registration_benchmark(requests):
+    """
+    Registers ``requests`` users through the baseline and the current
+    registration serializers, reporting queries and CPU time outside password
+    hashing per registration, and the memory of the common password list
+    """
+    run_id = '%x' % time.time_ns()
+    results = {}
+    for name, serializer_class in (('baseline', BaselineRegistrationSerializer),
+                                   ('current', AuthUserRegistrationSerializer)):
+        queries = 0
+        cpu = 0.0
+        # A trivial hasher takes password hashing out of the CPU time
+        with override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher']):
+            for index in range(requests):
+                data = {'email': 'registration-%s-%s-%d@bench.local' % (name, run_id, index),
+                        'password': BENCHMARK_PASSWORD}
+                start = time.thread_time()
+                with CaptureQueriesContext(connection) as captured:
+                    serializer = serializer_class(data=data)
+                    serializer.is_valid(raise_exception=True)
+                    serializer.save()
+                cpu += time.thread_time() - start
+                queries += len(captured)
+        results[name] = {
+            'queries_per_request': queries / requests,
+            'non_hash_cpu_ms_per_request': cpu * 1000 / requests,
+        }
+
+    stock = CommonPasswordValidator()
+    compact = CompactCommonPasswordValidator()
+    results['common_passwords_bytes'] = {
+        'baseline': sys.getsizeof(stock.passwords) + sum(sys.getsizeof(p) for p in stock.passwords),
+        'current': sys.getsizeof(compact.fingerprints),
+    }
+    results['requests'] = requests
+    return results
+
+
+def seed_sections(total):
+    """
+    Creates ``total`` 50 minute sections of one course, Monday-Wednesday-Friday
+    or Tuesday-Thursday from 8:00 to 17:00, in as many rooms as it takes for
+    none to be double-booked
+    """
+    course, _ = Course.objects.get_or_create(code='BENCH-%x' % time.time_ns(), title='Benchmark')
+    patterns = [(0b10101, hour) for hour in range(8, 18)] + [(0b01010, hour) for hour in range(8, 18)]
+    Section.objects.bulk_create([
+        Section(course=course, code=str(index), room='R%d' % (index // len(patterns)),
+                days=patterns[index % len(patterns)][0],
+                start_time=datetime.time(patterns[index % len(patterns)][1]),
+                end_time=datetime.time(patterns[index % len(patterns)][1], 50),
+                capacity=100)
+        for index in range(total)
+    ])
+    return Section.objects.filter(course=course)
+
+
+def run_schedule_benchmark(sections, enrollments=5000, repeats=20):
+    """
+    Times a room conflict check of a timetable of ``sections`` sections, and
+    the throughput of bulk enrollment over ``enrollments`` requests of seeded
+    students picking random sections
+    """
+    slots = load_slots(seed_sections(sections))
+    check_ms = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        find_room_conflicts(slots)
+        check_ms.append((time.perf_counter() - start) * 1000)
+
+    seed_users(max(1, enrollments // 5))
+    students = list(User.objects.filter(email__startswith='seed-').values_list('id', flat=True))
+    chooser = random.Random(0)
+    requests = [(chooser.choice(students), chooser.choice(slots).id) for _ in range(enrollments)]
+    start = time.perf_counter()
+    with CaptureQueriesContext(connection) as captured:
+        errors = enroll(requests)
+    elapsed = time.perf_counter() - start
+
+    return {
+        'sections': sections,
+        'timetable_check_ms': statistics.median(check_ms),
+        'enrollments': enrollments,
+        'enrolled': sum(error is None for error in errors),
+        'enrollments_per_second': enrollments / elapsed if elapsed else None,
+        'enrollment_queries': len(captured),
+    }
+
+
+def environment():
+    """
+    Describes what the numbers were measured on, to compare runs between commits
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+    }
+
+
+def run_suite(user_counts, scenarios, requests, concurrency, serialization_rows=None,
+              registration_requests=None, schedule_sections=None):
+    """
+    Runs every scenario at every table size and returns a JSON-serializable report
+    """
+    report = {'environment': environment(), 'runs': []}
+    for users in sorted(user_counts):
+        seed_users(users)
+        for name in scenarios:
+            result = run_scenario(name, requests, concurrency)
+            result['users'] = users
+            report['runs'].append(result)
+    if serialization_rows:
+        report['serialization'] = run_serialization_benchmark(serialization_rows)
+    if registration_requests:
+        report['registration'] = run_registration_benchmark(registration_requests)
+    if schedule_sections:
+        report['schedule'] = run_schedule_benchmark(schedule_sections)
+    return report
+
+
+def dumps(report):
+    return json.dumps(report, indent=2, sort_keys=True)
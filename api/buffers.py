@@ -0,0 +1,109 @@
+"""
+Flushing of the write-behind buffers.
+
+Buffers are flushed once they are due after each request (see api.signals)
+and, so that writes do not wait for the next request, by a background
+flusher each serving process starts (see api.lifecycle). Management
+commands filling them call flush_buffers() before returning.
+
+Serving processes flush everything when they stop (see api.lifecycle). Other
+processes flush nothing at exit: by then the test runner or benchmark_api may
+have dropped the database the buffered writes belong to, and they would land
+in the configured one. discard_buffers() drops them before such a database
+goes.
+"""
+import logging
+import os
+import threading
+
+from django.db import DatabaseError, close_old_connections, connections
+
+from .audit import audit_log
+from .conf import api_setting
+from .last_login import last_login_buffer
+from .user_stats import user_stats
+
+logger = logging.getLogger(__name__)
+
+# name -> buffer, each with flush_if_due(), flush() and discard()
+BUFFERS = {
+    'last_login': last_login_buffer,
+    'user_stats': user_stats,
+}
+
+
+def flush_buffers(due_only=False):
+    """
+    Flushes every buffer, or the due ones. A failing buffer is logged and
+    keeps its writes for the next attempt.
+    """
+    for name, buffer in BUFFERS.items():
+        try:
+            if due_only:
+                buffer.flush_if_due()
+            else:
+                buffer.flush()
+        except DatabaseError:
+            logger.exception('Could not flush the %s buffer', name)
+
+
+def discard_buffers():
+    """
+    Drops every buffered write and queued audit event, returns how many were
+    dropped by buffer
+    """
+    dropped = {name: buffer.discard() for name, buffer in BUFFERS.items()}
+    dropped['audit_log'] = audit_log.discard()
+    return dropped
+
+
+class BufferFlusher:
+    """
+    Background thread flushing the due buffers every CHECK_INTERVAL seconds
+    """
+
+    def __init__(self):
+        self._thread = None
+        self._pid = None
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+
+    def running(self):
+        return self._thread is not None and self._thread.is_alive() and self._pid == os.getpid()
+
+    def start(self):
+        """
+        Starts the flusher of this process, once
+        """
+        with self._lock:
+            # A forked child inherits the flag but not the thread
+            if self.running():
+                return
+            self._pid = os.getpid()
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='buffer-flusher', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5):
+        """
+        Stops the flusher after a last flush of every buffer, made from the
+        calling thread when the flusher does not run
+        """
+        thread = self._thread
+        if not self.running():
+            flush_buffers()
+            return
+        self._stopping.set()
+        thread.join(timeout)
+
+    def _run(self):
+        while not self._stopping.wait(api_setting('WRITE_BUFFERS', 'CHECK_INTERVAL')):
+            close_old_connections()
+            flush_buffers(due_only=True)
+            # Hands pooled connections back between checks
+            close_old_connections()
+        flush_buffers()
+        connections.close_all()
+
+
+buffer_flusher = BufferFlusher()
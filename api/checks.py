@@ -0,0 +1,78 @@
+"""
+Checks that the state workers share lives in a cache they all reach.
+
+Revoked tokens kept in a LocMemCache only exist in the worker that revoked
+them, login throttle buckets there multiply the limits by the number of
+workers, and a users list version or Basic auth salt there is never changed
+by the writes of other workers. Workers refuse to start with such a cache
+unless DEBUG is on (require_shared_caches(), called by lms/wsgi.py and
+lms/asgi.py), and
+``manage.py check --deploy`` reports it.
+"""
+import logging
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+
+from .conf import api_setting
+
+logger = logging.getLogger(__name__)
+
+# Backends whose entries no other process sees
+LOCAL_BACKENDS = (LocMemCache, DummyCache)
+
+
+def shared_cache_settings():
+    """
+    (setting, cache alias) of every cache holding state shared by the workers
+    """
+    uses = []
+    if api_setting('TOKEN_REVOCATION', 'STORE') == 'api.revocation.CacheRevocationStore':
+        uses.append(("TOKEN_REVOCATION['OPTIONS']['cache']",
+                     api_setting('TOKEN_REVOCATION', 'OPTIONS').get('cache', 'default')))
+    if api_setting('LOGIN_THROTTLE', 'STORE') == 'api.throttling.CacheBucketStore':
+        uses.append(("LOGIN_THROTTLE['OPTIONS']['cache']",
+                     api_setting('LOGIN_THROTTLE', 'OPTIONS').get('cache', 'default')))
+    uses.append(("USER_LIST['CACHE']", api_setting('USER_LIST', 'CACHE')))
+    if api_setting('BASIC_AUTH_CACHE', 'TTL'):
+        uses.append(("BASIC_AUTH_CACHE['CACHE']", api_setting('BASIC_AUTH_CACHE', 'CACHE')))
+    return uses
+
+
+def local_cache_settings():
+    """
+    The shared_cache_settings() whose cache is local to this process
+    """
+    return [(setting, alias) for setting, alias in shared_cache_settings()
+            if isinstance(caches[alias], LOCAL_BACKENDS)]
+
+
+@checks.register(checks.Tags.caches, deploy=True)
+def check_shared_caches(app_configs, **kwargs):
+    return [
+        checks.Error(
+            '%s is the process-local cache %r, workers do not share it' % (setting, alias),
+            hint='Point it at a cache every worker reaches, e.g. set REDIS_URL.',
+            id='api.E001',
+        )
+        for setting, alias in local_cache_settings()
+    ]
+
+
+def require_shared_caches():
+    """
+    Raises ImproperlyConfigured when shared state would be kept per process,
+    only warns when DEBUG is on
+    """
+    local = local_cache_settings()
+    if not local:
+        return
+    message = 'Process-local caches hold state workers must share: %s' % ', '.join(
+        '%s (%r)' % item for item in local)
+    if not settings.DEBUG:
+        raise ImproperlyConfigured(message)
+    logger.warning(message)
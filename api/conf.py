@@ -0,0 +1,120 @@
+from django.conf import settings
+
+# Defaults for the api app's own settings groups, overridable from lms/settings.py
+DEFAULTS = {
+    'USER_LIST': {
+        'PAGE_SIZE': 100,
+        'MAX_PAGE_SIZE': 1000,
+        'STREAM_CHUNK_SIZE': 2000,
+        'CACHE': 'shared',
+        'PAGE_CACHE_TTL': 0,
+    },
+    'EXPORT': {
+        'CHUNK_SIZE': 2000,
+    },
+    'PASSWORD_HASHING': {
+        'WORKERS': None,
+        'MIN_POOL_BATCH': 16,
+        'THREADS': None,
+    },
+    'BULK_REGISTRATION': {
+        'BATCH_SIZE': 1000,
+        'MAX_ROWS': 20000,
+    },
+    'ENROLLMENT': {
+        'BATCH_SIZE': 1000,
+        'MAX_ROWS': 20000,
+    },
+    'BATCH_JOBS': {
+        'CHUNK_SIZE': 1000,
+        'SLEEP': 0.1,
+        'MAX_ROWS_PER_SECOND': None,
+    },
+    'IMPORT': {
+        'BATCH_SIZE': 5000,
+    },
+    'BASIC_AUTH_CACHE': {
+        'CACHE': 'shared',
+        'TTL': 60,
+    },
+    'USER_CACHE': {
+        'MAX_ENTRIES': 10000,
+        'LOCAL_TTL': 30,
+        'CACHE': None,
+        'TTL': 300,
+    },
+    'PERMISSION_CACHE': {
+        'MAX_ENTRIES': 10000,
+        'LOCAL_TTL': 30,
+    },
+    'LAST_LOGIN_BUFFER': {
+        'FLUSH_INTERVAL': 5,
+        'FLUSH_SIZE': 500,
+    },
+    'WRITE_BUFFERS': {
+        'CHECK_INTERVAL': 1,
+    },
+    'USER_STATS': {
+        'FLUSH_INTERVAL': 5,
+        'FLUSH_SIZE': 500,
+        'SIGNUP_DAYS': 30,
+        'MAX_SIGNUP_DAYS': 366,
+    },
+    'TOKEN_CACHE': {
+        'MAX_ENTRIES': 10000,
+    },
+    'TOKEN_REVOCATION': {
+        'STORE': 'api.revocation.CacheRevocationStore',
+        'OPTIONS': {},
+        'BLOOM_CAPACITY': 100000,
+        'BLOOM_ERROR_RATE': 0.01,
+        'SYNC_INTERVAL': 5,
+    },
+    'DATABASE_POOL': {
+        'MIN_SIZE': 2,
+        'MAX_SIZE': 20,
+        'TIMEOUT': 30,
+        'MAX_IDLE': 300,
+        'HEALTH_CHECK': True,
+    },
+    'LOGIN_THROTTLE': {
+        'STORE': 'api.throttling.CacheBucketStore',
+        'OPTIONS': {'cache': 'shared'},
+        'IP_RATE': '30/min',
+        'IP_BURST': 30,
+        'EMAIL_RATE': '5/min',
+        'EMAIL_BURST': 10,
+    },
+    'AUDIT_LOG': {
+        'ENABLED': True,
+        'MAX_QUEUE': 10000,
+        'BATCH_SIZE': 500,
+        'FLUSH_INTERVAL': 1.0,
+        'DROP_POLICY': 'drop_newest',
+        'BLOCK_TIMEOUT': 0.05,
+        'PAGE_SIZE': 100,
+        'MAX_PAGE_SIZE': 1000,
+    },
+    'READ_REPLICAS': {
+        'ALIASES': [],
+        'PIN_SECONDS': 5,
+        'PIN_COOKIE': 'lms_primary',
+    },
+    'STARTUP': {
+        'WARM_UP': True,
+        'IMPORT_BUDGET': 3.0,
+        'IMPORT_BUDGET_TOP': 20,
+    },
+    'REQUEST_PROFILING': {
+        'ENABLED': True,
+        'SERVER_TIMING': None,
+    },
+}
+
+
+def api_setting(group, key):
+    """
+    Reads ``settings.<group>[<key>]`` falling back to the api app defaults.
+    Looked up on every call so override_settings works in tests.
+    """
+    return getattr(settings, group, {}).get(key, DEFAULTS[group][key])
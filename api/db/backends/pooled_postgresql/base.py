@@ -0,0 +1,98 @@
+"""
+PostgreSQL backend keeping connections in an api.pool.ConnectionPool.
+
+Django opens a connection for every request and closes it afterwards unless
+CONN_MAX_AGE is set. With this engine opening checks a connection out of the
+pool of the database, and closing rolls back whatever was left open and
+returns it. Sized and tuned by the DATABASE_POOL setting. A forked process
+starts with pools of its own (see api.pool).
+"""
+import os
+
+from django.db.backends.postgresql import base, creation
+from django.db.backends.postgresql.psycopg_any import IsolationLevel
+
+from api.conf import api_setting
+from api.pool import ConnectionPool, abandon, close_pools, get_pool
+
+# libpq transaction states, the same values in psycopg2 and psycopg 3
+TRANSACTION_IDLE = 0
+TRANSACTION_INTRANS = 2
+TRANSACTION_INERROR = 3
+
+
+def check_connection(connection):
+    """
+    Health check run on checkout
+    """
+    if connection.closed:
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1')
+    if not connection.autocommit:
+        connection.rollback()
+    return True
+
+
+def reset_connection(connection):
+    """
+    Readies a returned connection for the next checkout, False if it cannot be reused
+    """
+    if connection.closed:
+        return False
+    status = connection.info.transaction_status
+    if status in (TRANSACTION_INTRANS, TRANSACTION_INERROR):
+        try:
+            connection.rollback()
+        except Exception:
+            return False
+        return True
+    return status == TRANSACTION_IDLE
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # Idle pooled connections would keep the test database in use
+        close_pools(self.connection.alias)
+        super()._destroy_test_db(test_database_name, verbosity)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+
+    def pool_key(self, conn_params):
+        # Test database setup connects the same alias to other databases
+        return '%s:%s' % (self.alias, conn_params.get('dbname') or conn_params.get('service'))
+
+    def get_pool(self, conn_params):
+        def factory():
+            pool = ConnectionPool(
+                lambda: super(DatabaseWrapper, self).get_new_connection(conn_params),
+                min_size=api_setting('DATABASE_POOL', 'MIN_SIZE'),
+                max_size=api_setting('DATABASE_POOL', 'MAX_SIZE'),
+                timeout=api_setting('DATABASE_POOL', 'TIMEOUT'),
+                max_idle=api_setting('DATABASE_POOL', 'MAX_IDLE'),
+                health_check=check_connection if api_setting('DATABASE_POOL', 'HEALTH_CHECK') else None,
+            )
+            pool.fill()
+            return pool
+        return get_pool(self.pool_key(conn_params), factory)
+
+    def get_new_connection(self, conn_params):
+        self.pool = self.get_pool(conn_params)
+        connection = self.pool.getconn()
+        # The parent sets this while connecting, which reused connections skip
+        isolation_level = self.settings_dict['OPTIONS'].get('isolation_level')
+        self.isolation_level = (IsolationLevel.READ_COMMITTED if isolation_level is None
+                                else IsolationLevel(isolation_level))
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            if self.pool.pid != os.getpid():
+                # Opened before a fork, the parent still uses it
+                abandon(self.connection)
+                return
+            with self.wrap_database_errors:
+                self.pool.putconn(self.connection, discard=not reset_connection(self.connection))
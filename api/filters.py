@@ -0,0 +1,123 @@
+import datetime
+
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import AuthAuditEvent, User
+
+
+class InvalidFilter(Exception):
+    """
+    Raised with a client-facing message for a malformed filter parameter
+    """
+
+
+def _parse_boolean(name, value):
+    if value in ('1', 'true', 'True'):
+        return True
+    if value in ('0', 'false', 'False'):
+        return False
+    raise InvalidFilter('%s must be true or false' % name)
+
+
+def _parse_moment(name, value, end_of_day=False):
+    """
+    Parses an ISO 8601 datetime, or a date meaning the start of that day
+    (or the start of the next one with ``end_of_day``)
+    """
+    try:
+        # parse_datetime() also accepts bare dates, so try those first
+        date = parse_date(value)
+        if date is not None:
+            if end_of_day:
+                date += datetime.timedelta(days=1)
+            moment = datetime.datetime.combine(date, datetime.time.min)
+        else:
+            moment = parse_datetime(value)
+            if moment is None:
+                raise ValueError(value)
+    except ValueError:
+        raise InvalidFilter('%s must be an ISO 8601 date or datetime' % name)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def email_prefix_q(prefix):
+    """
+    Matches emails starting with ``prefix``, case-sensitively as on PostgreSQL
+    """
+    q = Q(email__startswith=prefix)
+    if connection.vendor == 'sqlite':
+        # SQLite never uses an index for LIKE ... ESCAPE, but can answer the
+        # equivalent binary range from the unique email index
+        q &= Q(email__gte=prefix, email__lt=prefix + '\U0010ffff')
+    return q
+
+
+def _filter_created(queryset, params, after_name, before_name):
+    after = params.get(after_name)
+    if after:
+        queryset = queryset.filter(created_date__gte=_parse_moment(after_name, after))
+
+    before = params.get(before_name)
+    if before:
+        # A bare date includes the whole day
+        moment = _parse_moment(before_name, before, end_of_day=True)
+        if parse_date(before) is not None:
+            queryset = queryset.filter(created_date__lt=moment)
+        else:
+            queryset = queryset.filter(created_date__lte=moment)
+    return queryset
+
+
+def filter_users(queryset, params):
+    """
+    Applies the users list filters found in ``params``: role, is_active,
+    created_after, created_before (inclusive ISO 8601 dates or datetimes)
+    and email (prefix).
+    Every filter is backed by an index, see the User model.
+    """
+    role = params.get('role')
+    if role:
+        if role not in [str(value) for value, label in User.ROLE_CHOICES]:
+            raise InvalidFilter('role must be one of %s' % ', '.join(
+                str(value) for value, label in User.ROLE_CHOICES))
+        queryset = queryset.filter(role=int(role))
+
+    is_active = params.get('is_active')
+    if is_active:
+        queryset = queryset.filter(is_active=_parse_boolean('is_active', is_active))
+
+    queryset = _filter_created(queryset, params, 'created_after', 'created_before')
+
+    email = params.get('email')
+    if email:
+        queryset = queryset.filter(email_prefix_q(email))
+
+    return queryset
+
+
+def filter_audit_events(queryset, params):
+    """
+    Applies the audit log filters found in ``params``: user (id), event,
+    since and until (inclusive ISO 8601 dates or datetimes).
+    Backed by the (user_id, created_date, id) and (created_date, id) indexes.
+    """
+    user = params.get('user')
+    if user:
+        try:
+            queryset = queryset.filter(user_id=int(user))
+        except ValueError:
+            raise InvalidFilter('user must be a user id')
+
+    event = params.get('event')
+    if event:
+        events = [value for value, label in AuthAuditEvent.EVENT_CHOICES]
+        if event not in events:
+            raise InvalidFilter('event must be one of %s' % ', '.join(events))
+        queryset = queryset.filter(event=event)
+
+    return _filter_created(queryset, params, 'since', 'until')
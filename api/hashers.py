@@ -0,0 +1,15 @@
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+
+from .profiling import span
+
+
+class ProfiledPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """
+    Django's default PBKDF2 hasher, adding its time to the request's
+    ``hashing`` span. Hashes are unchanged, the algorithm name is the same.
+    """
+
+    def encode(self, password, salt, iterations=None):
+        # verify() and harden_runtime() go through encode() as well
+        with span('hashing'):
+            return super().encode(password, salt, iterations)
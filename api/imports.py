@@ -0,0 +1,188 @@
+"""
+Bulk loading of students from CSV files, used by the import_users command.
+
+Rows are validated and normalized like CustomUserManager.create_user, checked
+against existing emails with one query per batch, hashed in a process pool
+(api.passwords.hash_passwords) and written with PostgreSQL's COPY, or
+bulk_create on other databases.
+"""
+import csv
+import io
+import secrets
+import time
+
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import IntegrityError, connections, transaction
+from django.utils import timezone
+
+from .conf import api_setting
+from .managers import users_bulk_created
+from .models import User
+from .passwords import hash_passwords
+from .user_version import bump_users_version
+
+
+def generate_password():
+    """
+    One-time password for rows without one
+    """
+    return secrets.token_urlsafe(12)
+
+
+class ImportStats:
+
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.duplicates = 0
+        self.invalid = 0
+        self.started = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def rows_per_second(self):
+        elapsed = self.elapsed
+        return self.rows / elapsed if elapsed else 0.0
+
+
+class UserImporter:
+    """
+    Imports ``email`` and optional ``password`` CSV columns as students.
+    Rows without a password get a generated one-time password, passed to
+    ``on_password(email, password)`` so it can be handed out; without that
+    callback they are rejected. Invalid rows go to ``on_invalid(line, email,
+    reason)`` and ``progress(stats)`` is called after every batch.
+    """
+
+    def __init__(self, batch_size=None, workers=None, using='default',
+                 on_password=None, on_invalid=None, progress=None):
+        self.batch_size = batch_size or api_setting('IMPORT', 'BATCH_SIZE')
+        self.workers = workers
+        self.using = using
+        self.on_password = on_password
+        self.on_invalid = on_invalid
+        self.progress = progress
+        self.stats = ImportStats()
+
+    def run(self, f):
+        reader = csv.DictReader(f)
+        if 'email' not in (reader.fieldnames or ()):
+            raise ValueError('The CSV needs an email column')
+        batch = []
+        for row in reader:
+            batch.append((reader.line_num, row))
+            if len(batch) == self.batch_size:
+                self.import_batch(batch)
+                batch = []
+        if batch:
+            self.import_batch(batch)
+        if self.stats.created:
+            # Neither COPY nor bulk_create send post_save signals
+            bump_users_version()
+        return self.stats
+
+    def invalid(self, line, email, reason):
+        self.stats.invalid += 1
+        if self.on_invalid is not None:
+            self.on_invalid(line, email, reason)
+
+    def import_batch(self, batch):
+        self.stats.rows += len(batch)
+
+        pending = {}
+        for line, row in batch:
+            email = (row.get('email') or '').strip()
+            try:
+                validate_email(email)
+            except ValidationError:
+                self.invalid(line, email, 'invalid email')
+                continue
+            email = User.objects.normalize_email(email)
+            if email in pending:
+                self.stats.duplicates += 1
+                continue
+            password = row.get('password') or None
+            if password is None and self.on_password is None:
+                self.invalid(line, email, 'no password')
+                continue
+            pending[email] = password
+
+        # One set-based query for the whole batch; earlier batches are already
+        # committed, so repeats across the file are caught here too
+        existing = User.objects.using(self.using).filter(email__in=list(pending))
+        for email in existing.values_list('email', flat=True):
+            del pending[email]
+            self.stats.duplicates += 1
+
+        generated = {}
+        for email, password in pending.items():
+            if password is None:
+                pending[email] = generated[email] = generate_password()
+
+        now = timezone.now()
+        hashes = hash_passwords(pending.values(), workers=self.workers)
+        users = [
+            User(email=email, password=password, role=User.STUDENT,
+                 created_date=now, modified_date=now)
+            for email, password in zip(pending, hashes)
+        ]
+        created = self.insert(users)
+        self.stats.created += len(created)
+        if self.on_password is not None:
+            for user in created:
+                if user.email in generated:
+                    self.on_password(user.email, generated[user.email])
+
+        if self.progress is not None:
+            self.progress(self.stats)
+
+    def insert(self, users):
+        """
+        Writes ``users``, returning those actually created
+        """
+        if not users:
+            return []
+        if connections[self.using].vendor == 'postgresql':
+            try:
+                with transaction.atomic(using=self.using):
+                    self.copy(users)
+                users_bulk_created.send(sender=User, users=users, using=self.using)
+                return users
+            except IntegrityError:
+                # Lost a race with a concurrent registration, let the manager
+                # drop the taken emails
+                pass
+        return User.objects.db_manager(self.using)._bulk_insert(users)
+
+    def copy(self, users):
+        connection = connections[self.using]
+        fields = [field for field in User._meta.concrete_fields if field.column != 'id']
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for user in users:
+            values = []
+            for field in fields:
+                value = field.get_db_prep_save(field.pre_save(user, True), connection)
+                if isinstance(value, bool):
+                    value = 't' if value else 'f'
+                values.append(value)
+            writer.writerow(values)
+        buffer.seek(0)
+
+        sql = 'COPY %s (%s) FROM STDIN WITH (FORMAT csv)' % (
+            connection.ops.quote_name(User._meta.db_table),
+            ', '.join(connection.ops.quote_name(field.column) for field in fields),
+        )
+        with connection.cursor() as cursor:
+            raw = cursor.cursor
+            if hasattr(raw, 'copy_expert'):
+                # psycopg2
+                raw.copy_expert(sql, buffer)
+            else:
+                # psycopg 3
+                with raw.copy(sql) as copy:
+                    copy.write(buffer.getvalue())
@@ -0,0 +1,94 @@
+import threading
+import time
+
+from django.db import DatabaseError
+from django.db.models import Case, DateTimeField, Value, When
+from django.utils import timezone
+
+from .conf import api_setting
+from .models import User
+from .routers import pin_to_primary
+
+
+class LastLoginBuffer:
+    """
+    Write-behind buffer for User.last_login.
+
+    Logins only record a timestamp in memory. Pending timestamps are written
+    in one batched UPDATE once LAST_LOGIN_BUFFER['FLUSH_SIZE'] users are
+    pending or the oldest one is FLUSH_INTERVAL seconds old, checked after each
+    request has been answered (see api.signals) and by the background flusher
+    of api.buffers, and when a serving process stops (see api.lifecycle).
+    """
+    # Users per UPDATE statement, keeps the CASE expression reasonably sized
+    statement_size = 500
+
+    def __init__(self):
+        self._pending = {}
+        self._oldest = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def record(self, user):
+        now = timezone.now()
+        user.last_login = now
+        with self._lock:
+            self._pending[user.pk] = now
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+        # A deferred write, but the client should still read its own login
+        pin_to_primary()
+
+    def is_due(self):
+        oldest = self._oldest
+        if oldest is None:
+            return False
+        return (len(self._pending) >= api_setting('LAST_LOGIN_BUFFER', 'FLUSH_SIZE')
+                or time.monotonic() - oldest >= api_setting('LAST_LOGIN_BUFFER', 'FLUSH_INTERVAL'))
+
+    def flush_if_due(self):
+        if self.is_due():
+            return self.flush()
+        return 0
+
+    def flush(self):
+        """
+        Writes every pending timestamp, returns the number of users updated
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._oldest = None
+        if not pending:
+            return 0
+
+        items = list(pending.items())
+        try:
+            for start in range(0, len(items), self.statement_size):
+                chunk = items[start:start + self.statement_size]
+                User.objects.filter(pk__in=[pk for pk, _ in chunk]).update(last_login=Case(
+                    *[When(pk=pk, then=Value(when)) for pk, when in chunk],
+                    output_field=DateTimeField(),
+                ))
+        except DatabaseError:
+            # Put the timestamps back, unless a newer login was recorded meanwhile
+            with self._lock:
+                for pk, when in items:
+                    self._pending.setdefault(pk, when)
+                if self._oldest is None:
+                    self._oldest = time.monotonic()
+            raise
+        return len(items)
+
+    def discard(self):
+        """
+        Drops every pending timestamp, returns how many
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._oldest = None
+        return len(pending)
+
+
+last_login_buffer = LastLoginBuffer()
@@ -0,0 +1,88 @@
+"""
+Background work of a serving process, and its orderly stop.
+
+start_worker() runs in each worker once it is forked, before it serves:
+gunicorn calls it from its post_worker_init hook (gunicorn.conf.py), other
+servers on the first request (see start_worker_on_request()). Nothing is
+started when the application is imported, so a preloading master forks
+without threads or database connections. It starts the audit log writer and
+the write-behind buffer flusher, warms the worker's database connections
+(api.warmup.WORKER_STEPS) and makes sure stop_worker() runs when the
+process exits: it stops the flusher after a last flush of every buffer, so
+a worker exiting, recycled (max-requests) or replaced by a deploy does not
+lose the writes it buffered. The audit log writer is stopped the same way.
+
+Servers exit their workers normally on SIGTERM, which runs atexit handlers;
+their worker-exit hooks may call stop_worker() earlier, it only runs once.
+
+Only the process that started the flusher flushes: a forked child inherits
+the atexit handler but not the flusher, and the test runner and benchmark_api
+discard the buffers of the databases they drop (see api.buffers).
+"""
+import atexit
+import logging
+import os
+import threading
+
+from django.core.signals import request_started
+
+from .audit import audit_log
+from .buffers import buffer_flusher
+from .warmup import WORKER_STEPS, warm_up
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+# Process the background work runs in
+_started_pid = None
+
+
+def start_worker():
+    """
+    Starts the background work of this process, once
+    """
+    global _started_pid
+    with _lock:
+        if _started_pid == os.getpid():
+            return
+        _started_pid = os.getpid()
+        audit_log.start()
+        buffer_flusher.start()
+        warm_up(WORKER_STEPS)
+
+
+def _request_started(sender, **kwargs):
+    if _started_pid != os.getpid():
+        start_worker()
+
+
+def start_worker_on_request():
+    """
+    Starts the background work of each process on its first request, for
+    servers without a post-fork hook
+    """
+    request_started.connect(_request_started, dispatch_uid='api.lifecycle.start_worker')
+
+
+def stop_worker():
+    """
+    Stops the background work started in this process, flushing what it
+    buffered. Does nothing in other processes, or when already stopped.
+    """
+    global _started_pid
+    with _lock:
+        if _started_pid != os.getpid():
+            return
+        _started_pid = None
+        try:
+            buffer_flusher.stop()
+        except Exception:
+            logger.exception('Could not flush the write-behind buffers at exit')
+        try:
+            audit_log.stop()
+            audit_log.flush()
+        except Exception:
+            logger.exception('Could not flush the audit log at exit')
+
+
+atexit.register(stop_worker)
@@ -0,0 +1,59 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test.utils import (
+    setup_databases, setup_test_environment, teardown_databases, teardown_test_environment
+)
+
+from api.benchmarks import SCENARIOS, dumps, run_suite
+from api.buffers import discard_buffers
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmarks the api endpoints in-process against a throwaway test database '
+        'seeded with the given numbers of users, and prints a JSON report'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, nargs='+', default=[1000],
+                            help='Table sizes to benchmark at, e.g. 1000 100000 1000000')
+        parser.add_argument('--scenarios', nargs='+', choices=sorted(SCENARIOS),
+                            default=sorted(SCENARIOS))
+        parser.add_argument('--requests', type=int, default=100, help='Requests per scenario')
+        parser.add_argument('--concurrency', type=int, default=4)
+        parser.add_argument('--serialization-rows', type=int,
+                            help='Also compare user list serialization paths on this many rows')
+        parser.add_argument('--registration-requests', type=int,
+                            help='Also compare the registration paths over this many registrations')
+        parser.add_argument('--schedule-sections', type=int,
+                            help='Also time conflict checks and bulk enrollment over this many sections')
+        parser.add_argument('--output', help='Write the report to this file instead of stdout')
+        parser.add_argument('--keepdb', action='store_true',
+                            help='Keep the benchmark database, reusing seeded users next time')
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or options['concurrency'] < 1:
+            raise CommandError('--requests and --concurrency must be positive')
+
+        # Same database isolation and host handling as the test runner, every
+        # alias getting a test database (replicas mirror the primary's)
+        setup_test_environment(debug=False)
+        old_config = setup_databases(verbosity=0, interactive=False, keepdb=options['keepdb'],
+                                     aliases=set(connections), serialized_aliases=set())
+        try:
+            report = run_suite(options['users'], options['scenarios'],
+                               options['requests'], options['concurrency'],
+                               options['serialization_rows'], options['registration_requests'],
+                               options['schedule_sections'])
+        finally:
+            # Writes still buffered, audit events included, belong to the benchmark databases
+            discard_buffers()
+            teardown_databases(old_config, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
+
+        output = dumps(report)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
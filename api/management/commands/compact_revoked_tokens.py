@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from api.revocation import revocation_registry
+
+
+class Command(BaseCommand):
+    help = 'Drops revoked refresh tokens past their expiry and rebuilds the Bloom filter'
+
+    def handle(self, *args, **options):
+        removed = revocation_registry.compact()
+        self.stdout.write(self.style.SUCCESS('Removed %d expired revoked tokens' % removed))
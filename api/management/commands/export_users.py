@@ -0,0 +1,57 @@
+import os
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.exports import ENCODERS, complete_gzip_length, export_users
+
+
+class Command(BaseCommand):
+    help = (
+        'Streams every user to a CSV or NDJSON file (or stdout) in id order. '
+        'Pass the last exported id printed by an interrupted run to --after-id '
+        'to resume it, appending to the same file.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', dest='output_format', choices=sorted(ENCODERS), default='csv')
+        parser.add_argument('--output', help='File to write, stdout by default')
+        parser.add_argument('--gzip', action='store_true', help='Gzip the export')
+        parser.add_argument('--after-id', type=int, help='Only export users with a greater id')
+        parser.add_argument('--chunk-size', type=int, help='Rows fetched and written at a time')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] is not None and options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be positive')
+        resuming = options['after_id'] is not None
+        path = options['output']
+
+        def progress(rows, last_id):
+            self.stderr.write('Exported %d users, last id %d' % (rows, last_id))
+
+        chunks = export_users(
+            options['output_format'],
+            after_id=options['after_id'],
+            chunk_size=options['chunk_size'],
+            compress=options['gzip'],
+            # A resumed export continues a file that already has the header
+            header=not (resuming and path and os.path.exists(path)),
+            progress=progress,
+        )
+        # Each chunk is flushed before the next is read, so the last id
+        # reported is always in the output
+        if path:
+            appending = resuming and os.path.exists(path)
+            with open(path, 'r+b' if appending else 'wb') as f:
+                if appending and options['gzip']:
+                    # Drops the chunk an interruption left half written
+                    f.truncate(complete_gzip_length(f))
+                f.seek(0, os.SEEK_END)
+                for data in chunks:
+                    f.write(data)
+                    f.flush()
+        else:
+            out = sys.stdout.buffer
+            for data in chunks:
+                out.write(data)
+                out.flush()
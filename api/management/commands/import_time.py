@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.conf import api_setting
+from api.warmup import STARTUP_CODE, measure_imports
+
+
+class Command(BaseCommand):
+    help = (
+        'Times the imports of a worker start (settings, apps and URLconf) in a fresh '
+        'interpreter, lists the slowest modules and fails over the startup budget'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--budget', type=float,
+                            help='Seconds the startup imports may take, STARTUP["IMPORT_BUDGET"] by default')
+        parser.add_argument('--top', type=int,
+                            help='Modules to list, STARTUP["IMPORT_BUDGET_TOP"] by default')
+        parser.add_argument('--sort', choices=['self', 'cumulative'], default='self',
+                            help='Rank modules by their own import time or including their imports')
+        parser.add_argument('--code', default=STARTUP_CODE, help='Python code whose imports to time')
+
+    def handle(self, *args, **options):
+        budget = options['budget']
+        if budget is None:
+            budget = api_setting('STARTUP', 'IMPORT_BUDGET')
+        top = options['top']
+        if top is None:
+            top = api_setting('STARTUP', 'IMPORT_BUDGET_TOP')
+
+        try:
+            imports = measure_imports(options['code'])
+        except RuntimeError as e:
+            raise CommandError(e)
+        total = sum(item.cumulative for item in imports if item.depth == 0)
+
+        self.stdout.write('%10s %10s  module' % ('self ms', 'total ms'))
+        for item in sorted(imports, key=lambda item: getattr(item, options['sort']), reverse=True)[:top]:
+            self.stdout.write('%10.1f %10.1f  %s' % (item.self * 1000, item.cumulative * 1000, item.module))
+
+        message = '%d modules imported in %.3fs, budget %.3fs' % (len(imports), total, budget)
+        if total > budget:
+            raise CommandError(message)
+        self.stdout.write(self.style.SUCCESS(message))
@@ -0,0 +1,66 @@
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.buffers import flush_buffers
+from api.imports import UserImporter
+
+
+class Command(BaseCommand):
+    help = (
+        'Imports students from a CSV file with an email and an optional password '
+        'column. Emails that already exist are skipped.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV file to import')
+        parser.add_argument('--otp-output',
+                            help='Generate one-time passwords for rows without a password '
+                                 'and write them to this CSV file; such rows are rejected otherwise')
+        parser.add_argument('--batch-size', type=int, help='Rows validated and written at a time')
+        parser.add_argument('--workers', type=int, help='Password hashing processes')
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] is not None and options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+
+        otp_file = on_password = None
+        if options['otp_output']:
+            otp_file = open(options['otp_output'], 'w', newline='')
+            otp_writer = csv.writer(otp_file)
+            otp_writer.writerow(['email', 'password'])
+
+            def on_password(email, password):
+                otp_writer.writerow([email, password])
+
+        def on_invalid(line, email, reason):
+            self.stderr.write('Line %d: skipped %r, %s' % (line, email, reason))
+
+        def progress(stats):
+            self.stdout.write('%d rows read, %d created, %d duplicates, %d invalid (%.0f rows/s)' % (
+                stats.rows, stats.created, stats.duplicates, stats.invalid, stats.rows_per_second))
+
+        importer = UserImporter(
+            batch_size=options['batch_size'],
+            workers=options['workers'],
+            using=options['database'],
+            on_password=on_password,
+            on_invalid=on_invalid,
+            progress=progress,
+        )
+        try:
+            with open(options['path'], newline='') as f:
+                stats = importer.run(f)
+        except (OSError, ValueError) as e:
+            raise CommandError(e)
+        finally:
+            if otp_file is not None:
+                otp_file.close()
+            # The user counts of the batches written
+            flush_buffers()
+
+        self.stdout.write(self.style.SUCCESS(
+            'Imported %d of %d rows in %.1fs (%.0f rows/s)' % (
+                stats.created, stats.rows, stats.elapsed, stats.rows_per_second)
+        ))
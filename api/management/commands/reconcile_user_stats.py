@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from api.user_stats import reconcile_user_stats
+
+
+class Command(BaseCommand):
+    help = (
+        'Recounts users by role, is_active and signup day and rewrites the user '
+        'statistics to match. Meant to run periodically, e.g. nightly from cron.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report the counts that are wrong')
+
+    def handle(self, *args, **options):
+        drift = reconcile_user_stats(dry_run=options['dry_run'])
+        for (dimension, key), (stored, actual) in sorted(drift.items()):
+            self.stdout.write('%s=%s: %d, counted %d' % (dimension, key, stored, actual))
+        if not drift:
+            message = 'User statistics are up to date'
+        elif options['dry_run']:
+            message = '%d user statistics are wrong' % len(drift)
+        else:
+            message = 'Corrected %d user statistics' % len(drift)
+        self.stdout.write(self.style.SUCCESS(message))
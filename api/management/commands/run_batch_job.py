@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.batch_jobs import JOBS
+from api.buffers import flush_buffers
+
+
+class Command(BaseCommand):
+    help = (
+        'Runs a batch job over the users in small id ranges, resuming an '
+        'interrupted run unless --restart is given'
+    )
+
+    def add_arguments(self, parser):
+        jobs = parser.add_subparsers(dest='job', required=True, metavar='job')
+        for name, job_class in sorted(JOBS.items()):
+            job_parser = jobs.add_parser(name, help=job_class.__doc__.strip().splitlines()[0])
+            job_parser.add_argument('--chunk-size', type=int, help='Ids per transaction')
+            job_parser.add_argument('--sleep', type=float, help='Seconds to wait between transactions')
+            job_parser.add_argument('--max-rows-per-second', type=float,
+                                    help='Slow down to change at most this many users a second')
+            job_parser.add_argument('--dry-run', action='store_true',
+                                    help='Only count the users that would change')
+            job_parser.add_argument('--restart', action='store_true',
+                                    help='Start over instead of resuming the last run')
+            job_class.add_arguments(job_parser)
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] is not None and options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be positive')
+
+        job_class = JOBS[options['job']]
+        job_options = {name: options[name] for name in job_class.options}
+        verb = 'would change' if options['dry_run'] else 'changed'
+
+        def progress(stats):
+            self.stdout.write('%.0f%% up to id %d: %d users %s (%.0f rows/s)' % (
+                stats.progress * 100, stats.last_id, stats.rows, verb, stats.rows_per_second))
+
+        job = job_class(
+            chunk_size=options['chunk_size'],
+            sleep=options['sleep'],
+            max_rows_per_second=options['max_rows_per_second'],
+            dry_run=options['dry_run'],
+            progress=progress,
+            **job_options
+        )
+        try:
+            stats = job.run(restart=options['restart'])
+        except ValueError as e:
+            raise CommandError(e)
+        finally:
+            # The user counts moved by the chunks done so far
+            flush_buffers()
+        self.stdout.write(self.style.SUCCESS(
+            '%s: %d users %s in %d chunks, %.1fs (%.0f rows/s)' % (
+                job.name, stats.rows, verb, stats.chunks, stats.elapsed, stats.rows_per_second)
+        ))
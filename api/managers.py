@@ -1,6 +1,28 @@
+import logging
+
 from django.contrib.auth.base_user import BaseUserManager
+from django.contrib.auth.hashers import make_password
+from django.db import IntegrityError, transaction
+from django.dispatch import Signal
 from django.utils.translation import gettext_lazy as _
 
+from .conf import api_setting
+from .passwords import hash_passwords, run_in_password_executor
+from .user_version import bump_users_version
+
+logger = logging.getLogger(__name__)
+
+# Bulk inserts of a batch before falling back to inserting its rows one by one
+BULK_INSERT_ATTEMPTS = 3
+
+# Sent with the ``users`` written in bulk, for which bulk_create and COPY send
+# no post_save
+users_bulk_created = Signal()
+
+# Sent with the ``users`` changed by a QuerySet.update() of ``update_fields``,
+# their attributes set to the new values
+users_bulk_updated = Signal()
+
 class CustomUserManager(BaseUserManager):
     """
     Manager class for creating users and superusers
@@ -18,10 +40,101 @@ class CustomUserManager(BaseUserManager):
         user.save()
         return user
 
+    async def acreate_user(self, email, password, **extra_fields):
+        """
+        Async counterpart of create_user, hashing the password off the event loop
+        """
+        if not email:
+            raise ValueError(_("The email field is required."))
+        if not password:
+            raise ValueError(_("The password field is required."))
+        email = self.normalize_email(email)
+
+        password = await run_in_password_executor(make_password, password)
+        return await self.acreate(email=email, password=password, **extra_fields)
+
     def create_superuser(self, email, password, **extra_fields):
         extra_fields.setdefault('is_active', True)
         extra_fields.setdefault('role', 1) # Super user default role is Admin
 
         if extra_fields.get('role') != 1:
             raise ValueError('Superuser must have role of Admin')
-        return self.create_user(email, password, **extra_fields)
\ No newline at end of file
+        return self.create_user(email, password, **extra_fields)
+
+    def bulk_create_users(self, users, batch_size=None, workers=None):
+        """
+        Creates many users at once from dicts of email, password and extra fields.
+        Passwords are hashed in a process pool and rows are written with
+        bulk_create in batches of ``batch_size``. Emails that already exist, or
+        repeat earlier in ``users``, are skipped. Returns the created users.
+        """
+        batch_size = batch_size or api_setting('BULK_REGISTRATION', 'BATCH_SIZE')
+
+        pending = {}
+        for fields in users:
+            fields = dict(fields)
+            email = fields.pop('email', None)
+            password = fields.pop('password', None)
+            if not email:
+                raise ValueError(_("The email field is required."))
+            if not password:
+                raise ValueError(_("The password field is required."))
+            pending.setdefault(self.normalize_email(email), (password, fields))
+
+        # One set-based uniqueness query per batch instead of one per user
+        emails = list(pending)
+        for start in range(0, len(emails), batch_size):
+            existing = self.filter(email__in=emails[start:start + batch_size])
+            for email in existing.values_list('email', flat=True):
+                pending.pop(email, None)
+
+        emails = list(pending)
+        hashes = hash_passwords((pending[email][0] for email in emails), workers=workers)
+        objs = []
+        for email, password in zip(emails, hashes):
+            user = self.model(email=email, **pending[email][1])
+            user.password = password
+            objs.append(user)
+
+        created = []
+        for start in range(0, len(objs), batch_size):
+            created.extend(self._bulk_insert(objs[start:start + batch_size]))
+        if created:
+            # bulk_create sends no post_save signals
+            bump_users_version()
+        return created
+
+    def _bulk_insert(self, batch):
+        """
+        Inserts ``batch``, dropping users whose email was taken meanwhile, and
+        returns the created ones. When the conflicts persist, or are not about
+        emails, the rows are inserted one by one and the failing ones skipped.
+        """
+        created = None
+        for _ in range(BULK_INSERT_ATTEMPTS):
+            try:
+                with transaction.atomic(using=self.db):
+                    created = self.bulk_create(batch)
+                break
+            except IntegrityError:
+                # Lost a race with a concurrent registration, drop the taken emails and retry
+                taken = set(self.filter(email__in=[user.email for user in batch])
+                            .values_list('email', flat=True))
+                if not taken:
+                    # Another constraint failed
+                    break
+                batch = [user for user in batch if user.email not in taken]
+        if created is None:
+            created = self._insert_each(batch)
+        users_bulk_created.send(sender=self.model, users=created, using=self.db)
+        return created
+
+    def _insert_each(self, batch):
+        created = []
+        for user in batch:
+            try:
+                with transaction.atomic(using=self.db):
+                    created.extend(self.bulk_create([user]))
+            except IntegrityError:
+                logger.warning('Could not create user %s', user.email, exc_info=True)
+        return created
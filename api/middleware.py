@@ -0,0 +1,116 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from .conf import api_setting
+from .profiling import end_profile, install_query_recorder, observe_latency, start_profile
+from .routers import end_request, start_request
+
+
+class RequestTimingMiddleware:
+    """
+    Profiles every request: query count and database time, time spent in
+    serializer validation and password hashing, and the total time.
+    The total is added to the latency histogram of the request's URL name
+    (see api.profiling). The numbers are sent back in a Server-Timing header
+    only when REQUEST_PROFILING['SERVER_TIMING'] is on, or left to None and
+    DEBUG is: they tell any client about the server's internals.
+    Should be the first middleware so the total covers the whole stack.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not api_setting('REQUEST_PROFILING', 'ENABLED'):
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+        connection_created.connect(install_query_recorder, dispatch_uid='api.profiling')
+        for connection in connections.all(initialized_only=True):
+            install_query_recorder(connection)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        profile, token = start_profile()
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            end_profile(token)
+        self.finish(request, response, profile, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        profile, token = start_profile()
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            end_profile(token)
+        self.finish(request, response, profile, time.perf_counter() - start)
+        return response
+
+    def finish(self, request, response, profile, total):
+        server_timing = api_setting('REQUEST_PROFILING', 'SERVER_TIMING')
+        if settings.DEBUG if server_timing is None else server_timing:
+            metrics = ['db;dur=%.2f;desc="%d queries"' % (profile.db_time * 1000, profile.queries)]
+            metrics.extend('%s;dur=%.2f' % (name, seconds * 1000)
+                           for name, seconds in profile.spans.items())
+            metrics.append('total;dur=%.2f' % (total * 1000))
+            response['Server-Timing'] = ', '.join(metrics)
+
+        match = request.resolver_match
+        if match is not None and match.url_name:
+            observe_latency(match.url_name, total * 1000)
+
+
+class ReplicaPinningMiddleware:
+    """
+    Keeps clients that have just written on the primary database.
+    A request that wrote sets a cookie lasting READ_REPLICAS['PIN_SECONDS'],
+    and requests carrying it read from the primary too (see api.routers).
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not api_setting('READ_REPLICAS', 'ALIASES'):
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state, token = start_request(self.cookie_name in request.COOKIES)
+        try:
+            response = self.get_response(request)
+        finally:
+            end_request(token)
+        return self.finish(response, state)
+
+    async def __acall__(self, request):
+        state, token = start_request(self.cookie_name in request.COOKIES)
+        try:
+            response = await self.get_response(request)
+        finally:
+            end_request(token)
+        return self.finish(response, state)
+
+    @property
+    def cookie_name(self):
+        return api_setting('READ_REPLICAS', 'PIN_COOKIE')
+
+    def finish(self, response, state):
+        if state.wrote:
+            response.set_cookie(self.cookie_name, '1', max_age=api_setting('READ_REPLICAS', 'PIN_SECONDS'),
+                                httponly=True, samesite='Lax')
+        return response
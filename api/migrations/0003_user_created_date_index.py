@@ -0,0 +1,17 @@
+# Generated by Django 5.0 on 2026-10-18 02:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_user_is_active'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['created_date', 'id'], name='api_user_created_id_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.0 on 2026-10-18 02:39
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_user_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuthAuditEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event', models.CharField(choices=[('login', 'Login'), ('login_failed', 'Failed login'), ('registration', 'Registration'), ('token_refresh', 'Token refresh')], max_length=16)),
+                ('user_id', models.BigIntegerField(blank=True, null=True)),
+                ('email', models.CharField(blank=True, max_length=254)),
+                ('ip', models.CharField(blank=True, max_length=64)),
+                ('created_date', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'authentication audit event',
+                'indexes': [models.Index(fields=['created_date', 'id'], name='api_audit_created_id_idx'), models.Index(fields=['user_id', 'created_date', 'id'], name='api_audit_user_created_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.0 on 2026-10-18 02:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_course_section_enrollment'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserStatistic',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dimension', models.CharField(max_length=16)),
+                ('key', models.CharField(max_length=32)),
+                ('count', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='userstatistic',
+            constraint=models.UniqueConstraint(fields=('dimension', 'key'), name='api_userstat_dimension_key_uniq'),
+        ),
+    ]
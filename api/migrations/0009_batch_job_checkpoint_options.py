@@ -0,0 +1,18 @@
+# Generated by Django 5.0 on 2026-10-18 04:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_batch_job_checkpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='batchjobcheckpoint',
+            name='options',
+            field=models.JSONField(default=dict),
+        ),
+    ]
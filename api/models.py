@@ -44,8 +44,185 @@ class User(AbstractBaseUser, PermissionsMixin):
         Represents instance of User model
         """
         return self.email
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # What the user is counted under in UserStatistic, to move the counts when it changes
+        if all(name in instance.__dict__ for name in UserStatistic.USER_FIELDS):
+            instance._counted_as = UserStatistic.keys_for(instance)
+        return instance
   
     
     class Meta:
         verbose_name = 'user'
-        verbose_name_plural = 'users'
\ No newline at end of file
+        verbose_name_plural = 'users'
+        indexes = [
+            # Backs keyset pagination of the user list
+            models.Index(fields=['created_date', 'id'], name='api_user_created_id_idx'),
+            # Users list filters, each in the list's (created_date, id) order
+            models.Index(fields=['role', 'created_date', 'id'], name='api_user_role_created_idx'),
+            models.Index(fields=['is_active', 'created_date', 'id'], name='api_user_active_created_idx'),
+            # Inactive accounts are few, a partial index keeps looking them up cheap
+            models.Index(fields=['created_date', 'id'], condition=models.Q(is_active=False),
+                         name='api_user_inactive_idx'),
+            # Email prefix search; the operator class only applies on PostgreSQL,
+            # where LIKE 'prefix%' cannot use the default collation's unique index
+            models.Index(fields=['email'], opclasses=['varchar_pattern_ops'],
+                         name='api_user_email_prefix_idx'),
+        ]
+
+
+class AuthAuditEvent(models.Model):
+    """
+    One authentication event. Written in batches by api.audit.AuditLog.
+    The user is kept as a plain id rather than a foreign key so the log
+    outlives deleted users and a batch never fails on one of them.
+    """
+    LOGIN = 'login'
+    LOGIN_FAILED = 'login_failed'
+    REGISTRATION = 'registration'
+    TOKEN_REFRESH = 'token_refresh'
+
+    EVENT_CHOICES = (
+        (LOGIN, 'Login'),
+        (LOGIN_FAILED, 'Failed login'),
+        (REGISTRATION, 'Registration'),
+        (TOKEN_REFRESH, 'Token refresh'),
+    )
+
+    event = models.CharField(max_length=16, choices=EVENT_CHOICES)
+    user_id = models.BigIntegerField(blank=True, null=True)
+    # The email that was tried, kept for failed logins of unknown users
+    email = models.CharField(max_length=254, blank=True)
+    ip = models.CharField(max_length=64, blank=True)
+    created_date = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return '%s %s' % (self.event, self.email or self.user_id)
+
+    class Meta:
+        verbose_name = 'authentication audit event'
+        indexes = [
+            # Keyset pagination of the log, optionally per user
+            models.Index(fields=['created_date', 'id'], name='api_audit_created_id_idx'),
+            models.Index(fields=['user_id', 'created_date', 'id'], name='api_audit_user_created_idx'),
+        ]
+
+
+class Course(models.Model):
+    """
+    A course of the catalogue, taught in one or more sections
+    """
+    code = models.CharField(max_length=16, unique=True)
+    title = models.CharField(max_length=200)
+    credits = models.PositiveSmallIntegerField(default=3)
+    created_date = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return self.code
+
+
+class Section(models.Model):
+    """
+    One weekly meeting pattern of a course: the same hours on every day set
+    in ``days``, in one room
+    """
+    # Bits of ``days``, Monday first
+    DAYS = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='sections')
+    code = models.CharField(max_length=16)
+    room = models.CharField(max_length=32, blank=True)
+    days = models.PositiveSmallIntegerField()
+    start_time = models.TimeField()
+    end_time = models.TimeField()
+    capacity = models.PositiveIntegerField(default=30)
+    created_date = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return '%s-%s' % (self.course_id, self.code)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['course', 'code'], name='api_section_course_code_uniq'),
+        ]
+        indexes = [
+            # Loads a room's timetable for conflict checks
+            models.Index(fields=['room'], name='api_section_room_idx'),
+        ]
+
+
+class Enrollment(models.Model):
+    """
+    A student taking a section
+    """
+    student = models.ForeignKey(User, on_delete=models.CASCADE, related_name='enrollments')
+    section = models.ForeignKey(Section, on_delete=models.CASCADE, related_name='enrollments')
+    created_date = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return '%s in %s' % (self.student_id, self.section_id)
+
+    class Meta:
+        constraints = [
+            # Also serves loading a student's timetable
+            models.UniqueConstraint(fields=['student', 'section'], name='api_enrollment_student_section_uniq'),
+        ]
+
+
+class UserStatistic(models.Model):
+    """
+    Number of users per role, per is_active and per signup day, kept current
+    by api.user_stats so dashboards never count the user table
+    """
+    ROLE = 'role'
+    IS_ACTIVE = 'is_active'
+    SIGNUP_DAY = 'signup_day'
+
+    # User fields the counts depend on
+    USER_FIELDS = ('role', 'is_active', 'created_date')
+
+    dimension = models.CharField(max_length=16)
+    # Role value ('' for none), 'true'/'false', or an ISO date
+    key = models.CharField(max_length=32)
+    count = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return '%s=%s: %d' % (self.dimension, self.key, self.count)
+
+    @classmethod
+    def keys_for(cls, user):
+        """
+        The (dimension, key) pairs ``user`` is counted under
+        """
+        return (
+            (cls.ROLE, '' if user.role is None else str(user.role)),
+            (cls.IS_ACTIVE, 'true' if user.is_active else 'false'),
+            (cls.SIGNUP_DAY, timezone.localdate(user.created_date).isoformat()),
+        )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['dimension', 'key'], name='api_userstat_dimension_key_uniq'),
+        ]
+
+
+class BatchJobCheckpoint(models.Model):
+    """
+    Progress of a batch job (api.batch_jobs), for resuming it where it stopped
+    """
+    name = models.CharField(max_length=64, unique=True)
+    # Every user up to this id has been processed
+    last_id = models.BigIntegerField(default=0)
+    # Highest user id when the run started, where it stops
+    end_id = models.BigIntegerField(default=0)
+    rows_updated = models.BigIntegerField(default=0)
+    # The job's own options the run was started with, a resumed run must match
+    options = models.JSONField(default=dict)
+    started_date = models.DateTimeField(default=timezone.now)
+    updated_date = models.DateTimeField(default=timezone.now)
+    finished_date = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return '%s at %d' % (self.name, self.last_id)
@@ -0,0 +1,132 @@
+import base64
+import binascii
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+class InvalidCursor(Exception):
+    """
+    Raised when a client sends a cursor we did not issue
+    """
+
+
+def encode_cursor(created_date, pk):
+    """
+    Builds an opaque cursor pointing just after the given (created_date, id) key
+    """
+    payload = json.dumps([created_date.isoformat(), pk], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Reverses encode_cursor, raising InvalidCursor for anything malformed
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_date, pk = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        created_date = parse_datetime(created_date)
+    except (binascii.Error, ValueError, TypeError, UnicodeDecodeError):
+        raise InvalidCursor(cursor)
+    if created_date is None or not isinstance(pk, int):
+        raise InvalidCursor(cursor)
+    return created_date, pk
+
+
+class KeysetPaginator:
+    """
+    Keyset (seek) pagination over (created_date, id).
+
+    Unlike OFFSET pagination every page costs the same no matter how deep the
+    client is, and rows inserted while paging never shift or duplicate results.
+    """
+    ordering = ('created_date', 'id')
+
+    def __init__(self, page_size, max_page_size):
+        self.page_size = page_size
+        self.max_page_size = max_page_size
+
+    def get_limit(self, value):
+        if value in (None, ''):
+            return self.page_size
+        try:
+            limit = int(value)
+        except (TypeError, ValueError):
+            return self.page_size
+        return max(1, min(limit, self.max_page_size))
+
+    def seek(self, queryset, cursor):
+        queryset = queryset.order_by(*self.ordering)
+        if not cursor:
+            return queryset
+        created_date, pk = decode_cursor(cursor)
+        return queryset.filter(
+            Q(created_date__gt=created_date) | Q(created_date=created_date, id__gt=pk)
+        )
+
+    def cursor_for(self, row):
+        return encode_cursor(row.created_date, row.pk)
+
+    def paginate(self, queryset, cursor, limit):
+        """
+        Returns the rows of one page and the cursor of the next one (or None)
+        """
+        rows = list(self.seek(queryset, cursor)[:limit + 1])
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = self.cursor_for(rows[-1])
+        return rows, next_cursor
+
+    def paginate_values(self, queryset, cursor, limit, fields):
+        """
+        Like paginate, returning ``values_list(*fields)`` tuples that have the
+        ordering columns appended
+        """
+        queryset = self.seek(queryset, cursor).values_list(*fields, *self.ordering)
+        rows = list(queryset[:limit + 1])
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(*rows[-1][-len(self.ordering):])
+        return rows, next_cursor
+
+
+class JSONEnvelopeStream:
+    """
+    Encodes a JSON document equal to ``envelope`` with ``key`` holding a list
+    whose items are produced chunk by chunk, without holding them all in memory.
+    Emit ``head``, then ``encode_chunk()`` for every chunk, then ``tail``.
+    """
+
+    def __init__(self, envelope, key):
+        self.encoder = DjangoJSONEncoder(separators=(',', ':'), ensure_ascii=False)
+        document = self.encoder.encode(dict(envelope, **{key: []}))
+        # The empty list is the last member, so split the document around it
+        self.head = document[:-2]
+        self.tail = document[-2:]
+        self._first = True
+
+    def encode_chunk(self, chunk):
+        if not chunk:
+            return ''
+        body = self.encoder.encode(chunk)[1:-1]
+        if self._first:
+            self._first = False
+            return body
+        return ',' + body
+
+
+def stream_json_envelope(envelope, key, chunks):
+    """
+    Yields the document of a JSONEnvelopeStream for an iterable of chunks
+    """
+    stream = JSONEnvelopeStream(envelope, key)
+    yield stream.head
+    for chunk in chunks:
+        if chunk:
+            yield stream.encode_chunk(chunk)
+    yield stream.tail
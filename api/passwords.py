@@ -0,0 +1,134 @@
+import asyncio
+import atexit
+import contextvars
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import django
+from django.apps import apps
+from django.contrib.auth.hashers import make_password
+from django.db import close_old_connections
+
+from .conf import api_setting
+
+
+def _init_worker():
+    """
+    Makes sure Django is configured in pool workers started with spawn
+    """
+    if not apps.ready:
+        django.setup()
+
+
+def hash_passwords(passwords, workers=None):
+    """
+    Hashes ``passwords`` with the configured hasher, spreading the work over a
+    process pool since PBKDF2 is pure CPU and holds the GIL.
+    Small inputs are hashed inline, where the pool would cost more than it saves.
+    """
+    passwords = list(passwords)
+    if workers is None:
+        workers = api_setting('PASSWORD_HASHING', 'WORKERS') or os.cpu_count() or 1
+    if workers <= 1 or len(passwords) < api_setting('PASSWORD_HASHING', 'MIN_POOL_BATCH'):
+        return [make_password(password) for password in passwords]
+
+    chunksize = max(1, len(passwords) // (workers * 4))
+    pool = get_hash_pool(workers)
+    try:
+        return list(pool.map(make_password, passwords, chunksize=chunksize))
+    except BrokenProcessPool:
+        # A worker died, the next call starts a new pool
+        _drop_hash_pool(workers, pool)
+        raise
+
+
+# Process pools by number of workers, and the process they belong to
+_hash_pools = {}
+_hash_pools_pid = None
+_hash_pools_lock = threading.Lock()
+
+
+def get_hash_pool(workers):
+    """
+    Pool of ``workers`` hashing processes, started on first use and kept for
+    the life of this process, so their startup (each runs django.setup()) is
+    paid once. Workers are spawned, not forked: the pool is started from
+    request threads of threaded servers, and a fork copies whatever locks
+    the other threads hold at that moment.
+    """
+    global _hash_pools, _hash_pools_pid
+    with _hash_pools_lock:
+        if _hash_pools_pid != os.getpid():
+            # A forked child cannot use its parent's pools
+            _hash_pools = {}
+            _hash_pools_pid = os.getpid()
+        pool = _hash_pools.get(workers)
+        if pool is None:
+            pool = _hash_pools[workers] = ProcessPoolExecutor(
+                max_workers=workers, initializer=_init_worker,
+                mp_context=multiprocessing.get_context('spawn'))
+    return pool
+
+
+def _drop_hash_pool(workers, pool):
+    with _hash_pools_lock:
+        if _hash_pools.get(workers) is pool:
+            del _hash_pools[workers]
+    pool.shutdown(wait=False)
+
+
+@atexit.register
+def shutdown_hash_pools():
+    """
+    Stops the hashing processes of this process
+    """
+    with _hash_pools_lock:
+        if _hash_pools_pid != os.getpid():
+            return
+        pools = list(_hash_pools.values())
+        _hash_pools.clear()
+    for pool in pools:
+        pool.shutdown(cancel_futures=True)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_password_executor():
+    """
+    Bounded thread pool for password hashing and checking off the event loop.
+    Its size caps how many hashes run at once, keeping login throughput CPU-bound
+    no matter how many connections are waiting.
+    """
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=api_setting('PASSWORD_HASHING', 'THREADS') or os.cpu_count() or 1,
+                    thread_name_prefix='password-hashing',
+                )
+    return _executor
+
+
+def _run_with_connections_closed(func, *args):
+    # Work like serializer.is_valid() queries the database, and nothing else
+    # closes the connections of pool threads: they would be kept forever,
+    # pinning pooled connections and outliving database restarts
+    close_old_connections()
+    try:
+        return func(*args)
+    finally:
+        close_old_connections()
+
+
+async def run_in_password_executor(func, *args):
+    loop = asyncio.get_running_loop()
+    # Carry the context over so the request's profile sees the work
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(get_password_executor(), context.run,
+                                      _run_with_connections_closed, func, *args)
@@ -0,0 +1,111 @@
+"""
+Per-process snapshots of user permissions.
+
+PermissionsMixin resolves permissions through ModelBackend, which joins
+user_permissions and groups on every new User instance. Since every request
+authenticates a new instance, that is every request. A snapshot is computed
+once per user and kept until a signal (see api.signals) says the user's
+groups, permissions, group permissions or flags changed. Those signals only
+reach the current process, so snapshots also expire after
+PERMISSION_CACHE['LOCAL_TTL'] seconds.
+"""
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import Permission
+
+from .conf import api_setting
+
+
+class PermissionSnapshot(namedtuple('PermissionSnapshot', (
+        'is_active', 'is_superuser', 'user_permissions', 'group_permissions'))):
+    __slots__ = ()
+
+    def has_perm(self, perm):
+        return self.is_active and (perm in self.user_permissions or perm in self.group_permissions)
+
+    def has_perms(self, perms):
+        return all(self.has_perm(perm) for perm in perms)
+
+
+def _names(permissions):
+    return frozenset('%s.%s' % row for row in
+                     permissions.values_list('content_type__app_label', 'codename').order_by())
+
+
+def compute_snapshot(user):
+    """
+    Loads the permissions of ``user`` like ModelBackend, in two queries
+    """
+    if user.is_superuser:
+        user_permissions = group_permissions = _names(Permission.objects.all())
+    else:
+        user_permissions = _names(Permission.objects.filter(user=user.pk))
+        group_permissions = _names(Permission.objects.filter(group__user=user.pk))
+    return PermissionSnapshot(user.is_active, user.is_superuser, user_permissions, group_permissions)
+
+
+class PermissionCache:
+    """
+    Bounded LRU of permission snapshots by user id
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def peek(self, user):
+        """
+        Returns the cached snapshot of ``user``, or None
+        """
+        with self._lock:
+            entry = self._entries.get(user.pk)
+            if entry is None:
+                return None
+            snapshot, expires = entry
+            # A user loaded after the snapshot was taken knows better
+            if (expires <= time.monotonic() or snapshot.is_active != user.is_active
+                    or snapshot.is_superuser != user.is_superuser):
+                del self._entries[user.pk]
+                return None
+            self._entries.move_to_end(user.pk)
+            return snapshot
+
+    def get(self, user):
+        snapshot = self.peek(user)
+        if snapshot is None:
+            snapshot = compute_snapshot(user)
+            expires = time.monotonic() + api_setting('PERMISSION_CACHE', 'LOCAL_TTL')
+            max_entries = api_setting('PERMISSION_CACHE', 'MAX_ENTRIES')
+            with self._lock:
+                self._entries[user.pk] = (snapshot, expires)
+                self._entries.move_to_end(user.pk)
+                while len(self._entries) > max_entries:
+                    self._entries.popitem(last=False)
+        return snapshot
+
+    def invalidate(self, pk):
+        with self._lock:
+            self._entries.pop(pk, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+permission_cache = PermissionCache()
+
+
+class SnapshotModelBackend(ModelBackend):
+    """
+    ModelBackend answering has_perm() and get_all_permissions() from
+    permission_cache
+    """
+
+    def _get_permissions(self, user_obj, obj, from_name):
+        if not user_obj.is_active or user_obj.is_anonymous or obj is not None:
+            return set()
+        snapshot = permission_cache.get(user_obj)
+        return set(getattr(snapshot, '%s_permissions' % from_name))
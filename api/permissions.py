@@ -0,0 +1,52 @@
+from asgiref.sync import sync_to_async
+from rest_framework.permissions import BasePermission
+
+from .models import User
+from .permission_cache import permission_cache
+
+
+class HasRoleOrPermission(BasePermission):
+    """
+    Allows access to authenticated users with one of ``roles``, or holding
+    every permission in ``permissions`` (superusers hold them all).
+    Permissions come from the user's cached snapshot, so once it is warm the
+    check costs no queries.
+    """
+    roles = ()
+    permissions = ()
+    message = 'You are not authorized to perform this action'
+
+    def has_permission(self, request, view):
+        user = request.user
+        return bool(user and user.is_authenticated and self.allows(user))
+
+    def allows(self, user):
+        if user.role in self.roles:
+            return True
+        return bool(self.permissions) and permission_cache.get(user).has_perms(self.permissions)
+
+    async def aallows(self, user):
+        """
+        Async counterpart of allows, leaving the event loop only for a cold snapshot
+        """
+        if user.role in self.roles:
+            return True
+        if not self.permissions:
+            return False
+        snapshot = permission_cache.peek(user) or await sync_to_async(permission_cache.get)(user)
+        return snapshot.has_perms(self.permissions)
+
+
+class IsAdminRole(HasRoleOrPermission):
+    """
+    Allows access only to authenticated users with the Admin role
+    """
+    roles = (User.ADMIN, )
+
+
+class CanViewUsers(HasRoleOrPermission):
+    """
+    Allows admins, and other users granted the api.view_user permission
+    """
+    roles = (User.ADMIN, )
+    permissions = ('api.view_user', )
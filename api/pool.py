@@ -0,0 +1,279 @@
+"""
+A thread-safe pool of DB-API connections.
+
+Used by the api.db.backends.pooled_postgresql engine, which checks a
+connection out where Django would open one and returns it where Django would
+close it. The pool only needs a ``connect`` callable, so tests can run it on
+in-process stand-ins instead of PostgreSQL.
+"""
+import collections
+import logging
+import os
+import threading
+import time
+
+from .profiling import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(Exception):
+    """
+    Raised when no connection could be checked out in time
+    """
+
+
+class ConnectionPool:
+    """
+    Keeps between ``min_size`` and ``max_size`` connections made by
+    ``connect()``. A checkout takes the most recently used idle connection,
+    checked with ``health_check(connection)`` (which returns False or raises
+    for dead connections), opens a new one below ``max_size``, or waits up to
+    ``timeout`` seconds for one to be returned. Idle connections beyond
+    ``min_size`` are closed after ``max_idle`` seconds.
+    """
+
+    def __init__(self, connect, min_size=0, max_size=10, timeout=30.0, max_idle=600.0,
+                 health_check=None):
+        if max_size < 1 or not 0 <= min_size <= max_size:
+            raise ValueError('Pool sizes must satisfy 0 <= min_size <= max_size and max_size >= 1')
+        self.connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.health_check = health_check
+        # Connections are only usable in the process that opened them
+        self.pid = os.getpid()
+
+        # (connection, returned at) pairs, most recently returned last
+        self._idle = collections.deque()
+        self._size = 0
+        self._in_use = 0
+        self._closed = False
+        self._condition = threading.Condition()
+
+        self.checkouts = 0
+        self.timeouts = 0
+        self.health_check_failures = 0
+        self.evictions = 0
+        self.max_in_use = 0
+        self.wait_time = LatencyHistogram()
+        self.checkout_latency = LatencyHistogram()
+
+    def getconn(self):
+        start = time.perf_counter()
+        waited = 0.0
+        deadline = time.monotonic() + self.timeout
+        while True:
+            with self._condition:
+                if self._closed:
+                    raise PoolTimeout('The pool is closed')
+                evicted = self._evict_idle()
+                if self._idle:
+                    connection, _ = self._idle.pop()
+                    reserved = False
+                elif self._size < self.max_size:
+                    # Reserve the slot, connecting happens outside the lock
+                    self._size += 1
+                    connection = None
+                    reserved = True
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        raise PoolTimeout('No connection available within %ss' % self.timeout)
+                    wait_start = time.perf_counter()
+                    self._condition.wait(remaining)
+                    waited += time.perf_counter() - wait_start
+                    continue
+            for stale in evicted:
+                self._close_quietly(stale)
+
+            if reserved:
+                try:
+                    connection = self.connect()
+                except BaseException:
+                    with self._condition:
+                        self._size -= 1
+                        self._condition.notify()
+                    raise
+            elif not self._check(connection):
+                self._discard(connection)
+                continue
+
+            with self._condition:
+                self._in_use += 1
+                self.max_in_use = max(self.max_in_use, self._in_use)
+                self.checkouts += 1
+            self.wait_time.observe(waited * 1000)
+            self.checkout_latency.observe((time.perf_counter() - start) * 1000)
+            return connection
+
+    def putconn(self, connection, discard=False):
+        """
+        Returns a checked out connection; ``discard`` closes it instead
+        """
+        with self._condition:
+            self._in_use -= 1
+            if not (discard or self._closed):
+                self._idle.append((connection, time.monotonic()))
+                self._condition.notify()
+                return
+        self._discard(connection)
+
+    def fill(self):
+        """
+        Opens connections up to ``min_size``
+        """
+        while True:
+            with self._condition:
+                if self._closed or self._size >= self.min_size:
+                    return
+                self._size += 1
+            try:
+                connection = self.connect()
+            except BaseException:
+                with self._condition:
+                    self._size -= 1
+                raise
+            with self._condition:
+                self._idle.appendleft((connection, time.monotonic()))
+                self._condition.notify()
+
+    def close(self):
+        """
+        Closes the idle connections; checked out ones are closed when returned
+        """
+        with self._condition:
+            self._closed = True
+            idle = [connection for connection, _ in self._idle]
+            self._idle.clear()
+            self._size -= len(idle)
+            self._condition.notify_all()
+        for connection in idle:
+            self._close_quietly(connection)
+
+    def _check(self, connection):
+        if self.health_check is None:
+            return True
+        try:
+            healthy = self.health_check(connection)
+        except Exception:
+            healthy = False
+        if not healthy:
+            with self._condition:
+                self.health_check_failures += 1
+        return healthy
+
+    def _evict_idle(self):
+        # Called with the lock held, returns the connections to close after
+        # releasing it. The oldest idle connections are first.
+        now = time.monotonic()
+        evicted = []
+        while (self._idle and self._size - len(evicted) > self.min_size
+               and now - self._idle[0][1] > self.max_idle):
+            evicted.append(self._idle.popleft()[0])
+        self._size -= len(evicted)
+        self.evictions += len(evicted)
+        return evicted
+
+    def _discard(self, connection):
+        with self._condition:
+            self._size -= 1
+            self._condition.notify()
+        self._close_quietly(connection)
+
+    def _close_quietly(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            logger.debug('Error closing a pooled connection', exc_info=True)
+
+    def stats(self):
+        with self._condition:
+            counters = {
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._in_use,
+                'max_in_use': self.max_in_use,
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'health_check_failures': self.health_check_failures,
+                'evictions': self.evictions,
+            }
+        counters['wait_time'] = self.wait_time.stats()
+        counters['checkout_latency'] = self.checkout_latency.stats()
+        return counters
+
+
+# Pools of the pooled database backends, keyed by "alias:database", and the
+# process they belong to
+_pools = {}
+_pools_pid = os.getpid()
+_pools_lock = threading.Lock()
+
+# Pools and connections a forked child inherited. Their sockets are the
+# parent's: closing them, even by garbage collection, would end the parent's
+# sessions, so the child keeps them referenced and never uses them.
+_inherited = []
+
+
+def _forget_inherited_pools():
+    global _pools, _pools_pid, _pools_lock
+    if _pools:
+        _inherited.append(_pools)
+    _pools = {}
+    _pools_pid = os.getpid()
+    _pools_lock = threading.Lock()
+
+
+def _check_pid():
+    # Also catches forks the at-fork hook below did not see
+    if _pools_pid != os.getpid():
+        _forget_inherited_pools()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_inherited_pools)
+
+
+def abandon(connection):
+    """
+    Drops a connection opened before a fork without closing it
+    """
+    _inherited.append(connection)
+
+
+def get_pool(key, factory):
+    """
+    Returns the pool registered under ``key``, made with ``factory()`` the
+    first time in this process
+    """
+    _check_pid()
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = _pools[key] = factory()
+    return pool
+
+
+def pool_stats():
+    _check_pid()
+    return {alias: pool.stats() for alias, pool in list(_pools.items())}
+
+
+def close_pools(alias=None):
+    """
+    Closes and forgets the pools of database ``alias``, or all of them
+    """
+    _check_pid()
+    with _pools_lock:
+        keys = [key for key in _pools if alias is None or key.split(':', 1)[0] == alias]
+        pools = [_pools.pop(key) for key in keys]
+    for pool in pools:
+        pool.close()
@@ -0,0 +1,148 @@
+"""
+Lightweight per-request profiling.
+
+RequestTimingMiddleware opens a RequestProfile for every request. Code on the
+request path adds time to it with span(), and SQL is counted by record_query,
+which install_query_recorder adds to the execute wrappers of every connection.
+Outside of a request all of these cost one context variable lookup.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+_current_profile = ContextVar('request_profile', default=None)
+
+
+class RequestProfile:
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.spans = {}
+
+    def add(self, name, seconds):
+        self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+
+def current_profile():
+    return _current_profile.get()
+
+
+def start_profile():
+    """
+    Starts profiling the current context, returns the profile and a reset token
+    """
+    profile = RequestProfile()
+    return profile, _current_profile.set(profile)
+
+
+def end_profile(token):
+    _current_profile.reset(token)
+
+
+@contextmanager
+def span(name):
+    """
+    Adds the time spent in the block to the current request's ``name`` span
+    """
+    profile = _current_profile.get()
+    if profile is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add(name, time.perf_counter() - start)
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    Database execute wrapper counting queries and their time
+    """
+    profile = _current_profile.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        profile.queries += 1
+        profile.db_time += time.perf_counter() - start
+
+
+def install_query_recorder(connection, **kwargs):
+    """
+    Adds record_query to a connection, usable as a connection_created receiver
+    """
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class LatencyHistogram:
+    """
+    Fixed-bucket latency histogram. Percentiles are reported as the upper
+    bound of the bucket they fall in, which is plenty for spotting regressions.
+    """
+    # Bucket upper bounds in milliseconds, the last bucket is unbounded
+    bounds = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, milliseconds):
+        index = bisect.bisect_left(self.bounds, milliseconds)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total += milliseconds
+
+    def percentile(self, fraction):
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return self.bounds[index] if index < len(self.bounds) else float('inf')
+
+    def stats(self):
+        with self._lock:
+            return {
+                'count': self.count,
+                'mean_ms': self.total / self.count if self.count else None,
+                'p50_ms': self.percentile(0.5),
+                'p95_ms': self.percentile(0.95),
+                'p99_ms': self.percentile(0.99),
+                'buckets': dict(zip([str(bound) for bound in self.bounds] + ['inf'], self.counts)),
+            }
+
+
+_histograms = {}
+_histograms_lock = threading.Lock()
+
+
+def observe_latency(url_name, milliseconds):
+    histogram = _histograms.get(url_name)
+    if histogram is None:
+        with _histograms_lock:
+            histogram = _histograms.setdefault(url_name, LatencyHistogram())
+    histogram.observe(milliseconds)
+
+
+def latency_stats():
+    """
+    Latency statistics per URL name
+    """
+    return {url_name: histogram.stats() for url_name, histogram in list(_histograms.items())}
+
+
+def reset_latency_stats():
+    with _histograms_lock:
+        _histograms.clear()
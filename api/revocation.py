@@ -0,0 +1,238 @@
+import hashlib
+import math
+import threading
+import time
+
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+from .conf import api_setting
+
+
+class BloomFilter:
+    """
+    Fixed-size Bloom filter over strings. Membership tests never give false
+    negatives and give false positives at roughly ``error_rate`` while no more
+    than ``capacity`` items have been added.
+    """
+
+    def __init__(self, capacity, error_rate):
+        capacity = max(1, capacity)
+        self.size = max(8, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.hashes = max(1, int(round(self.size / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7))
+                   for position in self._positions(item))
+
+
+class InMemoryRevocationStore:
+    """
+    Revoked token ids held in this process only, for tests and single-process setups
+    """
+
+    def __init__(self):
+        self._tokens = {}
+        self._log = {}
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    def add(self, jti, exp):
+        with self._lock:
+            if self.contains(jti):
+                return False
+            self._tokens[jti] = exp
+            self._sequence += 1
+            self._log[self._sequence] = (jti, exp)
+        return True
+
+    def contains(self, jti):
+        exp = self._tokens.get(jti)
+        return exp is not None and exp > time.time()
+
+    def position(self):
+        return self._sequence
+
+    def changes_since(self, position):
+        """
+        Returns the current position and the ids revoked after ``position``,
+        or None when the store cannot tell and callers must rebuild
+        """
+        with self._lock:
+            current = self._sequence
+            if current < position:
+                return None
+            return current, [self._log[seq][0] for seq in range(position + 1, current + 1)
+                             if seq in self._log]
+
+    def items(self):
+        now = time.time()
+        with self._lock:
+            return [(jti, exp) for jti, exp in self._tokens.items() if exp > now]
+
+    def compact(self):
+        now = time.time()
+        with self._lock:
+            expired = [jti for jti, exp in self._tokens.items() if exp <= now]
+            for jti in expired:
+                del self._tokens[jti]
+            self._log = {seq: entry for seq, entry in self._log.items() if entry[1] > now}
+        return len(expired)
+
+
+class CacheRevocationStore:
+    """
+    Revoked token ids kept in a shared Django cache, each entry expiring with
+    its token. A sequence counter and an append-only log of revocations let
+    every process catch its Bloom filter up with one counter read.
+    """
+    # Log entries fetched per get_many call
+    read_chunk = 1000
+
+    def __init__(self, cache='default', prefix='revoked-tokens'):
+        self.cache = caches[cache]
+        self.prefix = prefix
+
+    def _token_key(self, jti):
+        return '%s:jti:%s' % (self.prefix, jti)
+
+    def _log_key(self, seq):
+        return '%s:log:%d' % (self.prefix, seq)
+
+    @property
+    def _sequence_key(self):
+        return '%s:seq' % self.prefix
+
+    def add(self, jti, exp):
+        ttl = max(1, int(math.ceil(exp - time.time())))
+        # Atomic, of concurrent revocations of the same token only one wins
+        if not self.cache.add(self._token_key(jti), exp, ttl):
+            return False
+        self.cache.add(self._sequence_key, 0, None)
+        seq = self.cache.incr(self._sequence_key)
+        self.cache.set(self._log_key(seq), (jti, exp), ttl)
+        return True
+
+    def contains(self, jti):
+        return self.cache.get(self._token_key(jti)) is not None
+
+    def position(self):
+        return self.cache.get(self._sequence_key, 0)
+
+    def _read_log(self, start, end):
+        for chunk_start in range(start, end + 1, self.read_chunk):
+            keys = [self._log_key(seq)
+                    for seq in range(chunk_start, min(end, chunk_start + self.read_chunk - 1) + 1)]
+            yield from self.cache.get_many(keys).values()
+
+    def changes_since(self, position):
+        current = self.position()
+        if current < position:
+            # The counter was evicted or the cache restarted
+            return None
+        return current, [jti for jti, exp in self._read_log(position + 1, current)]
+
+    def items(self):
+        now = time.time()
+        return [(jti, exp) for jti, exp in self._read_log(1, self.position()) if exp > now]
+
+    def compact(self):
+        # Cache entries expire together with their tokens
+        return 0
+
+
+class RevocationRegistry:
+    """
+    Answers whether a refresh token id has been revoked.
+
+    A local Bloom filter sits in front of the configured store so the common
+    case, a token that was never revoked, needs no store round-trip.
+    Revocations made by other processes reach the filter within
+    TOKEN_REVOCATION['SYNC_INTERVAL'] seconds.
+    """
+
+    def __init__(self, store=None):
+        self._store = store
+        self._bloom = None
+        self._position = 0
+        self._synced_at = None
+        self._lock = threading.RLock()
+
+    @property
+    def store(self):
+        if self._store is None:
+            store_class = import_string(api_setting('TOKEN_REVOCATION', 'STORE'))
+            self._store = store_class(**api_setting('TOKEN_REVOCATION', 'OPTIONS'))
+        return self._store
+
+    def rebuild(self):
+        """
+        Recreates the Bloom filter from the live entries of the store
+        """
+        with self._lock:
+            position = self.store.position()
+            items = self.store.items()
+            capacity = max(api_setting('TOKEN_REVOCATION', 'BLOOM_CAPACITY'), 2 * len(items))
+            bloom = BloomFilter(capacity, api_setting('TOKEN_REVOCATION', 'BLOOM_ERROR_RATE'))
+            for jti, exp in items:
+                bloom.add(jti)
+            self._bloom = bloom
+            self._position = position
+            self._synced_at = time.monotonic()
+
+    def sync(self):
+        with self._lock:
+            if self._bloom is None:
+                return self.rebuild()
+            changes = self.store.changes_since(self._position)
+            if changes is None:
+                return self.rebuild()
+            self._position, revoked = changes
+            for jti in revoked:
+                self._bloom.add(jti)
+            self._synced_at = time.monotonic()
+
+    def _sync_if_due(self):
+        interval = api_setting('TOKEN_REVOCATION', 'SYNC_INTERVAL')
+        if self._bloom is None or time.monotonic() - self._synced_at >= interval:
+            self.sync()
+
+    def revoke(self, jti, exp):
+        """
+        Revokes a token id, returns False when it was already revoked, by this
+        or a concurrent request
+        """
+        self._sync_if_due()
+        revoked = self.store.add(jti, exp)
+        with self._lock:
+            self._bloom.add(jti)
+        return revoked
+
+    def is_revoked(self, jti):
+        self._sync_if_due()
+        if jti not in self._bloom:
+            return False
+        return self.store.contains(jti)
+
+    def compact(self):
+        """
+        Drops revoked tokens past their expiry and shrinks the filter to the
+        remaining ones. Returns the number of entries removed from the store.
+        """
+        removed = self.store.compact()
+        self.rebuild()
+        return removed
+
+
+revocation_registry = RevocationRegistry()
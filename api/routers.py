@@ -0,0 +1,89 @@
+"""
+Primary/replica database routing.
+
+Writes always go to the primary ('default'). Reads go to one of the
+READ_REPLICAS['ALIASES'] databases, unless the current context has written
+within the last PIN_SECONDS, or is inside a transaction on the primary, so a
+client always reads its own writes. ReplicaPinningMiddleware carries the pin
+over to the client's next requests with a cookie.
+"""
+import math
+import random
+import time
+from contextvars import ContextVar
+
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from .conf import api_setting
+
+_pin_state = ContextVar('replica_pin_state', default=None)
+
+
+class PinState:
+    """
+    Whether reads of one request (or, outside requests, one context) must
+    stay on the primary
+    """
+
+    def __init__(self, pinned=False):
+        self.pinned_until = math.inf if pinned else 0.0
+        self.wrote = False
+
+    def pin(self):
+        self.wrote = True
+        self.pinned_until = max(self.pinned_until,
+                                time.monotonic() + api_setting('READ_REPLICAS', 'PIN_SECONDS'))
+
+    @property
+    def pinned(self):
+        return self.pinned_until > time.monotonic()
+
+
+def start_request(pinned=False):
+    """
+    Gives the current request its own pin state, returns it and a reset token
+    """
+    state = PinState(pinned)
+    return state, _pin_state.set(state)
+
+
+def end_request(token):
+    _pin_state.reset(token)
+
+
+def pin_to_primary():
+    """
+    Sends the current context's reads to the primary for the pin window.
+    Called for every write, and by code whose writes are deferred (see
+    api.last_login).
+    """
+    state = _pin_state.get()
+    if state is None:
+        state = PinState()
+        _pin_state.set(state)
+    state.pin()
+
+
+def is_pinned():
+    state = _pin_state.get()
+    return state is not None and state.pinned
+
+
+class PrimaryReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        replicas = api_setting('READ_REPLICAS', 'ALIASES')
+        if not replicas or is_pinned() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        pin_to_primary()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        databases = {DEFAULT_DB_ALIAS, *api_setting('READ_REPLICAS', 'ALIASES')}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
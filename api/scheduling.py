@@ -0,0 +1,228 @@
+"""
+Timetable conflict checks.
+
+A section meets on some days of the week at the same hours, which makes it a
+set of half-open [start, end) intervals on the minutes of the week. Conflicts
+are found in memory, from timetables loaded once per student and per room,
+instead of asking the database about every pair of sections.
+"""
+import heapq
+from bisect import bisect_left, insort
+from collections import Counter, defaultdict, namedtuple
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count
+
+from .models import Enrollment, Section, User
+
+MINUTES_PER_DAY = 24 * 60
+
+# A section as the checks see it; ``meetings`` are (start, end) minutes of the week
+Slot = namedtuple('Slot', 'id room meetings')
+
+SLOT_FIELDS = ('id', 'room', 'days', 'start_time', 'end_time')
+
+
+def make_slot(id, room, days, start_time, end_time):
+    start = start_time.hour * 60 + start_time.minute
+    end = end_time.hour * 60 + end_time.minute
+    meetings = tuple((day * MINUTES_PER_DAY + start, day * MINUTES_PER_DAY + end)
+                     for day in range(7) if days & (1 << day))
+    return Slot(id, room, meetings)
+
+
+def load_slots(queryset):
+    """
+    Slots of the sections of ``queryset``, without building model instances
+    """
+    return [make_slot(*row) for row in queryset.values_list(*SLOT_FIELDS)]
+
+
+class IntervalIndex:
+    """
+    Intervals sorted by start. Looking up the ones overlapping [start, end)
+    bisects to the last interval starting before ``end`` and walks back no
+    further than the longest interval held could reach.
+    """
+
+    def __init__(self):
+        self._intervals = []
+        self._longest = 0
+
+    def __len__(self):
+        return len(self._intervals)
+
+    def add(self, start, end, key):
+        insort(self._intervals, (start, end, key))
+        self._longest = max(self._longest, end - start)
+
+    def overlapping(self, start, end):
+        intervals = self._intervals
+        keys = []
+        index = bisect_left(intervals, (end,)) - 1
+        floor = start - self._longest
+        while index >= 0 and intervals[index][0] > floor:
+            if intervals[index][1] > start:
+                keys.append(intervals[index][2])
+            index -= 1
+        return keys
+
+
+class Timetable:
+    """
+    The sections of one student or one room
+    """
+
+    def __init__(self, slots=()):
+        self.index = IntervalIndex()
+        self.section_ids = set()
+        for slot in slots:
+            self.add(slot)
+
+    def __contains__(self, section_id):
+        return section_id in self.section_ids
+
+    def add(self, slot):
+        self.section_ids.add(slot.id)
+        for start, end in slot.meetings:
+            self.index.add(start, end, slot.id)
+
+    def conflicts(self, slot):
+        """
+        Ids of the sections overlapping ``slot``, sorted
+        """
+        found = set()
+        for start, end in slot.meetings:
+            found.update(self.index.overlapping(start, end))
+        found.discard(slot.id)
+        return sorted(found)
+
+
+def find_conflicts(slots):
+    """
+    Every pair of overlapping sections among ``slots``, as sorted (id, id)
+    tuples, by sweeping their meetings in order of start
+    """
+    meetings = sorted((start, end, slot.id) for slot in slots for start, end in slot.meetings)
+    # (end, id) of the meetings still running, the earliest end first
+    running = []
+    pairs = set()
+    for start, end, section_id in meetings:
+        while running and running[0][0] <= start:
+            heapq.heappop(running)
+        for _, other in running:
+            if other != section_id:
+                pairs.add((min(section_id, other), max(section_id, other)))
+        heapq.heappush(running, (end, section_id))
+    return sorted(pairs)
+
+
+def find_room_conflicts(slots):
+    """
+    Pairs of sections booked in the same room at overlapping times
+    """
+    rooms = defaultdict(list)
+    for slot in slots:
+        if slot.room:
+            rooms[slot.room].append(slot)
+    pairs = []
+    for room_slots in rooms.values():
+        pairs.extend(find_conflicts(room_slots))
+    return sorted(pairs)
+
+
+def room_conflicts(slot):
+    """
+    Ids of the sections already booked in the room of ``slot`` at overlapping times
+    """
+    if not slot.room:
+        return []
+    return Timetable(load_slots(Section.objects.filter(room=slot.room))).conflicts(slot)
+
+
+class EnrollmentPlanner:
+    """
+    Validates a batch of (student id, section id) enrollment requests in
+    memory. The sections, their enrollment counts, the students and the
+    students' timetables are loaded once, in four queries, whatever the size
+    of the batch. Accepted requests are added to the timetables, so later
+    requests of the same batch are checked against them.
+    """
+
+    def __init__(self, student_ids, section_ids):
+        section_ids = set(section_ids)
+        student_ids = set(student_ids)
+        sections = Section.objects.filter(id__in=section_ids)
+        self.slots = {}
+        self.capacity = {}
+        for row in sections.values_list(*SLOT_FIELDS, 'capacity'):
+            self.slots[row[0]] = make_slot(*row[:-1])
+            self.capacity[row[0]] = row[-1]
+        self.enrolled = Counter(dict(
+            Enrollment.objects.filter(section_id__in=section_ids)
+            .values_list('section_id').annotate(Count('id')).order_by()
+        ))
+        self.students = set(User.objects.filter(id__in=student_ids).values_list('id', flat=True))
+
+        self.timetables = defaultdict(Timetable)
+        enrolled_in = (Enrollment.objects.filter(student_id__in=self.students)
+                       .values_list('student_id', *('section__%s' % field for field in SLOT_FIELDS)))
+        for student_id, *row in enrolled_in:
+            self.timetables[student_id].add(make_slot(*row))
+
+    def check(self, student_id, section_id):
+        """
+        Returns why the request is refused, or None after taking the seat
+        """
+        slot = self.slots.get(section_id)
+        if slot is None:
+            return 'Unknown section'
+        if student_id not in self.students:
+            return 'Unknown student'
+        timetable = self.timetables[student_id]
+        if section_id in timetable:
+            return 'Already enrolled'
+        if self.enrolled[section_id] >= self.capacity[section_id]:
+            return 'Section is full'
+        conflicts = timetable.conflicts(slot)
+        if conflicts:
+            return 'Conflicts with sections %s' % ', '.join(map(str, conflicts))
+        timetable.add(slot)
+        self.enrolled[section_id] += 1
+        return None
+
+
+def enroll(requests, batch_size=1000):
+    """
+    Validates ``requests``, (student id, section id) pairs, and enrolls the
+    accepted ones. Returns one error or None per request.
+
+    The sections and then the students are locked for the duration, always
+    in that order, so concurrent enrollments can neither overfill a section
+    nor give a student two conflicting sections. A pair enrolled anyway in
+    the meantime is reported as already enrolled.
+    """
+    requests = list(requests)
+    with transaction.atomic():
+        section_ids = {section_id for _, section_id in requests}
+        student_ids = {student_id for student_id, _ in requests}
+        list(Section.objects.select_for_update().filter(id__in=section_ids)
+             .order_by('id').values_list('id'))
+        list(User.objects.select_for_update().filter(id__in=student_ids)
+             .order_by('id').values_list('id'))
+        planner = EnrollmentPlanner(student_ids, section_ids)
+        errors = [planner.check(student_id, section_id) for student_id, section_id in requests]
+        accepted = [index for index, error in enumerate(errors) if error is None]
+        enrollments = [Enrollment(student_id=requests[index][0], section_id=requests[index][1])
+                       for index in accepted]
+        try:
+            with transaction.atomic():
+                Enrollment.objects.bulk_create(enrollments, batch_size=batch_size)
+        except IntegrityError:
+            for index, enrollment in zip(accepted, enrollments):
+                try:
+                    with transaction.atomic():
+                        enrollment.save(force_insert=True)
+                except IntegrityError:
+                    errors[index] = 'Already enrolled'
+    return errors
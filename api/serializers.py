@@ -1,14 +1,43 @@
+from contextlib import nullcontext
+
 from django.contrib.auth.password_validation import validate_password
 from django.core.exceptions import ValidationError
 from django.contrib.auth import authenticate
-from django.contrib.auth.models import update_last_login
+from django.db import IntegrityError, transaction
 
 from rest_framework import serializers
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, TokenError
+from rest_framework_simplejwt.serializers import (
+    TokenObtainPairSerializer as BaseTokenObtainPairSerializer,
+    TokenRefreshSerializer
+)
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
 from rest_framework_simplejwt.tokens import RefreshToken
 
-from .models import User
+from .audit import audit_log
+from .last_login import last_login_buffer
+from .models import AuthAuditEvent, Course, Section, User
+from .profiling import span
+from .revocation import revocation_registry
+from .scheduling import make_slot, room_conflicts
+
+# Same message as the unique validator of User.email
+DUPLICATE_EMAIL = 'user with this email already exists.'
+
+class ProfiledValidationMixin:
+    """
+    Adds the time spent validating to the request's ``validation`` span
+    """
 
-class AuthUserRegistrationSerializer(serializers.ModelSerializer):
+    def is_valid(self, *, raise_exception=False):
+        with span('validation'):
+            return super().is_valid(raise_exception=raise_exception)
+
+class AuthUserRegistrationSerializer(ProfiledValidationMixin, serializers.ModelSerializer):
+    """
+    Email uniqueness is enforced by the INSERT rather than a query before it,
+    so registering takes a single round trip
+    """
     password = serializers.CharField(write_only=True)
     
     def validate_password(self, value):
@@ -24,12 +53,26 @@ class AuthUserRegistrationSerializer(serializers.ModelSerializer):
             'email',
             'password'
         )
+        extra_kwargs = {'email': {'validators': []}}
 
     def create(self, validated_data):
-        auth_user = User.objects.create_user(**validated_data)
+        # A failed INSERT needs no cleanup in autocommit mode, but inside a
+        # transaction a savepoint keeps it usable after a duplicate
+        connection = transaction.get_connection()
+        try:
+            with transaction.atomic() if connection.in_atomic_block else nullcontext():
+                auth_user = User.objects.create_user(**validated_data)
+        except IntegrityError:
+            raise serializers.ValidationError({'email': [DUPLICATE_EMAIL]})
         return auth_user
 
-class AuthUserLoginSerializer(serializers.Serializer):
+class BulkRegistrationRowSerializer(AuthUserRegistrationSerializer):
+    """
+    Registration rules for one row of a bulk registration. Email uniqueness is
+    checked once per batch by bulk_create_users.
+    """
+
+class AuthUserLoginSerializer(ProfiledValidationMixin, serializers.Serializer):
 
     email = serializers.EmailField()
     password = serializers.CharField(max_length=128, write_only=True)
@@ -46,9 +89,11 @@ class AuthUserLoginSerializer(serializers.Serializer):
     def validate(self, data):
         email = data['email']
         password = data['password']
+        request = self.context.get('request')
         user = authenticate(email=email, password=password)
 
         if user is None:
+            audit_log.record(AuthAuditEvent.LOGIN_FAILED, email=email, request=request)
             raise serializers.ValidationError("Invalid login credentials")
 
         try:
@@ -56,7 +101,8 @@ class AuthUserLoginSerializer(serializers.Serializer):
             refresh_token = str(refresh)
             access_token = str(refresh.access_token)
 
-            update_last_login(None, user)
+            last_login_buffer.record(user)
+            audit_log.record(AuthAuditEvent.LOGIN, user.pk, user.email, request)
 
             validation = {
                 'access': access_token,
@@ -69,10 +115,132 @@ class AuthUserLoginSerializer(serializers.Serializer):
         except User.DoesNotExist:
             raise serializers.ValidationError("Invalid login credentials")
         
+class TokenObtainPairSerializer(ProfiledValidationMixin, BaseTokenObtainPairSerializer):
+
+    def validate(self, attrs):
+        request = self.context.get('request')
+        try:
+            data = super().validate(attrs)
+        except AuthenticationFailed:
+            audit_log.record(AuthAuditEvent.LOGIN_FAILED, email=attrs.get(self.username_field),
+                             request=request)
+            raise
+        audit_log.record(AuthAuditEvent.LOGIN, self.user.pk, self.user.email, request)
+        return data
+
+class RevocableTokenRefreshSerializer(ProfiledValidationMixin, TokenRefreshSerializer):
+    """
+    Refresh serializer that rejects revoked refresh tokens and, when rotation
+    is enabled, revokes the rotated one so it can be used only once
+    """
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+        jti = refresh[jwt_settings.JTI_CLAIM]
+        if revocation_registry.is_revoked(jti):
+            raise TokenError('Token is blacklisted')
+
+        data = {'access': str(refresh.access_token)}
+
+        if jwt_settings.ROTATE_REFRESH_TOKENS:
+            # Checking is_revoked() above is not enough, two requests could
+            # both pass it; only the one revoking the token may rotate it
+            if not revocation_registry.revoke(jti, refresh['exp']):
+                raise TokenError('Token is blacklisted')
+            refresh.set_jti()
+            refresh.set_exp()
+            refresh.set_iat()
+
+            data['refresh'] = str(refresh)
+
+        audit_log.record(AuthAuditEvent.TOKEN_REFRESH, refresh.get(jwt_settings.USER_ID_CLAIM),
+                         request=self.context.get('request'))
+        return data
+
 class UserListSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = (
             'email',
             'role'
-        )
\ No newline at end of file
+        )
+
+    @classmethod
+    def serialize_rows(cls, rows):
+        """
+        Read-only fast path: serializes ``values_list(*Meta.fields)`` tuples
+        without building model instances or running field machinery.
+        Gives the same output as the serializer as long as every field is a
+        plain column represented by its own value. Extra trailing values in a
+        row are ignored.
+        """
+        fields = cls.Meta.fields
+        return [dict(zip(fields, row)) for row in rows]
+
+class AuthAuditEventSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = AuthAuditEvent
+        fields = (
+            'id',
+            'event',
+            'user_id',
+            'email',
+            'ip',
+            'created_date'
+        )
+
+
+class CourseSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Course
+        fields = (
+            'code',
+            'title',
+            'credits'
+        )
+
+class DaysField(serializers.Field):
+    """
+    The ``days`` bits of a section as a list of day names, e.g. ["mon", "wed"]
+    """
+    default_error_messages = {
+        'invalid': 'Expected a non-empty list of days out of {days}.',
+    }
+
+    def to_representation(self, value):
+        return [day for bit, day in enumerate(Section.DAYS) if value & (1 << bit)]
+
+    def to_internal_value(self, data):
+        if not isinstance(data, list) or not data or not all(day in Section.DAYS for day in data):
+            self.fail('invalid', days=', '.join(Section.DAYS))
+        return sum(1 << Section.DAYS.index(day) for day in set(data))
+
+class SectionSerializer(serializers.ModelSerializer):
+    """
+    New sections are refused when their room is already booked at those times
+    """
+    course = serializers.SlugRelatedField(slug_field='code', queryset=Course.objects.all())
+    days = DaysField()
+
+    class Meta:
+        model = Section
+        fields = (
+            'id',
+            'course',
+            'code',
+            'room',
+            'days',
+            'start_time',
+            'end_time',
+            'capacity'
+        )
+
+    def validate(self, data):
+        if data['end_time'] <= data['start_time']:
+            raise serializers.ValidationError({'end_time': ['Must be after start_time.']})
+        conflicts = room_conflicts(make_slot(None, data.get('room'), data['days'],
+                                             data['start_time'], data['end_time']))
+        if conflicts:
+            raise serializers.ValidationError({'room': [
+                'Booked at these times by sections %s' % ', '.join(map(str, conflicts))]})
+        return data
@@ -0,0 +1,130 @@
+import logging
+
+from django.core.signals import request_finished
+from django.db import DatabaseError
+from django.contrib.auth.models import Group, Permission
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from .audit import audit_log
+from .authentication import invalidate_basic_auth_cache
+from .last_login import last_login_buffer
+from .managers import users_bulk_created, users_bulk_updated
+from .models import User, UserStatistic
+from .permission_cache import permission_cache
+from .user_cache import UserResolver, user_resolver
+from .user_stats import user_stats
+from .user_version import bump_users_version
+
+logger = logging.getLogger(__name__)
+
+# Fields whose change must invalidate cached credential checks
+CREDENTIAL_FIELDS = frozenset(('password', 'is_active'))
+
+# Fields held by the user resolution cache
+RESOLVED_FIELDS = frozenset(UserResolver.fields)
+
+# Fields shown or filtered on by the users list
+LISTED_FIELDS = frozenset(('email', 'role', 'is_active', 'created_date'))
+
+# Fields permission snapshots depend on
+PERMISSION_FIELDS = frozenset(('is_active', 'is_superuser'))
+
+# Fields the user statistics are counted by
+COUNTED_FIELDS = frozenset(UserStatistic.USER_FIELDS)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created=False, update_fields=None, **kwargs):
+    if update_fields is None or CREDENTIAL_FIELDS.intersection(update_fields):
+        invalidate_basic_auth_cache(instance.pk)
+    if update_fields is None or RESOLVED_FIELDS.intersection(update_fields):
+        user_resolver.invalidate(instance.pk)
+    if update_fields is None or LISTED_FIELDS.intersection(update_fields):
+        bump_users_version()
+    if update_fields is None or PERMISSION_FIELDS.intersection(update_fields):
+        permission_cache.invalidate(instance.pk)
+    if created:
+        user_stats.created([instance])
+    elif update_fields is None or COUNTED_FIELDS.intersection(update_fields):
+        user_stats.changed(instance)
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    invalidate_basic_auth_cache(instance.pk)
+    user_resolver.invalidate(instance.pk)
+    bump_users_version()
+    user_stats.deleted(instance)
+    permission_cache.invalidate(instance.pk)
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=User.user_permissions.through)
+def user_grants_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        permission_cache.invalidate(instance.pk)
+    elif pk_set is None:
+        # Cleared from the group or permission side, the users are unknown
+        permission_cache.clear()
+    else:
+        for pk in pk_set:
+            permission_cache.invalidate(pk)
+
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+@receiver(post_delete, sender=Group)
+@receiver(post_delete, sender=Permission)
+def group_grants_changed(sender, **kwargs):
+    # Rare edits reaching any number of users
+    if kwargs.get('action', 'post_').startswith('post_'):
+        permission_cache.clear()
+
+
+@receiver(users_bulk_created)
+def users_created_in_bulk(sender, users, **kwargs):
+    user_stats.created(users)
+
+
+@receiver(users_bulk_updated)
+def users_updated_in_bulk(sender, users, update_fields, **kwargs):
+    # Same invalidations as user_saved, the list version bumped once
+    update_fields = frozenset(update_fields)
+    for user in users:
+        if CREDENTIAL_FIELDS.intersection(update_fields):
+            invalidate_basic_auth_cache(user.pk)
+        if RESOLVED_FIELDS.intersection(update_fields):
+            user_resolver.invalidate(user.pk)
+        if PERMISSION_FIELDS.intersection(update_fields):
+            permission_cache.invalidate(user.pk)
+        if COUNTED_FIELDS.intersection(update_fields):
+            user_stats.changed(user)
+    if users and LISTED_FIELDS.intersection(update_fields):
+        bump_users_version()
+
+
+@receiver(request_finished)
+def flush_last_logins(sender, **kwargs):
+    # Runs once the response has been sent, keeping the write off the login path
+    try:
+        last_login_buffer.flush_if_due()
+    except DatabaseError:
+        logger.exception('Could not flush buffered last_login updates')
+
+
+@receiver(request_finished)
+def flush_user_stats(sender, **kwargs):
+    try:
+        user_stats.flush_if_due()
+    except DatabaseError:
+        logger.exception('Could not flush buffered user count changes')
+
+
+@receiver(request_finished)
+def flush_audit_log(sender, **kwargs):
+    # Without a background writer (tests, management commands) the queue is
+    # drained once the response has been sent
+    if not audit_log.worker_running():
+        audit_log.flush()
@@ -0,0 +1,15 @@
+from django.test.runner import DiscoverRunner as BaseDiscoverRunner
+
+from .buffers import discard_buffers
+
+
+class DiscoverRunner(BaseDiscoverRunner):
+    """
+    Drops the writes still buffered by the tests, audit events included,
+    before the test databases are destroyed. They belong to those databases,
+    flushed later they would reach the real ones.
+    """
+
+    def teardown_databases(self, old_config, **kwargs):
+        discard_buffers()
+        super().teardown_databases(old_config, **kwargs)
@@ -1,9 +1,70 @@
+import base64
+import contextvars
+import csv
+import datetime
+import gzip
+import io
 import json
+import os
+import tempfile
+import threading
+import time
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import authenticate
+from django.contrib.auth.models import Group, Permission
+from django.contrib.auth.password_validation import CommonPasswordValidator
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.core.management import CommandError, call_command
+from django.core.signals import request_started
+from django.db import IntegrityError, connection
+from django.db.backends.postgresql import base as postgresql_base
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
 from django.urls import include, path, reverse
+from django.utils import timezone
 from rest_framework import status
-from rest_framework.test import APITestCase, APIClient, URLPatternsTestCase
+from rest_framework.test import (
+    APITestCase, APITransactionTestCase, APIClient, URLPatternsTestCase
+)
+from rest_framework_simplejwt.tokens import RefreshToken
 
-from .models import User
+from .async_views import AsyncAuthUserLoginView, AsyncAuthUserRegistrationView, AsyncUserListView
+from .audit import AuditLog, audit_log
+from .authentication import _user_salt_key
+from .batch_jobs import DeactivateGraduatesJob, ExpireDormantJob
+from .benchmarks import run_suite
+from .buffers import buffer_flusher, discard_buffers
+from .checks import check_shared_caches, require_shared_caches
+from .db.backends.pooled_postgresql.base import DatabaseWrapper as PooledDatabaseWrapper, check_connection
+from .filters import filter_users
+from .last_login import last_login_buffer
+from .lifecycle import start_worker, start_worker_on_request, stop_worker
+from .middleware import ReplicaPinningMiddleware
+from .models import AuthAuditEvent, BatchJobCheckpoint, Course, Enrollment, Section, User
+from .pagination import KeysetPaginator, encode_cursor
+from .passwords import get_hash_pool, hash_passwords, run_in_password_executor
+from .permission_cache import permission_cache
+from .password_validation import CompactCommonPasswordValidator
+from .pool import ConnectionPool, PoolTimeout, close_pools, pool_stats
+from .profiling import latency_stats, reset_latency_stats
+from .renderers import FastJSONRenderer
+from .serializers import DUPLICATE_EMAIL, UserListSerializer
+from .test_runner import DiscoverRunner
+from .routers import PrimaryReplicaRouter, pin_to_primary
+from .scheduling import (EnrollmentPlanner, IntervalIndex, Timetable, enroll, find_conflicts,
+                         find_room_conflicts, make_slot)
+from .revocation import BloomFilter, InMemoryRevocationStore, RevocationRegistry, revocation_registry
+from .throttling import CacheBucketStore, MemoryBucketStore, login_throttle, take
+from .token_cache import token_cache
+from .user_stats import reconcile_user_stats, user_stats
+from .user_cache import user_resolver
+from .warmup import SHARED_STEPS, STEPS, measure_imports, parse_importtime, warm_up
 
 
 class UserTest(APITestCase, URLPatternsTestCase):
@@ -87,3 +148,1955 @@ class UserTest(APITestCase, URLPatternsTestCase):
         response_data = json.loads(response.content)
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
         self.assertFalse(response_data['success'])
+
+
+class UserListPaginationTest(APITestCase, URLPatternsTestCase):
+    """ Keyset pagination and streaming of the user list """
+
+    urlpatterns = [
+        path('api/auth/', include('api.urls')),
+    ]
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser(
+            email='admin@test.com',
+            password='admin',
+        )
+        User.objects.bulk_create(
+            User(email='student%d@test.com' % i) for i in range(25)
+        )
+        self.client.force_authenticate(user=self.admin)
+
+    def test_pages_cover_every_user_once(self):
+        """ Following the next cursor visits every user exactly once """
+        emails = []
+        response = self.client.get(reverse('users'), {'limit': 10})
+        while True:
+            response_data = json.loads(response.content)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response_data['users']), 10)
+            emails.extend(user['email'] for user in response_data['users'])
+            if response_data['next'] is None:
+                break
+            response = self.client.get(
+                reverse('users'), {'limit': 10, 'cursor': response_data['next']}
+            )
+        self.assertEqual(sorted(emails), sorted(User.objects.values_list('email', flat=True)))
+
+    def test_invalid_cursor(self):
+        """ A cursor we did not issue is rejected """
+        response = self.client.get(reverse('users'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(json.loads(response.content)['success'])
+
+    def test_stream(self):
+        """ Streaming mode returns the whole table as one JSON document """
+        with self.settings(USER_LIST={'STREAM_CHUNK_SIZE': 7}):
+            response = self.client.get(reverse('users'), {'stream': 'true'})
+            content = b''.join(response.streaming_content)
+        response_data = json.loads(content)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response_data['success'])
+        self.assertEqual(User.objects.count(), len(response_data['users']))
+
+
+class BulkRegistrationTest(APITestCase, URLPatternsTestCase):
+    """ Bulk user registration """
+
+    urlpatterns = [
+        path('api/auth/', include('api.urls')),
+    ]
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser(
+            email='admin@test.com',
+            password='admin',
+        )
+        self.client.force_authenticate(user=self.admin)
+
+    def test_bulk_registration_reports_each_row(self):
+        """ Valid rows are created, invalid and duplicate rows are reported """
+        data = {'users': [
+            {'email': 'new1@Test.com', 'password': 'x7#Lq9!vRt'},
+            {'email': 'new2@test.com', 'password': 'x7#Lq9!vRt'},
+            {'email': 'admin@test.com', 'password': 'x7#Lq9!vRt'},
+            {'email': 'new1@test.com', 'password': 'x7#Lq9!vRt'},
+            {'email': 'not-an-email', 'password': 'x7#Lq9!vRt'},
+            {'email': 'new3@test.com', 'password': '123'},
+        ]}
+        response = self.client.post(reverse('register_bulk'), data, format='json')
+        response_data = json.loads(response.content)
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(
+            [result['success'] for result in response_data['results']],
+            [True, True, False, False, False, False]
+        )
+        self.assertTrue(User.objects.get(email='new1@test.com').check_password('x7#Lq9!vRt'))
+        self.assertTrue(User.objects.filter(email='new2@test.com').exists())
+        self.assertFalse(User.objects.filter(email='new3@test.com').exists())
+
+    def test_bulk_registration_restricted_to_admins(self):
+        """ Students cannot register users in bulk """
+        student = User.objects.create_user(email='test1@test.com', password='test')
+        self.client.force_authenticate(user=student)
+        data = {'users': [{'email': 'new1@test.com', 'password': 'x7#Lq9!vRt'}]}
+        response = self.client.post(reverse('register_bulk'), data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_duplicate_rows_reported(self):
+        """ A row repeating an email of the same batch gets the duplicate email error """
+        data = {'users': [
+            {'email': 'new1@test.com', 'password': 'x7#Lq9!vRt'},
+            {'email': 'new1@TEST.com', 'password': 'x7#Lq9!vRt'},
+        ]}
+        response = self.client.post(reverse('register_bulk'), data, format='json')
+        results = json.loads(response.content)['results']
+        self.assertEqual([result['success'] for result in results], [True, False])
+        self.assertEqual(results[1]['errors'], {'email': [DUPLICATE_EMAIL]})
+
+    def test_bulk_insert_race(self):
+        """ Emails registered concurrently are skipped, not a 500 """
+        def racing_hash_passwords(passwords, workers=None):
+            # Registered by another request after the existence check
+            User.objects.create_user(email='race1@test.com', password='test')
+            User.objects.create_user(email='race2@test.com', password='test')
+            return hash_passwords(passwords, workers)
+
+        users = [{'email': email, 'password': 'secret'}
+                 for email in ('race1@test.com', 'new1@test.com', 'race2@test.com')]
+        with mock.patch('api.managers.hash_passwords', side_effect=racing_hash_passwords):
+            created = User.objects.bulk_create_users(users)
+        self.assertEqual([user.email for user in created], ['new1@test.com'])
+        self.assertTrue(User.objects.get(email='race1@test.com').check_password('test'))
+
+    def test_bulk_insert_other_constraint(self):
+        """ A row breaking another constraint fails alone """
+        bulk_create = User.objects.bulk_create
+
+        def failing_bulk_create(objs, *args, **kwargs):
+            if any(user.email == 'bad@test.com' for user in objs):
+                raise IntegrityError('new row violates check constraint')
+            return bulk_create(objs, *args, **kwargs)
+
+        data = {'users': [
+            {'email': 'new1@test.com', 'password': 'x7#Lq9!vRt'},
+            {'email': 'bad@test.com', 'password': 'x7#Lq9!vRt'},
+        ]}
+        with mock.patch.object(User.objects, 'bulk_create', side_effect=failing_bulk_create), \
+                self.assertLogs('api.managers', 'WARNING'):
+            response = self.client.post(reverse('register_bulk'), data, format='json')
+        results = json.loads(response.content)['results']
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual([result['success'] for result in results], [True, False])
+        self.assertIn('non_field_errors', results[1]['errors'])
+        self.assertTrue(User.objects.filter(email='new1@test.com').exists())
+
+    def test_bulk_create_users_batches(self):
+        """ The manager hashes in a process pool and inserts in batches """
+        users = [{'email': 'pool%d@test.com' % i, 'password': 'secret'} for i in range(20)]
+        with self.settings(PASSWORD_HASHING={'WORKERS': 2, 'MIN_POOL_BATCH': 4}):
+            created = User.objects.bulk_create_users(users, batch_size=6)
+        self.assertEqual(len(created), 20)
+        self.assertTrue(User.objects.get(email='pool7@test.com').check_password('secret'))
+        # The pool is kept for the next batch
+        self.assertIs(get_hash_pool(2), get_hash_pool(2))
+
+
+class CachedBasicAuthenticationTest(APITestCase, URLPatternsTestCase):
+    """ Caching of Basic auth credential checks """
+
+    urlpatterns = [
+        path('api/auth/', include('api.urls')),
+    ]
+
+    def setUp(self):
+        caches['shared'].clear()
+        self.admin = User.objects.create_superuser(
+            email='admin@test.com',
+            password='admin',
+        )
+
+    def get_users(self, password='admin'):
+        credentials = base64.b64encode(('admin@test.com:%s' % password).encode()).decode()
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Basic ' + credentials)
+        return client.get(reverse('users'))
+
+    def test_password_checked_once(self):
+        """ Repeated requests with the same credentials skip the hasher """
+        with mock.patch('rest_framework.authentication.authenticate', wraps=authenticate) as check:
+            for _ in range(3):
+                self.assertEqual(self.get_users().status_code, status.HTTP_200_OK)
+        self.assertEqual(check.call_count, 1)
+
+    def test_wrong_password_not_cached(self):
+        """ Failed checks are never cached """
+        self.assertEqual(self.get_users().status_code, status.HTTP_200_OK)
+        self.assertEqual(self.get_users('wrong').status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_password_change_invalidates(self):
+        """ Changing the password drops cached checks of the old one """
+        self.assertEqual(self.get_users().status_code, status.HTTP_200_OK)
+        self.admin.set_password('changed')
+        self.admin.save()
+        self.assertEqual(self.get_users().status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self.get_users('changed').status_code, status.HTTP_200_OK)
+
+    def test_password_change_during_check(self):
+        """ A check racing a password change is not trusted after the change """
+        def check_then_change(*args, **kwargs):
+            user = authenticate(*args, **kwargs)
+            # Another request changes the password before this check is cached
+            admin = User.objects.get(pk=self.admin.pk)
+            admin.set_password('changed')
+            admin.save()
+            return user
+
+        with mock.patch('rest_framework.authentication.authenticate', side_effect=check_then_change):
+            self.assertEqual(self.get_users().status_code, status.HTTP_200_OK)
+        self.assertEqual(self.get_users().status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self.get_users('changed').status_code, status.HTTP_200_OK)
+
+    def test_salt_eviction_invalidates(self):
+        """ A check stored under an evicted salt is checked again """
+        self.assertEqual(self.get_users().status_code, status.HTTP_200_OK)
+        caches['shared'].delete(_user_salt_key(self.admin.pk))
+        with mock.patch('rest_framework.authentication.authenticate', wraps=authenticate) as check:
+            self.assertEqual(self.get_users().status_code, status.HTTP_200_OK)
+        self.assertEqual(check.call_count, 1)
+
+    def test_deactivation_invalidates(self):
+        """ Deactivated users are rejected even with cached credentials """
+        self.assertEqual(self.get_users().status_code, status.HTTP_200_OK)
+        self.admin.is_active = False
+        self.admin.save(update_fields=['is_active'])
+        self.assertEqual(self.get_users().status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class CachedJWTAuthenticationTest(APITestCase, URLPatternsTestCase):
+    """ Cached user resolution for JWT authenticated requests """
+
+    urlpatterns = [
+        path('api/auth/', include('api.urls')),
+    ]
+
+    def setUp(self):
+        user_resolver.clear()
+        self.admin = User.objects.create_superuser(
+            email='admin@test.com',
+            password='admin',
+        )
+        refresh = RefreshToken.for_user(self.admin)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='JWT ' + str(refresh.access_token))
+
+    def test_no_user_query_on_cache_hit(self):
+        """ Only the listing itself hits the database once the user is cached """
+        self.assertEqual(self.client.get(reverse('users')).status_code, status.HTTP_200_OK)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(reverse('users')).status_code, status.HTTP_200_OK)
+
+    def test_role_change_invalidates(self):
+        """ Saving the user drops its cached authorization fields """
+        self.assertEqual(self.client.get(reverse('users')).status_code, status.HTTP_200_OK)
+        self.admin.role = User.STUDENT
+        self.admin.save()
+        self.assertEqual(self.client.get(reverse('users')).status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_deleted_user_rejected(self):
+        """ Tokens of deleted users stop working """
+        self.assertEqual(self.client.get(reverse('users')).status_code, status.HTTP_200_OK)
+        self.admin.delete()
+        self.assertEqual(self.client.get(reverse('users')).status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+def start_worker_without_threads():
+    """ start_worker() in a test: no background threads, no warm-up """
+    with mock.patch('api.lifecycle.audit_log.start'), \
+            mock.patch('api.lifecycle.buffer_flusher.start'), \
+            mock.patch('api.lifecycle.warm_up'):
+        start_worker()
+
+
+class LastLoginBufferTest(APITestCase, URLPatternsTestCase):
+    """ Write-behind batching of last_login updates """
+
+    urlpatterns = [
+        path('api/auth/', include('api.urls')),
+    ]
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser(
+            email='admin@test.com',
+            password='admin',
+        )
+        last_login_buffer.flush()
+
+    def login(self):
+        data = {'email': 'admin@test.com', 'password': 'admin'}
+        response = self.client.post(reverse('login'), data)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_login_defers_write(self):
+        """ Logging in buffers last_login until the buffer is flushed """
+        with self.settings(LAST_LOGIN_BUFFER={'FLUSH_INTERVAL': 60, 'FLUSH_SIZE': 100}):
+            self.login()
+        self.admin.refresh_from_db()
+        self.assertIsNone(self.admin.last_login)
+        self.assertEqual(last_login_buffer.flush(), 1)
+        self.admin.refresh_from_db()
+        self.assertIsNotNone(self.admin.last_login)
+
+    def test_flush_after_request_when_due(self):
+        """ A full buffer is flushed once the request has been answered """
+        with self.settings(LAST_LOGIN_BUFFER={'FLUSH_INTERVAL': 60, 'FLUSH_SIZE': 1}):
+            self.login()
+        self.assertEqual(len(last_login_buffer), 0)
+        self.admin.refresh_from_db()
+        self.assertIsNotNone(self.admin.last_login)
+
+    def test_batched_update(self):
+        """ Many users are updated in one statement """
+        users = User.objects.bulk_create(User(email='student%d@test.com' % i) for i in range(5))
+        for user in users:
+            last_login_buffer.record(user)
+        with self.assertNumQueries(1):
+            self.assertEqual(last_login_buffer.flush(), 5)
+        self.assertFalse(User.objects.filter(email__startswith='student', last_login=None).exists())
+
+    def test_background_flush(self):
+        """ The background flusher writes due buffers without waiting for a request """
+        flushed = threading.Event()
+        with self.settings(WRITE_BUFFERS={'CHECK_INTERVAL': 0.01}), \
+                mock.patch.object(last_login_buffer, 'flush_if_due', side_effect=lambda: flushed.set()):
+            buffer_flusher.start()
+            self.addCleanup(buffer_flusher.stop)
+            self.assertTrue(buffer_flusher.running())
+            self.assertTrue(flushed.wait(5))
+            with mock.patch.object(last_login_buffer, 'flush') as flush:
+                buffer_flusher.stop()
+            flush.assert_called_once_with()
+        self.assertFalse(buffer_flusher.running())
+
+    def test_stop_flushes(self):
+        """ Stopping a serving process writes the logins it buffered """
+        student = User.objects.create_user(email='student@test.com', password='test')
+        last_login_buffer.record(student)
+        start_worker_without_threads()
+        stop_worker()
+        self.assertEqual(len(last_login_buffer), 0)
+        self.assertIsNotNone(User.objects.get(pk=student.pk).last_login)
+
+        # Only once, and only in the process that started it
+        with mock.patch('api.lifecycle.buffer_flusher.stop') as stop:
+            stop_worker()
+        stop.assert_not_called()
+
+    def test_discard(self):
+        """ Buffered writes can be dropped, e.g. before their database is destroyed """
+        last_login_buffer.record(self.admin)
+        self.assertEqual(discard_buffers()['last_login'], 1)
+        self.assertEqual(len(last_login_buffer), 0)
+
+
+class ValidatedTokenCacheTest(APITestCase, URLPatternsTestCase):
+    """ Memoization of validated access tokens """
+
+    urlpatterns = [
+        path('api/auth/', include('api.urls')),
+    ]
+
+    def setUp(self):
+        token_cache.clear()
+        self.admin = User.objects.create_superuser(
+            email='admin@test.com',
+            password='admin',
+        )
+        self.access = str(RefreshToken.for_user(self.admin).access_token)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='JWT ' + self.access)
+
+    def test_token_verified_once(self):
+        """ Repeated requests with the same token are served from the cache """
+        with mock.patch('rest_framework_simplejwt.tokens.AccessToken.verify') as verify:
+            for _ in range(3):
+                self.assertEqual(self.client.get(reverse('users')).status_code, status.HTTP_200_OK)
+        self.assertEqual(verify.call_count, 1)
+        response_data = json.loads(self.client.get(reverse('metrics')).content)
+        stats = response_data['metrics']['token_cache']
+        self.assertEqual((stats['hits'], stats['misses']), (3, 1))
+
+    def test_expired_entries_dropped(self):
+        """ Cached tokens stop being served at their exp claim """
+        self.assertEqual(self.client.get(reverse('users')).status_code, status.HTTP_200_OK)
+        with mock.patch('api.token_cache.time.time', return_value=2 ** 40):
+            self.assertIsNone(token_cache.get(token_cache.key(self.access.encode())))
+        self.assertEqual(token_cache.stats()['expirations'], 1)
+
+    def test_evictions_counted(self):
+        """ The cache stays bounded, evicting least recently used tokens """
+        with self.settings(TOKEN_CACHE={'MAX_ENTRIES': 1}):
+            self.client.get(reverse('users'))
+            other = str(RefreshToken.for_user(self.admin).access_token)
+            self.client.credentials(HTTP_AUTHORIZATION='JWT ' + other)
+            self.client.get(reverse('users'))
+        stats = token_cache.stats()
+        self.assertEqual((stats['entries'], stats['evictions']), (1, 1))
+
+
+class TokenRevocationTest(APITestCase, URLPatternsTestCase):
+    """ Revocation of rotated refresh tokens """
+
+    urlpatterns = [
+        path('api/auth/', include('api.urls')),
+    ]
+
+    def setUp(self):
+        caches['shared'].clear()
+        revocation_registry.rebuild()
+        self.admin = User.objects.create_superuser(
+            email='admin@test.com',
+            password='admin',
+        )
+        self.refresh = str(RefreshToken.for_user(self.admin))
+
+    def test_rotated_token_cannot_be_reused(self):
+        """ A refresh token works once, its rotated successor keeps working """
+        response = self.client.post(reverse('token_refresh'), {'refresh': self.refresh})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        rotated = json.loads(response.content)['refresh']
+
+        response = self.client.post(reverse('token_refresh'), {'refresh': self.refresh})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        response = self.client.post(reverse('token_refresh'), {'refresh': rotated})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_unrevoked_token_skips_store(self):
+        """ The Bloom filter answers for tokens that were never revoked """
+        with mock.patch.object(revocation_registry.store, 'contains') as contains:
+            response = self.client.post(reverse('token_refresh'), {'refresh': self.refresh})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        contains.assert_not_called()
+
+    def test_revocations_from_other_workers(self):
+        """ Revocations written to the shared store reach this worker's filter """
+        other_worker = RevocationRegistry()
+        token = RefreshToken(self.refresh)
+        other_worker.revoke(token['jti'], token['exp'])
+        with self.settings(TOKEN_REVOCATION=dict(settings.TOKEN_REVOCATION, SYNC_INTERVAL=0)):
+            response = self.client.post(reverse('token_refresh'), {'refresh': self.refresh})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_concurrent_refresh(self):
+        """ Of two refreshes racing with the same token, only one rotates it """
+        token = RefreshToken(self.refresh)
+        # The other request revoked it after this one's is_revoked() check
+        with mock.patch.object(revocation_registry, 'is_revoked', return_value=False):
+            RevocationRegistry().revoke(token['jti'], token['exp'])
+            response = self.client.post(reverse('token_refresh'), {'refresh': self.refresh})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_shared_cache_required(self):
+        """ Workers refuse to keep revocations in a per-process cache """
+        self.assertIsInstance(caches['shared'], LocMemCache)
+        with self.settings(DEBUG=False), self.assertRaisesMessage(ImproperlyConfigured, "'shared'"):
+            require_shared_caches()
+        self.assertEqual({error.id for error in check_shared_caches(None)}, {'api.E001'})
+        self.assertTrue(any("BASIC_AUTH_CACHE['CACHE']" in error.msg for error in check_shared_caches(None)))
+
+        with tempfile.TemporaryDirectory() as directory:
+            shared = {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                      'LOCATION': directory}
+            with self.settings(DEBUG=False, CACHES=dict(settings.CACHES, shared=shared)):
+                require_shared_caches()
+                self.assertEqual(check_shared_caches(None), [])
+
+
+class RevocationRegistryTest(SimpleTestCase):
+    """ Bloom filter and in-memory revocation store """
+
+    def test_bloom_filter_has_no_false_negatives(self):
+        bloom = BloomFilter(1000, 0.01)
+        items = ['jti-%d' % i for i in range(1000)]
+        for item in items:
+            bloom.add(item)
+        self.assertTrue(all(item in bloom for item in items))
+        false_positives = sum('other-%d' % i in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+    def test_compaction_drops_expired_tokens(self):
+        registry = RevocationRegistry(store=InMemoryRevocationStore())
+        now = time.time()
+        registry.revoke('expired', now - 1)
+        registry.revoke('live', now + 60)
+        self.assertEqual(registry.compact(), 1)
+        self.assertTrue(registry.is_revoked('live'))
+        self.assertFalse(registry.is_revoked('expired'))
+
+
+class AsyncViewsTest(APITransactionTestCase, URLPatternsTestCase):
+    """
+    Native async auth and user list views.
+    A transaction test case since logins check passwords on pool threads.
+    """
+    # Including read replicas, which mirror the primary in tests
+    databases = '__all__'
+
+    urlpatterns = [
+        path('async/register', AsyncAuthUserRegistrationView.as_view(), name='async_register'),
+        path('async/login', AsyncAuthUserLoginView.as_view(), name='async_login'),
+        path('async/users', AsyncUserListView.as_view(), name='async_users'),
+    ]
+
+    def setUp(self):
+        user_resolver.clear()
+        self.admin = User.objects.create_superuser(
+            email='admin@test.com',
+            password='admin',
+        )
+        User.objects.create_user(email='test1@test.com', password='test')
+
+    async def test_register(self):
+        """ Registration validates, rejects duplicates and creates the user """
+        data = {'email': 'new@Test.com', 'password': 'x7#Lq9!vRt'}
+        response = await self.async_client.post(reverse('async_register'), data,
+                                                content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(json.loads(response.content)['user'], {'email': 'new@test.com'})
+        user = await User.objects.aget(email='new@test.com')
+        self.assertTrue(user.check_password('x7#Lq9!vRt'))
+
+        response = await self.async_client.post(reverse('async_register'), data,
+                                                content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('email', json.loads(response.content))
+
+    async def test_login_and_list(self):
+        """ Tokens issued by the async login work on the async user list """
+        response = await self.async_client.post(
+            reverse('async_login'), {'email': 'admin@test.com', 'password': 'wrong'},
+            content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = await self.async_client.post(
+            reverse('async_login'), {'email': 'admin@test.com', 'password': 'admin'},
+            content_type='application/json')
+        response_data = json.loads(response.content)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response_data['authenticatedUser']['role'], str(User.ADMIN))
+
+        headers = {'Authorization': 'JWT ' + response_data['access']}
+        response = await self.async_client.get(reverse('async_users'), {'limit': 1}, headers=headers)
+        response_data = json.loads(response.content)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response_data['users']), 1)
+
+        response = await self.async_client.get(
+            reverse('async_users'), {'cursor': response_data['next']}, headers=headers)
+        response_data = json.loads(response.content)
+        self.assertEqual(response_data['users'], [{'email': 'test1@test.com', 'role': User.STUDENT}])
+        self.assertIsNone(response_data['next'])
+
+    async def test_list_denied_to_students(self):
+        """ The async user list keeps the admin-only rule """
+        headers = {'Authorization': 'JWT ' + str(RefreshToken.for_user(
+            await User.objects.aget(email='test1@test.com')).access_token)}
+        response = await self.async_client.get(reverse('async_users'), headers=headers)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = await self.async_client.get(reverse('async_users'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    async def test_throttle_checked_off_the_sync_thread(self):
+        """ Throttle checks do not queue behind the one thread sync code shares """
+        threads = []
+
+        def check(ip, email):
+            threads.append(threading.current_thread())
+            return 1
+
+        with mock.patch('api.async_views.login_throttle.check', side_effect=check):
+            response = await self.async_client.post(reverse('async_login'), {'email': 'admin@test.com'},
+                                                    content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], threading.main_thread())
+
+    async def test_executor_closes_connections(self):
+        """ Pool threads querying the database give their connection back """
+        with mock.patch('api.passwords.close_old_connections') as close_old_connections:
+            exists = await run_in_password_executor(User.objects.filter(email='test1@test.com').exists)
+        self.assertTrue(exists)
+        self.assertEqual(close_old_connections.call_count, 2)
+
+
+class RequestTimingMiddlewareTest(APITestCase, URLPatternsTestCase):
+    """ Per-request profiling and Server-Timing output """
+
+    urlpatterns = [
+        path('api/auth/', include('api.urls')),
+    ]
+
+    def setUp(self):
+        reset_latency_stats()
+        self.admin = User.objects.create_superuser(
+            email='admin@test.com',
+            password='admin',
+        )
+
+    def server_timing(self, response):
+        metrics = {}
+        for metric in response['Server-Timing'].split(', '):
+            name, *params = metric.split(';')
+            metrics[name] = dict(param.split('=', 1) for param in params)
+        return metrics
+
+    @override_settings(REQUEST_PROFILING={'SERVER_TIMING': True})
+    def test_login_timings(self):
+        """ Login reports its queries, validation and hashing time """
+        data = {'email': 'admin@test.com', 'password': 'admin'}
+        response = self.client.post(reverse('login'), data)
+        metrics = self.server_timing(response)
+        self.assertEqual(set(metrics), {'db', 'validation', 'hashing', 'total'})
+        self.assertEqual(metrics['db']['desc'], '"1 queries"')
+        self.assertGreater(float(metrics['hashing']['dur']), 0)
+        self.assertEqual(latency_stats()['login']['count'], 1)
+
+    def test_server_timing_off_in_production(self):
+        """ Clients only see the internals when asked for """
+        data = {'email': 'admin@test.com', 'password': 'admin'}
+        with self.settings(DEBUG=False):
+            self.assertNotIn('Server-Timing', self.client.post(reverse('login'), data))
+        with self.settings(DEBUG=True):
+            self.assertIn('Server-Timing', self.client.post(reverse('login'), data))
+        with self.settings(DEBUG=False, REQUEST_PROFILING={'SERVER_TIMING': True}):
+            self.assertIn('Server-Timing', self.client.post(reverse('login'), data))
+        # Still measured
+        self.assertEqual(latency_stats()['login']['count'], 3)
+
+    def test_histograms_per_url_name(self):
+        """ Latency histograms are kept per URL name and exposed as metrics """
+        self.client.force_authenticate(user=self.admin)
+        for _ in range(3):
+            self.client.get(reverse('users'))
+        response_data = json.loads(self.client.get(reverse('metrics')).content)
+        latency = response_data['metrics']['latency']
+        self.assertEqual(latency['users']['count'], 3)
+        self.assertIsNotNone(latency['users']['p99_ms'])
+
+
+class BenchmarkSuiteTest(APITransactionTestCase):
+    """ The benchmark suite drives every endpoint and reports machine-readable results """
+
+    def test_run_suite(self):
+        report = run_suite([20], ['register', 'login', 'token_create', 'token_refresh', 'users'],
+                           requests=2, concurrency=1)
+        json.dumps(report)
+        self.assertEqual(User.objects.filter(email__startswith='seed-').count(), 20)
+        runs = {run['scenario']: run for run in report['runs']}
+        self.assertEqual(len(runs), 5)
+        for run in runs.values():
+            self.assertEqual(run['errors'], 0, run['scenario'])
+            self.assertEqual(run['users'], 20)
+            self.assertIsNotNone(run['latency_ms']['p99'])
+        self.assertEqual(runs['login']['queries_per_request'], 1)
+
+    def test_schedule_benchmark(self):
+        report = run_suite([], [], requests=1, concurrency=1, schedule_sections=40)
+        schedule = report['schedule']
+        self.assertEqual(schedule['sections'], 40)
+        self.assertGreater(schedule['enrolled'], 0)
+        # Independent of the number of requests: the locks, four loads, the inserts
+        self.assertLess(schedule['enrollment_queries'], 25)
+
+    def test_registration_benchmark(self):
+        """ The lean registration path saves the uniqueness query """
+        report = run_suite([], [], requests=1, concurrency=1, registration_requests=2)
+        registration = report['registration']
+        self.assertEqual(registration['baseline']['queries_per_request'], 2)
+        self.assertEqual(registration['current']['queries_per_request'], 1)
+        self.assertLess(registration['common_passwords_bytes']['current'],
+                        registration['common_passwords_bytes']['baseline'])
+
+
+class FastListSerializationTest(APITestCase, URLPatternsTestCase):
+    """ Fast-path list serialization and JSON rendering """
+
+    urlpatterns = [
+        path('api/auth/', include('api.urls')),
+    ]
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser(
+            email='admin@test.com',
+            password='admin',
+        )
+        User.objects.bulk_create([
+            User(email='jos\u00e9@test.com'),
+            User(email='line\u2028sep@test.com'),
+            User(email='norole@test.com', role=None),
+        ])
+
+    def test_fast_path_matches_model_serializer(self):
+        """ values_list rows serialize exactly like model instances """
+        users = User.objects.order_by('id')
+        self.assertEqual(
+            UserListSerializer.serialize_rows(users.values_list('email', 'role')),
+            UserListSerializer(users, many=True).data
+        )
+
+    def test_renderer_is_byte_compatible(self):
+        """ FastJSONRenderer renders the same bytes as DRF's JSONRenderer """
+        users = UserListSerializer(User.objects.order_by('id'), many=True).data
+        data = {'success': True, 'status_code': 200, 'message': 'Successfully fetched users',
+                'next': None, 'users': users, 'created': self.admin.created_date}
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_list_response_unchanged(self):
+        """ The users list keeps its envelope and content """
+        self.client.force_authenticate(user=self.admin)
+        response = self.client.get(reverse('users'))
+        users = UserListSerializer(User.objects.order_by('created_date', 'id'), many=True).data
+        expected = {'success': True, 'status_code': 200, 'message': 'Successfully fetched users',
+                    'next': None, 'users': users}
+        self.assertEqual(response.content, JSONRenderer().render(expected))
+
+
+class ConditionalUserListTest(APITestCase, URLPatternsTestCase):
+    """ ETag/Last-Modified revalidation and versioned page cache of the users list """
+
+    urlpatterns = [
+        path('api/auth/', include('api.urls')),
+    ]
+
+    def setUp(self):
+        caches['shared'].clear()
+        self.admin = User.objects.create_superuser(
+            email='admin@test.com',
+            password='admin',
+        )
+        self.client.force_authenticate(user=self.admin)
+
+    def test_not_modified_without_reading_rows(self):
+        """ A current ETag gets a 304 and no query """
+        response = self.client.get(reverse('users'))
+        etag = response['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('users'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+
+        last_modified = response['Last-Modified']
+        response = self.client.get(reverse('users'), HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        User.objects.create_user(email='test1@test.com', password='test')
+        response = self.client.get(reverse('users'), HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_writes_change_etag(self):
+        """ Creating, changing or deleting users invalidates the ETag """
+        etag = self.client.get(reverse('users'))['ETag']
+        student = User.objects.create_user(email='test1@test.com', password='test')
+        response = self.client.get(reverse('users'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(json.loads(response.content)['users']), 2)
+
+        etag = response['ETag']
+        student.delete()
+        response = self.client.get(reverse('users'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        etag = response['ETag']
+        User.objects.bulk_create_users([{'email': 'bulk@test.com', 'password': 'test'}])
+        response = self.client.get(reverse('users'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_deactivation_changes_etag(self):
+        """ ?is_active= pages change when users are deactivated, singly or in bulk """
+        student = User.objects.create_user(email='test1@test.com', password='test',
+                                           created_date=timezone.now() - datetime.timedelta(days=800))
+        etag = self.client.get(reverse('users'), {'is_active': 'true'})['ETag']
+        student.is_active = False
+        student.save(update_fields=['is_active'])
+        response = self.client.get(reverse('users'), {'is_active': 'true'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(json.loads(response.content)['users']), 1)
+
+        User.objects.filter(pk=student.pk).update(is_active=True)
+        etag = self.client.get(reverse('users'), {'is_active': 'false'})['ETag']
+        DeactivateGraduatesJob(timezone.localdate(), sleep=0).run()
+        response = self.client.get(reverse('users'), {'is_active': 'false'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_etag_varies_with_query(self):
+        """ Each page has its own ETag """
+        self.assertNotEqual(self.client.get(reverse('users'))['ETag'],
+                            self.client.get(reverse('users'), {'limit': 1})['ETag'])
+
+    def test_page_cache(self):
+        """ Pages are served from the cache until the version changes """
+        with self.settings(USER_LIST=dict(settings.USER_LIST, PAGE_CACHE_TTL=60)):
+            first = self.client.get(reverse('users'))
+            with self.assertNumQueries(0):
+                second = self.client.get(reverse('users'))
+            self.assertEqual(first.content, second.content)
+            User.objects.create_user(email='test1@test.com', password='test')
+            third = self.client.get(reverse('users'))
+        self.assertEqual(len(json.loads(third.content)['users']), 2)
+
+
+class UserListFilterTest(APITestCase, URLPatternsTestCase):
+    """ Filtering and email prefix search of the users list """
+
+    urlpatterns = [
+        path('api/auth/', include('api.urls')),
+    ]
+
+    def setUp(self):
+        caches['shared'].clear()
+        self.admin = User.objects.create_superuser(
+            email='admin@test.com',
+            password='admin',
+        )
+        User.objects.bulk_create([
+            User(email='alice@school.com', created_date=timezone.make_aware(datetime.datetime(2024, 1, 10, 12))),
+            User(email='alan@school.com', created_date=timezone.make_aware(datetime.datetime(2024, 2, 10, 12)),
+                 is_active=False),
+            User(email='bob@school.com', created_date=timezone.make_aware(datetime.datetime(2024, 3, 10, 12))),
+        ])
+        self.client.force_authenticate(user=self.admin)
+
+    def emails(self, params):
+        response = self.client.get(reverse('users'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [user['email'] for user in json.loads(response.content)['users']]
+
+    def test_filters(self):
+        """ Every filter narrows the list, and they combine """
+        self.assertEqual(self.emails({'role': User.ADMIN}), ['admin@test.com'])
+        self.assertEqual(self.emails({'is_active': 'false'}), ['alan@school.com'])
+        self.assertEqual(self.emails({'email': 'al'}), ['alice@school.com', 'alan@school.com'])
+        self.assertEqual(self.emails({'email': 'al', 'is_active': 'true'}), ['alice@school.com'])
+        self.assertEqual(self.emails({'created_after': '2024-02-10', 'created_before': '2024-03-10'}),
+                         ['alan@school.com', 'bob@school.com'])
+        self.assertEqual(self.emails({'created_before': '2024-02-10T11:00:00'}), ['alice@school.com'])
+
+    def test_filtered_stream(self):
+        """ Streaming applies the same filters """
+        response = self.client.get(reverse('users'), {'stream': 'true', 'role': User.STUDENT})
+        emails = [user['email'] for user in json.loads(b''.join(response.streaming_content))['users']]
+        self.assertEqual(emails, ['alice@school.com', 'alan@school.com', 'bob@school.com'])
+
+    def test_invalid_filters(self):
+        """ Malformed filter values are a 400 naming the parameter """
+        for params in ({'role': 9}, {'is_active': 'maybe'}, {'created_after': 'yesterday'}):
+            response = self.client.get(reverse('users'), params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn(next(iter(params)), json.loads(response.content)['message'])
+
+
+class UserListFilterIndexTest(TestCase):
+    """ Every users list filter is answered from an index on a large table """
+
+    def setUp(self):
+        start = timezone.make_aware(datetime.datetime(2020, 1, 1))
+        User.objects.bulk_create(
+            User(
+                email='user%05d@test.com' % i,
+                role=User.ADMIN if i % 100 == 0 else User.STUDENT,
+                is_active=i % 50 != 0,
+                created_date=start + datetime.timedelta(hours=i),
+            )
+            for i in range(5000)
+        )
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def assertIndexed(self, params):
+        # Built the way UserListView builds its pages
+        paginator = KeysetPaginator(page_size=100, max_page_size=100)
+        cursor = encode_cursor(timezone.make_aware(datetime.datetime(2020, 2, 1)), 0)
+        queryset = paginator.seek(filter_users(User.objects.all(), params), cursor)
+        plan = queryset.values_list(*UserListSerializer.Meta.fields)[:101].explain()
+        if connection.vendor == 'postgresql':
+            self.assertNotIn('Seq Scan', plan, msg='%s:\n%s' % (params, plan))
+        else:
+            for line in plan.splitlines():
+                self.assertFalse('SCAN api_user' in line and 'USING' not in line,
+                                 msg='%s:\n%s' % (params, plan))
+
+    def test_filters_use_indexes(self):
+        for params in (
+            {},
+            {'role': str(User.ADMIN)},
+            {'is_active': 'false'},
+            {'is_active': 'true'},
+            {'created_after': '2020-03-01', 'created_before': '2020-03-02'},
+            {'email': 'user0012'},
+            {'role': str(User.ADMIN), 'is_active': 'true'},
+        ):
+            self.assertIndexed(params)
+
+
+class UserExportTest(APITestCase, URLPatternsTestCase):
+    """ Streaming CSV/NDJSON exports of the user table """
+
+    urlpatterns = [
+        path('api/auth/', include('api.urls')),
+    ]
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser(
+            email='admin@test.com',
+            password='admin',
+        )
+        User.objects.bulk_create(
+            User(email='student%d@test.com' % i) for i in range(25)
+        )
+        self.ids = list(User.objects.order_by('id').values_list('id', flat=True))
+        self.client.force_authenticate(user=self.admin)
+
+    def test_csv(self):
+        """ The CSV export has a header and every user in id order, without passwords """
+        response = self.client.get(reverse('users_export'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual([int(row['id']) for row in rows], self.ids)
+        self.assertNotIn('password', rows[0])
+        self.assertEqual(rows[0]['email'], 'admin@test.com')
+
+    def test_gzipped_ndjson_resume(self):
+        """ A resumed gzipped export appended to the first part reads back whole """
+        response = self.client.get(reverse('users_export'),
+                                   {'output': 'ndjson', 'gzip': 'true', 'after_id': self.ids[9]})
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        lines = gzip.decompress(b''.join(response.streaming_content)).decode().splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in lines], self.ids[10:])
+
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'users.ndjson.gz')
+            stderr = io.StringIO()
+            call_command('export_users', format='ndjson', gzip=True, output=output,
+                         chunk_size=4, stderr=stderr)
+            self.assertIn('last id %d' % self.ids[-1], stderr.getvalue())
+
+            User.objects.create_user(email='late@test.com', password='x7#Lq9!vRt')
+            call_command('export_users', format='ndjson', gzip=True, output=output,
+                         after_id=self.ids[-1], stderr=io.StringIO())
+            with gzip.open(output, 'rt') as f:
+                emails = [json.loads(line)['email'] for line in f]
+        self.assertEqual(len(emails), len(self.ids) + 1)
+        self.assertEqual(emails[-1], 'late@test.com')
+
+    def test_interrupted_gzip_resume(self):
+        """ An export killed mid-chunk resumes from the last reported id into a readable file """
+        class Killed(Exception):
+            pass
+
+        class KilledAfterProgress(io.StringIO):
+            def write(self, text):
+                super().write(text)
+                if 'Exported' in text:
+                    raise Killed
+
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'users.csv.gz')
+            stderr = KilledAfterProgress()
+            with self.assertRaises(Killed):
+                call_command('export_users', gzip=True, output=output, chunk_size=10, stderr=stderr)
+            last_id = int(stderr.getvalue().rsplit('last id ', 1)[1].split()[0])
+            self.assertEqual(last_id, self.ids[9])
+            # Reported rows are on disk, then the next chunk was cut short
+            with gzip.open(output, 'rt') as f:
+                self.assertEqual(len(list(csv.DictReader(f))), 10)
+            with open(output, 'ab') as f:
+                f.write(gzip.compress(b'half,written,chunk\n')[:15])
+
+            call_command('export_users', gzip=True, output=output, chunk_size=10,
+                         after_id=last_id, stderr=io.StringIO())
+            with gzip.open(output, 'rt') as f:
+                rows = list(csv.DictReader(f))
+        self.assertEqual([int(row['id']) for row in rows], self.ids)
+
+    def test_invalid_parameters(self):
+        for params in ({'output': 'xml'}, {'after_id': 'abc'}):
+            response = self.client.get(reverse('users_export'), params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_admins_only(self):
+        student = User.objects.get(email='student0@test.com')
+        self.client.force_authenticate(user=student)
+        response = self.client.get(reverse('users_export'))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class ImportUsersTest(APITestCase):
+    """ CSV imports with the import_users command """
+
+    def setUp(self):
+        User.objects.create_user(email='taken@test.com', password='x7#Lq9!vRt')
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write_csv(self, rows):
+        path = os.path.join(self.directory.name, 'users.csv')
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['email', 'password'])
+            writer.writerows(rows)
+        return path
+
+    def test_import(self):
+        """ Valid new rows are created, duplicates and invalid rows skipped """
+        path = self.write_csv([
+            ['first@TEST.com', 'x7#Lq9!vRt'],
+            ['second@test.com', ''],
+            ['first@test.com', 'other'],
+            ['taken@test.com', 'other'],
+            ['not-an-email', 'x7#Lq9!vRt'],
+            ['third@test.com', 'x7#Lq9!vRt'],
+        ])
+        otp_output = os.path.join(self.directory.name, 'otp.csv')
+        stdout, stderr = io.StringIO(), io.StringIO()
+        with CaptureQueriesContext(connection) as queries:
+            call_command('import_users', path, otp_output=otp_output, batch_size=4,
+                         stdout=stdout, stderr=stderr)
+        # One duplicate check and one insert per batch of 4 rows, the user
+        # counts being flushed afterwards
+        statements = [query['sql'].split(' ', 1)[0] for query in queries.captured_queries
+                      if '"api_user"' in query['sql']]
+        self.assertEqual(statements.count('SELECT'), 2)
+        self.assertEqual(statements.count('INSERT'), 2)
+
+        self.assertTrue(User.objects.get(email='first@test.com').check_password('x7#Lq9!vRt'))
+        self.assertEqual(User.objects.get(email='third@test.com').role, User.STUDENT)
+        with open(otp_output, newline='') as f:
+            otp = list(csv.DictReader(f))
+        self.assertEqual([row['email'] for row in otp], ['second@test.com'])
+        self.assertTrue(User.objects.get(email='second@test.com').check_password(otp[0]['password']))
+        self.assertEqual(User.objects.count(), 4)
+        self.assertIn('Line 6', stderr.getvalue())
+        self.assertIn('rows/s', stdout.getvalue())
+
+    def test_rows_without_password_need_otp_output(self):
+        path = self.write_csv([['first@test.com', '']])
+        call_command('import_users', path, stdout=io.StringIO(), stderr=io.StringIO())
+        self.assertFalse(User.objects.filter(email='first@test.com').exists())
+
+
+@override_settings(READ_REPLICAS={'ALIASES': ['replica'], 'PIN_SECONDS': 5, 'PIN_COOKIE': 'lms_primary'})
+class PrimaryReplicaRouterTest(SimpleTestCase):
+    """ Read replica routing and pinning to the primary after writes """
+
+    def setUp(self):
+        self.router = PrimaryReplicaRouter()
+
+    def run_request(self, view, cookies=None):
+        # Each request runs in its own context, like under a server
+        request = RequestFactory().get('/')
+        request.COOKIES.update(cookies or {})
+        middleware = ReplicaPinningMiddleware(view)
+        return contextvars.copy_context().run(middleware, request)
+
+    def test_reads_go_to_replicas_until_written(self):
+        def view(request):
+            routes.append(self.router.db_for_read(User))
+            self.assertEqual(self.router.db_for_write(User), 'default')
+            routes.append(self.router.db_for_read(User))
+            return HttpResponse()
+
+        routes = []
+        response = self.run_request(view)
+        self.assertEqual(routes, ['replica', 'default'])
+        self.assertEqual(response.cookies['lms_primary']['max-age'], 5)
+
+    def test_pin_cookie(self):
+        """ Clients that just wrote read from the primary, others from replicas """
+        def view(request):
+            routes.append(self.router.db_for_read(User))
+            return HttpResponse()
+
+        routes = []
+        self.assertNotIn('lms_primary', self.run_request(view, {'lms_primary': '1'}).cookies)
+        self.run_request(view)
+        self.assertEqual(routes, ['default', 'replica'])
+
+    def test_pin_expires(self):
+        def run():
+            pin_to_primary()
+            pinned = self.router.db_for_read(User)
+            with mock.patch('api.routers.time.monotonic', return_value=time.monotonic() + 6):
+                return pinned, self.router.db_for_read(User)
+
+        self.assertEqual(contextvars.copy_context().run(run), ('default', 'replica'))
+
+    def test_login_pins(self):
+        """ Buffered last_login updates pin like writes """
+        def view(request):
+            last_login_buffer.record(User(pk=1))
+            return HttpResponse()
+
+        self.addCleanup(last_login_buffer._pending.clear)
+        self.assertIn('lms_primary', self.run_request(view).cookies)
+
+
+class FakeConnection:
+    """ In-process stand-in for a psycopg connection """
+
+    def __init__(self):
+        self.closed = False
+        self.autocommit = True
+        self.healthy = True
+        self.info = mock.Mock(transaction_status=0)
+        self.rollbacks = 0
+
+    def cursor(self):
+        if not self.healthy:
+            raise OSError('server closed the connection unexpectedly')
+        return mock.MagicMock()
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.info.transaction_status = 0
+
+    def close(self):
+        self.closed = True
+
+
+class ConnectionPoolTest(SimpleTestCase):
+    """ Connection pool sizing, health checks, eviction and metrics """
+
+    def make_pool(self, **kwargs):
+        kwargs.setdefault('health_check', check_connection)
+        return ConnectionPool(FakeConnection, **kwargs)
+
+    def test_reuse_and_limits(self):
+        pool = self.make_pool(min_size=1, max_size=2, timeout=0.05)
+        pool.fill()
+        first = pool.getconn()
+        second = pool.getconn()
+        self.assertIsNot(first, second)
+        with self.assertRaises(PoolTimeout):
+            pool.getconn()
+        pool.putconn(first)
+        self.assertIs(pool.getconn(), first)
+
+        stats = pool.stats()
+        self.assertEqual((stats['size'], stats['in_use'], stats['idle']), (2, 2, 0))
+        self.assertEqual((stats['checkouts'], stats['timeouts']), (3, 1))
+        self.assertEqual(stats['checkout_latency']['count'], 3)
+
+    def test_waits_for_a_returned_connection(self):
+        pool = self.make_pool(max_size=1)
+        connection = pool.getconn()
+        timer = threading.Timer(0.05, pool.putconn, (connection,))
+        timer.start()
+        self.assertIs(pool.getconn(), connection)
+        timer.join()
+        self.assertGreaterEqual(pool.stats()['wait_time']['mean_ms'], 10)
+
+    def test_health_check(self):
+        """ Dead connections are replaced on checkout """
+        pool = self.make_pool()
+        connection = pool.getconn()
+        pool.putconn(connection)
+        connection.healthy = False
+        replacement = pool.getconn()
+        self.assertIsNot(replacement, connection)
+        self.assertTrue(connection.closed)
+        self.assertEqual(pool.stats()['health_check_failures'], 1)
+        self.assertEqual(pool.stats()['size'], 1)
+
+    def test_idle_eviction(self):
+        """ Connections idle too long are closed, down to min_size """
+        pool = self.make_pool(min_size=1, max_idle=60)
+        connections = [pool.getconn() for _ in range(3)]
+        for connection in connections:
+            pool.putconn(connection)
+        with mock.patch('api.pool.time.monotonic', return_value=time.monotonic() + 61):
+            pool.getconn()
+        self.assertEqual([connection.closed for connection in connections], [True, True, False])
+        self.assertEqual(pool.stats()['evictions'], 2)
+
+    def test_backend_returns_connections_to_the_pool(self):
+        """ The pooled engine checks out on connect and returns on close """
+        settings_dict = dict(connection.settings_dict, OPTIONS={}, NAME='lms')
+        wrapper = PooledDatabaseWrapper(settings_dict, alias='pool_test')
+        self.addCleanup(close_pools, 'pool_test')
+        with mock.patch.object(postgresql_base.DatabaseWrapper, 'get_new_connection',
+                               side_effect=lambda conn_params: FakeConnection()) as connect, \
+                self.settings(DATABASE_POOL={'MIN_SIZE': 1}):
+            first = wrapper.get_new_connection({'dbname': 'lms'})
+            wrapper.connection = first
+            first.info.transaction_status = 3  # left in a failed transaction
+            wrapper._close()
+            self.assertEqual(first.rollbacks, 1)
+
+            self.assertIs(wrapper.get_new_connection({'dbname': 'lms'}), first)
+            wrapper.connection = first
+            first.closed = True
+            wrapper._close()
+            self.assertIsNot(wrapper.get_new_connection({'dbname': 'lms'}), first)
+        # One to fill the pool to MIN_SIZE, then the replacement
+        self.assertEqual(connect.call_count, 2)
+        self.assertIn('pool_test:lms', pool_stats())
+
+    def test_forked_process_gets_own_pool(self):
+        """ A child never uses nor closes the connections it inherited """
+        settings_dict = dict(connection.settings_dict, OPTIONS={}, NAME='lms')
+        wrapper = PooledDatabaseWrapper(settings_dict, alias='pool_test')
+        self.addCleanup(close_pools, 'pool_test')
+        with mock.patch.object(postgresql_base.DatabaseWrapper, 'get_new_connection',
+                               side_effect=lambda conn_params: FakeConnection()), \
+                self.settings(DATABASE_POOL={'MIN_SIZE': 1}):
+            inherited = wrapper.get_new_connection({'dbname': 'lms'})
+            parent_pool = wrapper.pool
+            idle = parent_pool.getconn()
+            parent_pool.putconn(idle)
+            wrapper.connection = inherited
+
+            with mock.patch('api.pool.os.getpid', return_value=os.getpid() + 1), \
+                    mock.patch('api.db.backends.pooled_postgresql.base.os.getpid',
+                               return_value=os.getpid() + 1):
+                wrapper._close()
+                child = wrapper.get_new_connection({'dbname': 'lms'})
+                self.assertIsNot(wrapper.pool, parent_pool)
+                self.assertNotIn(child, (inherited, idle))
+                close_pools('pool_test')
+        self.assertFalse(inherited.closed or idle.closed)
+        self.assertEqual(parent_pool.stats()['in_use'], 1)
+
+
+class LeanRegistrationTest(APITestCase, URLPatternsTestCase):
+    """ Registration in a single round trip with precompiled password checks """
+
+    urlpatterns = [
+        path('api/auth/', include('api.urls')),
+    ]
+
+    def test_single_insert(self):
+        """ No uniqueness query ahead of the INSERT """
+        data = {'email': 'new@test.com', 'password': 'x7#Lq9!vRt'}
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('register'), data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        # The audit event is written after the response, by the request_finished
+        # fallback when no background writer runs
+        statements = [query['sql'].split(' ', 1)[0] for query in queries.captured_queries
+                      if AuthAuditEvent._meta.db_table not in query['sql']]
+        # The savepoint is only taken inside the test's transaction
+        self.assertEqual([sql for sql in statements if sql not in ('SAVEPOINT', 'RELEASE')], ['INSERT'])
+
+    def test_duplicate_email(self):
+        """ A duplicate is reported like the unique validator did """
+        User.objects.create_user(email='new@test.com', password='x7#Lq9!vRt')
+        data = {'email': 'new@test.com', 'password': 'x7#Lq9!vRt'}
+        response = self.client.post(reverse('register'), data)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(json.loads(response.content),
+                         {'email': ['user with this email already exists.']})
+        # The enclosing transaction is still usable
+        self.assertEqual(User.objects.count(), 1)
+
+    def test_common_passwords(self):
+        validator = CompactCommonPasswordValidator()
+        for password in ('password', ' PassWord123 ', 'qwerty'):
+            with self.assertRaises(ValidationError):
+                validator.validate(password)
+        validator.validate('x7#Lq9!vRt')
+        self.assertEqual(len(validator.fingerprints), len(CommonPasswordValidator().passwords))
+        response = self.client.post(reverse('register'), {'email': 'new@test.com', 'password': 'password123'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('too common', json.loads(response.content)['password'][0])
+
+
+class LoginThrottleTest(APITestCase, URLPatternsTestCase):
+    """ Token bucket throttling of login attempts """
+
+    urlpatterns = [
+        path('api/auth/', include('api.urls')),
+        path('async/login', AsyncAuthUserLoginView.as_view(), name='async_login'),
+    ]
+
+    def setUp(self):
+        caches['shared'].clear()
+        User.objects.create_user(email='student@test.com', password='x7#Lq9!vRt')
+
+    def test_take(self):
+        """ Buckets allow a burst, then refill at the rate """
+        state, wait = take(None, 2, 0.5, 100.0)
+        state, wait = take(state, 2, 0.5, 100.0)
+        self.assertEqual(wait, 0)
+        state, wait = take(state, 2, 0.5, 100.0)
+        self.assertEqual(wait, 2)
+        state, wait = take(state, 2, 0.5, 102.0)
+        self.assertEqual(wait, 0)
+
+    @override_settings(LOGIN_THROTTLE={'EMAIL_RATE': '2/min', 'EMAIL_BURST': 2})
+    def test_email_bucket(self):
+        """ Attempts over the limit are rejected without hashing a password """
+        data = {'email': 'student@test.com', 'password': 'wrong'}
+        for _ in range(2):
+            response = self.client.post(reverse('login'), data)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        before = login_throttle.stats()
+        with mock.patch('api.serializers.authenticate') as authenticate:
+            response = self.client.post(reverse('login'), dict(data, email=' Student@test.com'))
+            self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            self.assertEqual(response['Retry-After'], '30')
+            response = self.client.post(reverse('token_create'), data)
+            self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            response = self.client.post(reverse('async_login'), data)
+            self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            self.assertEqual(response['Retry-After'], '30')
+        authenticate.assert_not_called()
+        self.assertEqual(login_throttle.stats()['rejected_by_email'], before['rejected_by_email'] + 3)
+
+        # Other emails are still let through
+        response = self.client.post(reverse('login'), {'email': 'other@test.com', 'password': 'wrong'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(LOGIN_THROTTLE={'IP_RATE': '1/min', 'IP_BURST': 1})
+    def test_ip_bucket(self):
+        data = {'email': 'student@test.com', 'password': 'x7#Lq9!vRt'}
+        response = self.client.post(reverse('login'), data)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.post(reverse('login'), data, REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.post(reverse('login'), data)
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response['Retry-After'], '60')
+
+    @override_settings(LOGIN_THROTTLE={'IP_RATE': '1/min', 'IP_BURST': 1})
+    def test_spoofed_forwarded_for(self):
+        """ X-Forwarded-For set by the client does not get it a fresh bucket """
+        data = {'email': 'student@test.com', 'password': 'x7#Lq9!vRt'}
+        response = self.client.post(reverse('login'), data, HTTP_X_FORWARDED_FOR='198.51.100.1')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.post(reverse('token_create'), data, HTTP_X_FORWARDED_FOR='198.51.100.2')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+        # Behind a trusted proxy its X-Forwarded-For tells clients apart
+        with self.settings(REST_FRAMEWORK=dict(settings.REST_FRAMEWORK, NUM_PROXIES=1)):
+            response = self.client.post(reverse('login'), data, HTTP_X_FORWARDED_FOR='198.51.100.3')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_token_create_skips_authentication(self):
+        """ A Basic auth header on token_create hashes no password before throttling """
+        credentials = base64.b64encode(b'student@test.com:wrong').decode()
+        with override_settings(LOGIN_THROTTLE={'IP_RATE': '1/min', 'IP_BURST': 0}), \
+                mock.patch('api.authentication.CachedBasicAuthentication.authenticate') as basic:
+            response = self.client.post(reverse('token_create'), {'email': 'student@test.com'},
+                                        HTTP_AUTHORIZATION='Basic ' + credentials)
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        basic.assert_not_called()
+
+    def test_cache_store_concurrent(self):
+        """ Concurrent attempts on a shared bucket never take more than it holds """
+        store = CacheBucketStore(cache='shared', lock_wait=5)
+        barrier = threading.Barrier(20)
+        waits = []
+
+        def slow_take(*args):
+            # Widens the window between reading and writing the bucket
+            time.sleep(0.002)
+            return take(*args)
+
+        def attempt():
+            barrier.wait()
+            waits.append(store.consume('ip:flood', 5, 1 / 3600))
+
+        with mock.patch('api.throttling.take', side_effect=slow_take):
+            threads = [threading.Thread(target=attempt) for _ in range(20)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(waits.count(0), 5)
+
+    def test_cache_store_contended(self):
+        """ An attempt that cannot lock the bucket is rejected, not let through """
+        store = CacheBucketStore(cache='shared', lock_wait=0.01)
+        caches['shared'].add('login-throttle:ip:busy:lock', 1)
+        self.assertEqual(store.consume('ip:busy', 5, 0.5), 2)
+        caches['shared'].delete('login-throttle:ip:busy:lock')
+        self.assertEqual(store.consume('ip:busy', 5, 0.5), 0)
+
+    def test_memory_store(self):
+        store = MemoryBucketStore(max_entries=2)
+        self.assertEqual(store.consume('a', 1, 1), 0)
+        self.assertGreater(store.consume('a', 1, 1), 0)
+        store.consume('b', 1, 1)
+        store.consume('c', 1, 1)
+        # 'a' was evicted, so its bucket is full again
+        self.assertEqual(store.consume('a', 1, 1), 0)
+
+
+
+class AuthAuditLogTest(APITestCase, URLPatternsTestCase):
+    """ Queued, batched authentication audit log """
+
+    urlpatterns = [
+        path('api/auth/', include('api.urls')),
+    ]
+
+    def setUp(self):
+        caches['shared'].clear()
+        audit_log.flush()
+        self.user = User.objects.create_user(email='student@test.com', password='x7#Lq9!vRt')
+        self.admin = User.objects.create_user(email='admin@test.com', password='x7#Lq9!vRt',
+                                              role=User.ADMIN)
+
+    def events(self):
+        return list(AuthAuditEvent.objects.order_by('id').values_list('event', 'user_id', 'email'))
+
+    def test_auth_events_written_after_response(self):
+        """ Events are queued by the request and written once it has been answered """
+        data = {'email': 'student@test.com', 'password': 'x7#Lq9!vRt'}
+        with mock.patch('api.signals.audit_log.flush') as flush:
+            response = self.client.post(reverse('login'), data)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        flush.assert_called()
+        self.assertEqual(len(audit_log), 1)
+        self.assertFalse(AuthAuditEvent.objects.exists())
+
+        self.client.post(reverse('login'), dict(data, password='wrong'))
+        refresh = self.client.post(reverse('token_create'), data).json()['refresh']
+        self.client.post(reverse('token_refresh'), {'refresh': refresh})
+        self.client.post(reverse('register'), {'email': 'new@test.com', 'password': 'x7#Lq9!vRt'})
+
+        new_user = User.objects.get(email='new@test.com')
+        self.assertEqual(self.events(), [
+            ('login', self.user.pk, 'student@test.com'),
+            ('login_failed', None, 'student@test.com'),
+            ('login', self.user.pk, 'student@test.com'),
+            ('token_refresh', self.user.pk, ''),
+            ('registration', new_user.pk, 'new@test.com'),
+        ])
+        self.assertEqual(set(AuthAuditEvent.objects.values_list('ip', flat=True)), {'127.0.0.1'})
+
+    def test_drop_policies(self):
+        """ A full queue drops the newest or the oldest event, or waits for room """
+        for policy, kept in (('drop_newest', ['a', 'b']), ('drop_oldest', ['b', 'c']),
+                             ('block', ['a', 'b'])):
+            with override_settings(AUDIT_LOG={'MAX_QUEUE': 2, 'DROP_POLICY': policy,
+                                              'BLOCK_TIMEOUT': 0.01}):
+                log = AuditLog()
+                for email in 'abc':
+                    log.record(AuthAuditEvent.LOGIN, email=email)
+            self.assertEqual([entry.email for entry in log._queue.queue], kept)
+            self.assertEqual(log.stats()['dropped'], 1)
+
+    @override_settings(AUDIT_LOG={'BATCH_SIZE': 2, 'FLUSH_INTERVAL': 0.01})
+    def test_worker_writes_in_batches(self):
+        """ The worker drains the queue in batches and writes what is left when stopped """
+        log = AuditLog()
+        for index in range(5):
+            log.record(AuthAuditEvent.LOGIN, user_id=index)
+        batches = []
+        with mock.patch.object(AuthAuditEvent.objects, 'bulk_create', side_effect=batches.append):
+            log.start()
+            self.assertTrue(log.worker_running())
+            log.stop()
+            self.assertFalse(log.worker_running())
+            log.record(AuthAuditEvent.LOGIN, user_id=5)
+            log.flush()
+        self.assertEqual([[entry.user_id for entry in batch] for batch in batches],
+                         [[0, 1], [2, 3], [4], [5]])
+        self.assertEqual(log.stats()['written'], 6)
+
+    def test_worker_releases_connection(self):
+        """ The worker hands its connection back after each write, not only before """
+        log = AuditLog()
+        log.record(AuthAuditEvent.LOGIN, user_id=1)
+        with mock.patch.object(AuthAuditEvent.objects, 'bulk_create'), \
+                mock.patch('api.audit.close_old_connections') as close:
+            log.start()
+            log.stop()
+        self.assertGreaterEqual(close.call_count, 2)
+
+    def test_discarded_or_written_on_stop(self):
+        """ Events of a dropped database are discarded, a stopping worker writes its own """
+        audit_log.record(AuthAuditEvent.LOGIN, self.user.pk)
+        self.assertEqual(discard_buffers()['audit_log'], 1)
+        self.assertEqual(len(audit_log), 0)
+
+        audit_log.record(AuthAuditEvent.LOGIN, self.user.pk)
+        start_worker_without_threads()
+        stop_worker()
+        self.assertEqual(self.events(), [('login', self.user.pk, '')])
+
+    def test_query_api(self):
+        AuthAuditEvent.objects.bulk_create([
+            AuthAuditEvent(event=AuthAuditEvent.LOGIN, user_id=self.user.pk),
+            AuthAuditEvent(event=AuthAuditEvent.LOGIN_FAILED, email='x@test.com'),
+            AuthAuditEvent(event=AuthAuditEvent.TOKEN_REFRESH, user_id=self.user.pk),
+        ])
+        self.client.force_authenticate(self.user)
+        response = self.client.get(reverse('audit'))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        self.client.force_authenticate(self.admin)
+        response = self.client.get(reverse('audit'), {'user': self.user.pk, 'limit': 1})
+        body = response.json()
+        self.assertEqual([event['event'] for event in body['events']], ['login'])
+        response = self.client.get(reverse('audit'), {'user': self.user.pk, 'cursor': body['next']})
+        self.assertEqual([event['event'] for event in response.json()['events']], ['token_refresh'])
+        self.assertIsNone(response.json()['next'])
+
+        response = self.client.get(reverse('audit'), {'event': 'login_failed',
+                                                      'since': timezone.now().date().isoformat()})
+        self.assertEqual([event['email'] for event in response.json()['events']], ['x@test.com'])
+
+        response = self.client.get(reverse('audit'), {'event': 'logout'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+
+class SchedulingTest(APITestCase, URLPatternsTestCase):
+    """ Courses, sections and enrollments checked against in-memory timetables """
+
+    urlpatterns = [
+        path('api/auth/', include('api.urls')),
+    ]
+
+    MWF = 0b10101
+    TTH = 0b01010
+
+    def setUp(self):
+        self.student = User.objects.create_user(email='student@test.com', password='x7#Lq9!vRt')
+        self.admin = User.objects.create_user(email='admin@test.com', password='x7#Lq9!vRt',
+                                              role=User.ADMIN)
+        self.course = Course.objects.create(code='CS101', title='Programming')
+
+    def section(self, code, days, start, end, room='', capacity=30):
+        return Section.objects.create(course=self.course, code=code, room=room, days=days,
+                                      start_time=datetime.time(*start), end_time=datetime.time(*end),
+                                      capacity=capacity)
+
+    def test_interval_index(self):
+        index = IntervalIndex()
+        index.add(600, 660, 'a')
+        index.add(660, 720, 'b')
+        index.add(0, 1440, 'long')
+        self.assertEqual(sorted(index.overlapping(650, 670)), ['a', 'b', 'long'])
+        # Intervals are half-open
+        self.assertEqual(index.overlapping(720, 780), ['long'])
+        self.assertEqual(index.overlapping(1440, 1500), [])
+
+    def test_find_conflicts(self):
+        slots = [
+            make_slot(1, 'R1', self.MWF, datetime.time(9), datetime.time(10)),
+            make_slot(2, 'R1', self.TTH, datetime.time(9), datetime.time(10)),
+            make_slot(3, 'R2', 0b00001, datetime.time(9, 30), datetime.time(11)),
+            make_slot(4, 'R2', 0b00100, datetime.time(9, 45), datetime.time(11)),
+            make_slot(5, 'R1', self.MWF, datetime.time(10), datetime.time(11)),
+        ]
+        self.assertEqual(find_conflicts(slots), [(1, 3), (1, 4), (3, 5), (4, 5)])
+        self.assertEqual(find_room_conflicts(slots), [])
+        self.assertEqual(Timetable(slots[:2]).conflicts(slots[2]), [1])
+
+    def test_sections_cannot_double_book_rooms(self):
+        self.client.force_authenticate(self.admin)
+        data = {'course': 'CS101', 'code': 'A', 'room': 'R1', 'days': ['mon', 'wed'],
+                'start_time': '09:00', 'end_time': '10:00'}
+        response = self.client.post(reverse('sections'), data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        section_id = response.json()['section']['id']
+
+        response = self.client.post(reverse('sections'), dict(data, code='B', days=['wed'],
+                                                              start_time='09:30'), format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json()['room'], ['Booked at these times by sections %d' % section_id])
+
+        response = self.client.post(reverse('sections'), dict(data, code='B', start_time='10:00',
+                                                              end_time='11:00'), format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        self.client.force_authenticate(self.student)
+        response = self.client.get(reverse('sections'), {'course': 'CS101'})
+        self.assertEqual([(section['code'], section['days']) for section in response.json()['sections']],
+                         [('A', ['mon', 'wed']), ('B', ['mon', 'wed'])])
+        response = self.client.post(reverse('sections'), dict(data, code='C'), format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_enrollment(self):
+        morning = self.section('A', self.MWF, (9,), (10,))
+        overlapping = self.section('B', 0b00100, (9, 30), (10, 30))
+        full = self.section('C', self.TTH, (9,), (10,), capacity=0)
+        self.client.force_authenticate(self.student)
+
+        response = self.client.post(reverse('enrollments'), {'section': morning.pk})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        for section, message in ((morning, 'Already enrolled'), (full, 'Section is full'),
+                                 (overlapping, 'Conflicts with sections %d' % morning.pk)):
+            response = self.client.post(reverse('enrollments'), {'section': section.pk})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(response.json()['message'], message)
+
+        response = self.client.get(reverse('enrollments'))
+        self.assertEqual([section['id'] for section in response.json()['sections']], [morning.pk])
+
+    def test_concurrent_enrollment(self):
+        """ Students are locked, and a pair enrolled meanwhile is reported, not a 500 """
+        morning = self.section('A', self.MWF, (9,), (10,))
+        planner_init = EnrollmentPlanner.__init__
+
+        def racing_init(planner, *args):
+            planner_init(planner, *args)
+            # Enrolled by a concurrent request once the timetables were loaded
+            Enrollment.objects.create(student=self.student, section=morning)
+
+        with mock.patch.object(EnrollmentPlanner, '__init__', racing_init), \
+                mock.patch.object(User.objects, 'select_for_update',
+                                  wraps=User.objects.select_for_update) as lock_students:
+            self.assertEqual(enroll([(self.student.pk, morning.pk)]), ['Already enrolled'])
+        lock_students.assert_called_once_with()
+        self.assertEqual(Enrollment.objects.filter(student=self.student).count(), 1)
+
+    def test_bulk_enrollment(self):
+        """ A batch is checked in memory with a fixed number of queries """
+        sections = [self.section(str(hour), self.MWF, (hour,), (hour, 50), capacity=2)
+                    for hour in range(8, 12)]
+        students = [User.objects.create_user(email='s%d@test.com' % index, password='x7#Lq9!vRt')
+                    for index in range(3)]
+        rows = [{'student': student.pk, 'section': section.pk}
+                for student in students for section in sections]
+        rows.append({'student': students[0].pk, 'section': sections[0].pk})
+        rows.append({'student': students[0].pk})
+
+        self.client.force_authenticate(self.admin)
+        # Counts of the students created above could otherwise be flushed within the request
+        user_stats.flush()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('enrollments_bulk'), {'enrollments': rows},
+                                        format='json')
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        results = response.json()['results']
+        self.assertEqual(sum(result['success'] for result in results), 8)
+        self.assertEqual({result.get('error') for result in results},
+                         {None, 'Section is full', 'Already enrolled',
+                          'Expected integer student and section ids'})
+        self.assertEqual(Enrollment.objects.count(), 8)
+        self.assertLess(len(queries), 15)
+
+
+
+class UserStatsTest(APITestCase, URLPatternsTestCase):
+    """ User counts kept current by signals instead of counting the user table """
+
+    urlpatterns = [
+        path('api/auth/', include('api.urls')),
+    ]
+
+    def setUp(self):
+        self.admin = User.objects.create_user(email='admin@test.com', password='x7#Lq9!vRt',
+                                              role=User.ADMIN)
+        reconcile_user_stats()
+
+    def test_counts_follow_writes(self):
+        student = User.objects.create_user(email='student@test.com', password='x7#Lq9!vRt')
+        User.objects.bulk_create_users([{'email': 's%d@test.com' % i, 'password': 'x7#Lq9!vRt'}
+                                        for i in range(3)])
+        student.is_active = False
+        student.save(update_fields=['is_active'])
+        # Loaded users move their counts too
+        promoted = User.objects.get(email='s0@test.com')
+        promoted.role = User.ADMIN
+        promoted.save()
+        User.objects.filter(email='s1@test.com').delete()
+        old = User.objects.create_user(email='old@test.com', password='x7#Lq9!vRt',
+                                       created_date=timezone.now() - datetime.timedelta(days=3))
+
+        self.assertGreater(len(user_stats), 0)
+        user_stats.flush()
+        self.assertEqual(reconcile_user_stats(dry_run=True), {})
+
+        self.client.force_authenticate(self.admin)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('users_stats'), {'days': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse([query for query in queries if '"api_user"' in query['sql']])
+        stats = response.json()['stats']
+        self.assertEqual(stats['total'], 5)
+        self.assertEqual(stats['by_role'], {'Admin': 2, 'Student': 3})
+        self.assertEqual((stats['active'], stats['inactive']), (4, 1))
+        self.assertEqual(stats['signups_by_day'], {timezone.localdate().isoformat(): 4})
+        self.assertNotIn(timezone.localdate(old.created_date).isoformat(), stats['signups_by_day'])
+
+        response = self.client.get(reverse('users_stats'), {'days': 0})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_reconcile_command(self):
+        """ Writes bypassing the signals are corrected by the reconciliation """
+        User.objects.create_user(email='student@test.com', password='x7#Lq9!vRt')
+        user_stats.flush()
+        User.objects.filter(email='student@test.com').update(is_active=False)
+
+        out = io.StringIO()
+        call_command('reconcile_user_stats', '--dry-run', stdout=out)
+        self.assertIn('is_active=false: 0, counted 1', out.getvalue())
+        self.assertIn('2 user statistics are wrong', out.getvalue())
+        call_command('reconcile_user_stats', stdout=out)
+        self.assertEqual(reconcile_user_stats(dry_run=True), {})
+
+    def test_flushed_on_stop(self):
+        """ A recycled worker writes its pending deltas, the summary does not drift """
+        User.objects.create_user(email='student@test.com', password='x7#Lq9!vRt')
+        self.assertGreater(len(user_stats), 0)
+        start_worker_without_threads()
+        stop_worker()
+        self.assertEqual(len(user_stats), 0)
+        self.assertEqual(reconcile_user_stats(dry_run=True), {})
+
+    def test_discarded_before_teardown(self):
+        """ Deltas of the test database are not flushed into the real one """
+        User.objects.create_user(email='student@test.com', password='x7#Lq9!vRt')
+        self.assertGreater(len(user_stats), 0)
+        with mock.patch('django.test.runner.DiscoverRunner.teardown_databases') as teardown:
+            DiscoverRunner().teardown_databases([])
+        teardown.assert_called_once_with([])
+        self.assertEqual(len(user_stats), 0)
+
+
+
+class PermissionSnapshotTest(APITestCase, URLPatternsTestCase):
+    """ Role and permission checks answered from cached permission snapshots """
+
+    urlpatterns = [
+        path('api/auth/', include('api.urls')),
+    ]
+
+    def setUp(self):
+        permission_cache.clear()
+        self.student = User.objects.create_user(email='student@test.com', password='x7#Lq9!vRt')
+        self.view_user = Permission.objects.get(codename='view_user', content_type__app_label='api')
+        self.group = Group.objects.create(name='registrars')
+
+    def fresh(self):
+        # Like authentication, every check starts from a new instance
+        return User.objects.get(pk=self.student.pk)
+
+    def test_has_perm_cached(self):
+        self.student.groups.add(self.group)
+        self.group.permissions.add(self.view_user)
+        user = self.fresh()
+        with self.assertNumQueries(2):
+            self.assertTrue(user.has_perm('api.view_user'))
+        user = self.fresh()
+        with self.assertNumQueries(0):
+            self.assertTrue(user.has_perm('api.view_user'))
+            self.assertEqual(user.get_all_permissions(), {'api.view_user'})
+            self.assertFalse(user.has_perm('api.delete_user'))
+
+    def test_invalidation(self):
+        """ Grants, group edits and flag changes reach the next check """
+        self.student.user_permissions.add(self.view_user)
+        self.assertTrue(self.fresh().has_perm('api.view_user'))
+        self.student.user_permissions.remove(self.view_user)
+        self.assertFalse(self.fresh().has_perm('api.view_user'))
+
+        self.group.user_set.add(self.student)
+        self.assertFalse(self.fresh().has_perm('api.view_user'))
+        self.group.permissions.add(self.view_user)
+        self.assertTrue(self.fresh().has_perm('api.view_user'))
+        self.group.delete()
+        self.assertFalse(self.fresh().has_perm('api.view_user'))
+
+        self.student.is_superuser = True
+        self.student.save(update_fields=['is_superuser'])
+        self.assertTrue(self.fresh().has_perm('api.delete_user'))
+
+    def test_user_list_permission(self):
+        """ Users granted view_user may list users, without queries for the check once warm """
+        self.client.force_authenticate(self.fresh())
+        response = self.client.get(reverse('users'))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(response.json()['message'], 'You are not authorized to perform this action')
+
+        self.student.user_permissions.add(self.view_user)
+        self.client.force_authenticate(self.fresh())
+        self.assertEqual(self.client.get(reverse('users')).status_code, status.HTTP_200_OK)
+        self.client.force_authenticate(self.fresh())
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('users'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse([query for query in queries if 'auth_permission' in query['sql']])
+
+
+
+class BatchJobTest(APITestCase):
+    """ Chunked, resumable batch updates of users """
+
+    class Interrupted(Exception):
+        pass
+
+    def setUp(self):
+        long_ago = timezone.now() - datetime.timedelta(days=800)
+        self.graduates = [
+            User.objects.create_user(email='graduate%d@test.com' % i, password='x7#Lq9!vRt',
+                                     created_date=long_ago)
+            for i in range(5)
+        ]
+        self.student = User.objects.create_user(email='student@test.com', password='x7#Lq9!vRt')
+        self.admin = User.objects.create_user(email='admin@test.com', password='x7#Lq9!vRt',
+                                              role=User.ADMIN, created_date=long_ago)
+        reconcile_user_stats()
+        self.joined_before = timezone.localdate() - datetime.timedelta(days=365)
+
+    def test_chunked_updates(self):
+        """ Each id range is updated in its own bounded statement """
+        # Cached users see the change right away
+        self.assertTrue(user_resolver.get(self.graduates[0].pk).is_active)
+        with CaptureQueriesContext(connection) as queries:
+            stats = DeactivateGraduatesJob(self.joined_before, chunk_size=2, sleep=0).run()
+        self.assertEqual((stats.rows, stats.chunks), (5, 4))
+        updates = [query['sql'] for query in queries if query['sql'].startswith('UPDATE "api_user"')]
+        self.assertEqual(len(updates), 3)
+        self.assertFalse(User.objects.filter(email__startswith='graduate', is_active=True).exists())
+        self.assertTrue(User.objects.get(pk=self.student.pk).is_active)
+        self.assertTrue(User.objects.get(pk=self.admin.pk).is_active)
+        self.assertFalse(user_resolver.get(self.graduates[0].pk).is_active)
+        self.assertEqual(reconcile_user_stats(dry_run=True), {})
+
+        checkpoint = BatchJobCheckpoint.objects.get(name='deactivate_graduates')
+        self.assertEqual((checkpoint.last_id, checkpoint.rows_updated), (self.admin.pk, 5))
+        self.assertIsNotNone(checkpoint.finished_date)
+
+    def test_dry_run(self):
+        stats = ExpireDormantJob(days=365, dry_run=True, sleep=0).run()
+        self.assertEqual(stats.rows, 5)
+        self.assertEqual(User.objects.filter(is_active=False).count(), 0)
+        self.assertFalse(BatchJobCheckpoint.objects.exists())
+
+    def test_resume(self):
+        """ An interrupted run continues after the last completed range """
+        def interrupt(stats):
+            raise self.Interrupted
+
+        job = DeactivateGraduatesJob(self.joined_before, chunk_size=2, sleep=0, progress=interrupt)
+        with self.assertRaises(self.Interrupted):
+            job.run()
+        self.assertEqual(User.objects.filter(is_active=False).count(), 2)
+
+        stats = DeactivateGraduatesJob(self.joined_before, chunk_size=2, sleep=0).run()
+        self.assertEqual(stats.rows, 3)
+        self.assertEqual(BatchJobCheckpoint.objects.get().rows_updated, 5)
+        # A finished job starts over
+        self.assertEqual(DeactivateGraduatesJob(self.joined_before, sleep=0).run().rows, 0)
+
+    def test_resume_requires_same_options(self):
+        """ A run interrupted under some criteria is not finished under others """
+        def interrupt(stats):
+            raise self.Interrupted
+
+        job = DeactivateGraduatesJob(self.joined_before, chunk_size=2, sleep=0, progress=interrupt)
+        with self.assertRaises(self.Interrupted):
+            job.run()
+        self.assertEqual(BatchJobCheckpoint.objects.get().options,
+                         {'joined_before': self.joined_before.isoformat()})
+
+        other = (self.joined_before - datetime.timedelta(days=1)).isoformat()
+        with self.assertRaisesMessage(CommandError, '--restart'):
+            call_command('run_batch_job', 'deactivate_graduates', '--joined-before', other,
+                         '--sleep', '0', stdout=io.StringIO())
+        self.assertEqual(User.objects.filter(is_active=False).count(), 2)
+
+        out = io.StringIO()
+        call_command('run_batch_job', 'deactivate_graduates', '--joined-before', other,
+                     '--sleep', '0', '--restart', stdout=out)
+        self.assertIn('deactivate_graduates: 3 users changed', out.getvalue())
+        self.assertEqual(BatchJobCheckpoint.objects.get().options, {'joined_before': other})
+
+    def test_throttle(self):
+        job = ExpireDormantJob(days=365, chunk_size=2, sleep=0, max_rows_per_second=100)
+        with mock.patch('api.batch_jobs.time.sleep') as sleep:
+            job.run()
+        self.assertEqual(sleep.call_count, 3)
+        self.assertLessEqual(max(call.args[0] for call in sleep.call_args_list), 0.02)
+
+    def test_command(self):
+        out = io.StringIO()
+        call_command('run_batch_job', 'expire_dormant', '--days', '365', '--sleep', '0', stdout=out)
+        self.assertIn('expire_dormant: 5 users changed in 1 chunks', out.getvalue())
+        # Counts are written before the command returns
+        self.assertEqual(len(user_stats), 0)
+        self.assertEqual(reconcile_user_stats(dry_run=True), {})
+
+
+
+class StartupTest(SimpleTestCase):
+    """ Worker warm-up and the startup import budget """
+
+    def test_warm_up(self):
+        with override_settings(STARTUP={'WARM_UP': ['urls', 'serializers', 'tokens', 'password_validators']}):
+            timings = warm_up()
+        self.assertEqual(list(timings), ['urls', 'serializers', 'tokens', 'password_validators'])
+
+        with override_settings(STARTUP={'WARM_UP': False}):
+            self.assertEqual(warm_up(), {})
+
+    def test_databases_warmed_in_workers(self):
+        """ Importing the application warms what workers share, each worker its connections """
+        warmed = []
+        steps = tuple((name, lambda name=name: warmed.append(name)) for name, step in STEPS)
+        with mock.patch('api.warmup.STEPS', steps):
+            warm_up(SHARED_STEPS)
+            self.assertEqual(warmed, list(SHARED_STEPS))
+
+            with mock.patch('api.lifecycle._started_pid', None), \
+                    mock.patch('api.lifecycle.audit_log.start') as audit_start, \
+                    mock.patch('api.lifecycle.buffer_flusher.start') as flusher_start:
+                start_worker_on_request()
+                self.addCleanup(request_started.disconnect, dispatch_uid='api.lifecycle.start_worker')
+                request_started.send(sender=None)
+                request_started.send(sender=None)
+                self.assertEqual(warmed.count('databases'), 1)
+                audit_start.assert_called_once_with()
+                flusher_start.assert_called_once_with()
+
+                # A forked worker starts its own
+                with mock.patch('api.lifecycle.os.getpid', return_value=os.getpid() + 1):
+                    request_started.send(sender=None)
+                self.assertEqual(warmed.count('databases'), 2)
+
+    def test_failing_step(self):
+        """ A step failing is logged, the worker still starts """
+        def fail():
+            raise RuntimeError('down')
+
+        steps = (('databases', fail), ('urls', lambda: None))
+        with mock.patch('api.warmup.STEPS', steps), self.assertLogs('api.warmup', 'ERROR'):
+            self.assertEqual(list(warm_up()), ['urls'])
+
+    def test_parse_importtime(self):
+        output = (
+            'import time: self [us] | cumulative | imported package\n'
+            'import time:       120 |        120 |   api.conf\n'
+            'import time:       300 |        420 | api.managers\n'
+            'Traceback (most recent call last):\n'
+        )
+        self.assertEqual(parse_importtime(output), [
+            ('api.conf', 0.00012, 0.00012, 1),
+            ('api.managers', 0.0003, 0.00042, 0),
+        ])
+
+    def test_import_budget(self):
+        """ A worker's imports fit in STARTUP['IMPORT_BUDGET'] """
+        imports = measure_imports()
+        modules = {item.module for item in imports}
+        self.assertTrue({'rest_framework_simplejwt.tokens', 'api.serializers', 'api.views'} <= modules)
+        total = sum(item.cumulative for item in imports if item.depth == 0)
+        self.assertLess(total, settings.STARTUP['IMPORT_BUDGET'])
+
+    def test_command(self):
+        out = io.StringIO()
+        call_command('import_time', '--top', '3', '--code', 'import json', stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 5)
+        self.assertIn('budget 3.000s', lines[-1])
+
+        with self.assertRaisesMessage(CommandError, 'budget 0.000s'):
+            call_command('import_time', '--budget', '0', '--code', 'import json', stdout=io.StringIO())
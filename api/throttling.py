@@ -0,0 +1,170 @@
+"""
+Throttling of login attempts.
+
+Each attempt takes a token from the bucket of the client's IP and then from
+the bucket of the email it tries. Buckets hold up to ``*_BURST`` tokens and
+refill at ``*_RATE``. Attempts finding a bucket empty are rejected before any
+password is hashed, with the time until a token is available.
+"""
+import hashlib
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+from rest_framework.throttling import BaseThrottle
+
+from .conf import api_setting
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    """
+    Parses a DRF style rate such as ``'5/min'`` into tokens per second
+    """
+    count, period = rate.split('/')
+    return int(count) / PERIODS[period[0]]
+
+
+def take(state, burst, rate, now):
+    """
+    Takes a token from a bucket in ``state``, ``(tokens, updated)`` or None
+    for a full bucket. Returns the new state and the seconds to wait, 0 when
+    the token was taken.
+    """
+    tokens, updated = state if state is not None else (burst, now)
+    tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+    if tokens >= 1:
+        return (tokens - 1, now), 0.0
+    return (tokens, now), (1 - tokens) / rate
+
+
+class MemoryBucketStore:
+    """
+    Buckets of this process, the least recently used dropped past ``max_entries``
+    """
+
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def consume(self, key, burst, rate):
+        with self._lock:
+            state, wait = take(self._buckets.get(key), burst, rate, time.time())
+            self._buckets[key] = state
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_entries:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class CacheBucketStore:
+    """
+    Buckets in a Django cache, which must be shared by every worker (see
+    api.checks). A bucket is updated under a lock taken with the cache's
+    atomic add(), so concurrent attempts never overdraw it. An attempt that
+    cannot get the lock within ``lock_wait`` seconds, which only happens
+    under a flood on that bucket, is rejected as if it were empty.
+    """
+    # Seconds a lock is held at most, should its holder die
+    lock_timeout = 1
+
+    def __init__(self, cache='default', prefix='login-throttle', lock_wait=0.05):
+        self.cache = caches[cache]
+        self.prefix = prefix
+        self.lock_wait = lock_wait
+
+    def consume(self, key, burst, rate):
+        key = '%s:%s' % (self.prefix, key)
+        lock = '%s:lock' % key
+        deadline = time.monotonic() + self.lock_wait
+        while not self.cache.add(lock, 1, self.lock_timeout):
+            if time.monotonic() >= deadline:
+                return 1 / rate
+            time.sleep(0.001)
+        try:
+            state, wait = take(self.cache.get(key), burst, rate, time.time())
+            # An untouched bucket is full again once this has passed
+            self.cache.set(key, state, math.ceil(burst / rate))
+        finally:
+            self.cache.delete(lock)
+        return wait
+
+
+class LoginThrottle:
+    """
+    Per IP and per email token buckets guarding the login endpoints
+    """
+
+    def __init__(self, store=None):
+        self._store = store
+        self._lock = threading.Lock()
+        self.accepted = 0
+        self.rejected = {'ip': 0, 'email': 0}
+
+    @property
+    def store(self):
+        if self._store is None:
+            store_class = import_string(api_setting('LOGIN_THROTTLE', 'STORE'))
+            self._store = store_class(**api_setting('LOGIN_THROTTLE', 'OPTIONS'))
+        return self._store
+
+    def check(self, ip, email):
+        """
+        Takes a token for an attempt, returns the seconds to wait when rejected
+        or None
+        """
+        buckets = [('ip', ip)]
+        if email:
+            # Hashed, any string can be posted as the email
+            buckets.append(('email', hashlib.sha256(email.strip().lower().encode()).hexdigest()))
+        for scope, value in buckets:
+            rate = api_setting('LOGIN_THROTTLE', '%s_RATE' % scope.upper())
+            if rate is None or value is None:
+                continue
+            wait = self.store.consume('%s:%s' % (scope, value),
+                                      api_setting('LOGIN_THROTTLE', '%s_BURST' % scope.upper()),
+                                      parse_rate(rate))
+            if wait:
+                with self._lock:
+                    self.rejected[scope] += 1
+                return wait
+        with self._lock:
+            self.accepted += 1
+        return None
+
+    def stats(self):
+        with self._lock:
+            return {
+                'accepted': self.accepted,
+                'rejected_by_ip': self.rejected['ip'],
+                'rejected_by_email': self.rejected['email'],
+            }
+
+
+login_throttle = LoginThrottle()
+
+
+class LoginRateThrottle(BaseThrottle):
+    """
+    DRF throttle applying login_throttle. Throttles run before the view, so
+    rejected attempts never reach authenticate().
+    """
+
+    def allow_request(self, request, view):
+        # get_ident() reads X-Forwarded-For only behind REST_FRAMEWORK['NUM_PROXIES'] proxies
+        email = request.data.get('email') if hasattr(request.data, 'get') else None
+        self.wait_seconds = login_throttle.check(self.get_ident(request),
+                                                 email if isinstance(email, str) else None)
+        return self.wait_seconds is None
+
+    def wait(self):
+        return self.wait_seconds
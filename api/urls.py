@@ -1,16 +1,43 @@
+from django.conf import settings
 from django.urls import path
 from rest_framework_simplejwt import views as jwt_views
 
 from .views import (
     AuthUserRegistrationView,
+    AuthUserBulkRegistrationView,
     AuthUserLoginView,
-    UserListView
+    UserListView,
+    UserExportView,
+    UserStatsView,
+    MetricsView,
+    AuditLogView,
+    CourseListView,
+    SectionListView,
+    EnrollmentView,
+    BulkEnrollmentView,
+    TokenObtainPairView
 )
 
+if settings.API_ASYNC_VIEWS:
+    from .async_views import (
+        AsyncAuthUserRegistrationView as AuthUserRegistrationView,
+        AsyncAuthUserLoginView as AuthUserLoginView,
+        AsyncUserListView as UserListView
+    )
+
 urlpatterns = [
-    path('token/obtain/', jwt_views.TokenObtainPairView.as_view(), name='token_create'),
+    path('token/obtain/', TokenObtainPairView.as_view(), name='token_create'),
     path('token/refresh/', jwt_views.TokenRefreshView.as_view(), name='token_refresh'),
     path('users/register', AuthUserRegistrationView.as_view(), name='register'),
+    path('users/register/bulk', AuthUserBulkRegistrationView.as_view(), name='register_bulk'),
     path('users/login', AuthUserLoginView.as_view(), name='login'),
-    path('users', UserListView.as_view(), name='users')
+    path('users', UserListView.as_view(), name='users'),
+    path('users/export', UserExportView.as_view(), name='users_export'),
+    path('users/stats', UserStatsView.as_view(), name='users_stats'),
+    path('metrics', MetricsView.as_view(), name='metrics'),
+    path('audit', AuditLogView.as_view(), name='audit'),
+    path('courses', CourseListView.as_view(), name='courses'),
+    path('sections', SectionListView.as_view(), name='sections'),
+    path('enrollments', EnrollmentView.as_view(), name='enrollments'),
+    path('enrollments/bulk', BulkEnrollmentView.as_view(), name='enrollments_bulk')
 ]
\ No newline at end of file
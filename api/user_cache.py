@@ -0,0 +1,123 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+
+from .conf import api_setting
+from .models import User
+
+
+class UserResolver:
+    """
+    Resolves user ids to User instances carrying only the fields needed for
+    authorization, from a bounded in-process LRU backed by an optional shared
+    cache. Other fields are deferred and load from the database on access.
+
+    Entries are invalidated by signals on User (see api.signals). Since those
+    only reach the current process, local entries also expire after
+    USER_CACHE['LOCAL_TTL'] seconds.
+    """
+    # Must follow the model's field order, which Model.from_db relies on
+    fields = ('id', 'is_superuser', 'email', 'role', 'is_active')
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _shared_cache(self):
+        alias = api_setting('USER_CACHE', 'CACHE')
+        return caches[alias] if alias else None
+
+    def _key(self, pk):
+        return 'user-cache:%s' % pk
+
+    def _build(self, values):
+        return User.from_db(DEFAULT_DB_ALIAS, list(self.fields), values)
+
+    def get(self, pk):
+        """
+        Returns the user with primary key ``pk`` or None if there is none
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(pk)
+            if entry is not None:
+                values, expires = entry
+                if expires > now:
+                    self._entries.move_to_end(pk)
+                    return self._build(values)
+                del self._entries[pk]
+
+        values = self.fetch(pk)
+        if values is None:
+            return None
+        self._remember(pk, values, now)
+        return self._build(values)
+
+    def fetch(self, pk):
+        """
+        Loads the authorization fields from the shared cache or the database
+        """
+        cache = self._shared_cache()
+        if cache is not None:
+            values = cache.get(self._key(pk))
+            if values is not None:
+                return values
+
+        values = User.objects.filter(pk=pk).values_list(*self.fields).first()
+        if values is not None and cache is not None:
+            cache.set(self._key(pk), values, api_setting('USER_CACHE', 'TTL'))
+        return values
+
+    async def aget(self, pk):
+        """
+        Async counterpart of get
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(pk)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(pk)
+                return self._build(entry[0])
+
+        values = await self.afetch(pk)
+        if values is None:
+            return None
+        self._remember(pk, values, now)
+        return self._build(values)
+
+    async def afetch(self, pk):
+        cache = self._shared_cache()
+        if cache is not None:
+            values = await cache.aget(self._key(pk))
+            if values is not None:
+                return values
+
+        values = await User.objects.filter(pk=pk).values_list(*self.fields).afirst()
+        if values is not None and cache is not None:
+            await cache.aset(self._key(pk), values, api_setting('USER_CACHE', 'TTL'))
+        return values
+
+    def _remember(self, pk, values, now):
+        max_entries = api_setting('USER_CACHE', 'MAX_ENTRIES')
+        with self._lock:
+            self._entries[pk] = (values, now + api_setting('USER_CACHE', 'LOCAL_TTL'))
+            self._entries.move_to_end(pk)
+            while len(self._entries) > max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, pk):
+        with self._lock:
+            self._entries.pop(pk, None)
+        cache = self._shared_cache()
+        if cache is not None:
+            cache.delete(self._key(pk))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+user_resolver = UserResolver()
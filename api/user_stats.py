@@ -0,0 +1,188 @@
+"""
+User counts for admin dashboards, maintained incrementally.
+
+Every user write that can move a count (see api.signals) adds +1/-1 deltas
+to an in-memory buffer, written like the last_login buffer: in one
+transaction once enough keys are pending or the oldest delta is old enough,
+checked after each request and by the background flusher of api.buffers,
+and written out when a serving process stops (see api.lifecycle), so
+recycling workers does not lose deltas.
+Writes that bypass the model and manager (QuerySet.update(), raw SQL) are
+only caught by ``manage.py reconcile_user_stats``, which recounts everything.
+"""
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+
+from django.db import DatabaseError, IntegrityError, transaction
+from django.db.models import Count, F, Q
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .conf import api_setting
+from .models import User, UserStatistic
+
+
+class UserStatsBuffer:
+    """
+    Pending count deltas, by (dimension, key)
+    """
+
+    def __init__(self):
+        self._pending = Counter()
+        self._oldest = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, keys, delta):
+        with self._lock:
+            for key in keys:
+                self._pending[key] += delta
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+
+    def created(self, users):
+        for user in users:
+            self.add(UserStatistic.keys_for(user), 1)
+            user._counted_as = UserStatistic.keys_for(user)
+
+    def changed(self, user):
+        """
+        Moves the counts of a saved user loaded from the database
+        """
+        before = getattr(user, '_counted_as', None)
+        if before is None:
+            return
+        after = UserStatistic.keys_for(user)
+        if after != before:
+            self.add(set(before) - set(after), -1)
+            self.add(set(after) - set(before), 1)
+            user._counted_as = after
+
+    def deleted(self, user):
+        self.add(getattr(user, '_counted_as', None) or UserStatistic.keys_for(user), -1)
+
+    def is_due(self):
+        oldest = self._oldest
+        if oldest is None:
+            return False
+        return (len(self._pending) >= api_setting('USER_STATS', 'FLUSH_SIZE')
+                or time.monotonic() - oldest >= api_setting('USER_STATS', 'FLUSH_INTERVAL'))
+
+    def flush_if_due(self):
+        if self.is_due():
+            return self.flush()
+        return 0
+
+    def flush(self):
+        """
+        Applies every pending delta, returns the number of counts changed
+        """
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+            self._oldest = None
+        pending = {key: delta for key, delta in pending.items() if delta}
+        if not pending:
+            return 0
+
+        try:
+            with transaction.atomic():
+                for (dimension, key), delta in sorted(pending.items()):
+                    apply_delta(dimension, key, delta)
+        except DatabaseError:
+            # Keep the deltas for the next flush
+            with self._lock:
+                self._pending.update(pending)
+                if self._oldest is None:
+                    self._oldest = time.monotonic()
+            raise
+        return len(pending)
+
+    def discard(self):
+        """
+        Drops every pending delta, returns how many keys had one
+        """
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+            self._oldest = None
+        return len(pending)
+
+
+def apply_delta(dimension, key, delta):
+    statistics = UserStatistic.objects.filter(dimension=dimension, key=key)
+    if statistics.update(count=F('count') + delta):
+        return
+    try:
+        with transaction.atomic():
+            UserStatistic.objects.create(dimension=dimension, key=key, count=delta)
+    except IntegrityError:
+        # Created by a concurrent flush meanwhile
+        statistics.update(count=F('count') + delta)
+
+
+def count_users():
+    """
+    Counts every (dimension, key) from the user table, three GROUP BY scans
+    """
+    users = User.objects.order_by()
+    counts = {}
+    for role, count in users.values_list('role').annotate(Count('id')):
+        counts[(UserStatistic.ROLE, '' if role is None else str(role))] = count
+    for is_active, count in users.values_list('is_active').annotate(Count('id')):
+        counts[(UserStatistic.IS_ACTIVE, 'true' if is_active else 'false')] = count
+    days = users.annotate(day=TruncDate('created_date')).values_list('day').annotate(Count('id'))
+    for day, count in days:
+        counts[(UserStatistic.SIGNUP_DAY, day.isoformat())] = count
+    return counts
+
+
+def reconcile_user_stats(dry_run=False):
+    """
+    Recounts the users and rewrites the summary table to match. Returns the
+    counts that were wrong, as {(dimension, key): (stored, actual)}.
+
+    Deltas still buffered by other processes are applied on top afterwards,
+    so counts changed while this runs can be off until the next run.
+    """
+    # Buffered deltas of this process are already in the recount
+    user_stats.flush()
+    with transaction.atomic():
+        # Serializes with concurrent flushes and reconciliations on PostgreSQL
+        stored = {(dimension, key): count for dimension, key, count in
+                  UserStatistic.objects.select_for_update().values_list('dimension', 'key', 'count')}
+        actual = count_users()
+        drift = {
+            key: (stored.get(key, 0), actual.get(key, 0))
+            for key in set(stored) | set(actual)
+            if stored.get(key, 0) != actual.get(key, 0)
+        }
+        if drift and not dry_run:
+            UserStatistic.objects.all().delete()
+            UserStatistic.objects.bulk_create(
+                UserStatistic(dimension=dimension, key=key, count=count)
+                for (dimension, key), count in actual.items() if count
+            )
+    return drift
+
+
+def get_user_stats(days):
+    """
+    The counts by role and is_active, and the signups of the last ``days``
+    days, read from the summary table alone
+    """
+    since = (timezone.localdate() - timedelta(days=days - 1)).isoformat()
+    rows = UserStatistic.objects.filter(
+        Q(dimension__in=[UserStatistic.ROLE, UserStatistic.IS_ACTIVE])
+        | Q(dimension=UserStatistic.SIGNUP_DAY, key__gte=since)
+    )
+    stats = {UserStatistic.ROLE: {}, UserStatistic.IS_ACTIVE: {}, UserStatistic.SIGNUP_DAY: {}}
+    for dimension, key, count in rows.values_list('dimension', 'key', 'count'):
+        if count:
+            stats[dimension][key] = count
+    return stats
+
+
+user_stats = UserStatsBuffer()
@@ -0,0 +1,78 @@
+"""
+Version of the users list, changed by every write that can alter it.
+
+The version is a random token stored with the time it was set, so it serves
+both as an ETag and a Last-Modified validator. A token lost to cache eviction
+is replaced by a fresh one, which can never match an ETag a client holds.
+It is kept until the next write, in USER_LIST['CACHE'], which must be shared
+by every worker (see api.checks).
+"""
+import hashlib
+import uuid
+from datetime import timedelta
+
+from django.core.cache import caches
+from django.utils import timezone
+from django.utils.http import urlencode
+
+from .conf import api_setting
+
+USERS_VERSION_KEY = 'users:version'
+
+
+def _cache():
+    return caches[api_setting('USER_LIST', 'CACHE')]
+
+
+def _new_version(previous=None):
+    last_modified = timezone.now().replace(microsecond=0)
+    if previous is not None and last_modified <= previous[1]:
+        # Last-Modified has one second resolution but must still move forward
+        last_modified = previous[1] + timedelta(seconds=1)
+    return uuid.uuid4().hex, last_modified
+
+
+def get_users_version():
+    """
+    Returns the current (token, last_modified) pair
+    """
+    cache = _cache()
+    version = cache.get(USERS_VERSION_KEY)
+    if version is None:
+        cache.add(USERS_VERSION_KEY, _new_version(), None)
+        version = cache.get(USERS_VERSION_KEY)
+    return version
+
+
+async def aget_users_version():
+    cache = _cache()
+    version = await cache.aget(USERS_VERSION_KEY)
+    if version is None:
+        await cache.aadd(USERS_VERSION_KEY, _new_version(), None)
+        version = await cache.aget(USERS_VERSION_KEY)
+    return version
+
+
+def bump_users_version():
+    cache = _cache()
+    cache.set(USERS_VERSION_KEY, _new_version(cache.get(USERS_VERSION_KEY)), None)
+
+
+def variant_key(token, query_params):
+    """
+    Identifies one representation of the list: a version and the query string
+    """
+    query = urlencode(sorted(query_params.lists()), doseq=True)
+    return '%s-%s' % (token, hashlib.md5(query.encode()).hexdigest()[:12])
+
+
+def get_cached_page(variant):
+    if not api_setting('USER_LIST', 'PAGE_CACHE_TTL'):
+        return None
+    return _cache().get('users:page:%s' % variant)
+
+
+def set_cached_page(variant, data):
+    ttl = api_setting('USER_LIST', 'PAGE_CACHE_TTL')
+    if ttl:
+        _cache().set('users:page:%s' % variant, data, ttl)
@@ -1,16 +1,41 @@
+from django.http import StreamingHttpResponse
 from django.shortcuts import render
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 from rest_framework import status
+from rest_framework.exceptions import PermissionDenied
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.renderers import BrowsableAPIRenderer
+from rest_framework_simplejwt import views as jwt_views
 
 from .serializers import (
+    DUPLICATE_EMAIL,
     AuthUserRegistrationSerializer,
+    BulkRegistrationRowSerializer,
     AuthUserLoginSerializer,
+    AuthAuditEventSerializer,
+    CourseSerializer,
+    SectionSerializer,
     UserListSerializer
 )
 
-from .models import User
+from .audit import audit_log
+from .conf import api_setting
+from .exports import CONTENT_TYPES, ENCODERS, export_users
+from .filters import InvalidFilter, filter_audit_events, filter_users
+from .models import AuthAuditEvent, Course, Section, User, UserStatistic
+from .pagination import InvalidCursor, KeysetPaginator, stream_json_envelope
+from .permissions import CanViewUsers, IsAdminRole
+from .pool import pool_stats
+from .profiling import latency_stats
+from .renderers import FastJSONRenderer
+from .scheduling import enroll
+from .throttling import LoginRateThrottle, login_throttle
+from .token_cache import token_cache
+from .user_stats import get_user_stats, user_stats
+from .user_version import get_cached_page, get_users_version, set_cached_page, variant_key
 
 
 class AuthUserRegistrationView(APIView):
@@ -22,7 +47,8 @@ class AuthUserRegistrationView(APIView):
         valid = serializer.is_valid(raise_exception=True)
 
         if valid:
-            serializer.save()
+            user = serializer.save()
+            audit_log.record(AuthAuditEvent.REGISTRATION, user.pk, user.email, request)
             status_code = status.HTTP_201_CREATED
 
             response = {
@@ -35,12 +61,89 @@ class AuthUserRegistrationView(APIView):
             return Response(response, status=status_code)
         
 
+class AuthUserBulkRegistrationView(APIView):
+    """
+    Registers a batch of users in one request, reporting success or failure per row.
+    Restricted to admins.
+    """
+    serializer_class = BulkRegistrationRowSerializer
+    permission_classes = (IsAdminRole, )
+
+    def post(self, request):
+        rows = request.data.get('users') if isinstance(request.data, dict) else None
+        max_rows = api_setting('BULK_REGISTRATION', 'MAX_ROWS')
+        if not isinstance(rows, list) or not rows or len(rows) > max_rows:
+            status_code = status.HTTP_400_BAD_REQUEST
+            response = {
+                'success': False,
+                'statusCode': status_code,
+                'message': 'Expected a list of 1 to %d users' % max_rows
+            }
+            return Response(response, status=status_code)
+
+        results = []
+        valid = []
+        seen = set()
+        for index, row in enumerate(rows):
+            serializer = self.serializer_class(data=row)
+            if serializer.is_valid():
+                email = User.objects.normalize_email(serializer.validated_data['email'])
+                if email in seen:
+                    # Repeats an earlier row of the batch
+                    results.append({'index': index, 'email': email, 'success': False,
+                                    'errors': {'email': [DUPLICATE_EMAIL]}})
+                    continue
+                seen.add(email)
+                results.append({'index': index, 'email': email, 'success': True})
+                valid.append(serializer.validated_data)
+            else:
+                email = row.get('email') if isinstance(row, dict) else None
+                results.append({'index': index, 'email': email, 'success': False,
+                                'errors': serializer.errors})
+
+        created = set()
+        for user in User.objects.bulk_create_users(valid):
+            created.add(user.email)
+            audit_log.record(AuthAuditEvent.REGISTRATION, user.pk, user.email, request)
+        missing = [result['email'] for result in results
+                   if result['success'] and result['email'] not in created]
+        taken = set(User.objects.filter(email__in=missing).values_list('email', flat=True)) if missing else set()
+        for result in results:
+            if not result['success'] or result['email'] in created:
+                continue
+            if result['email'] in taken:
+                result['success'] = False
+                result['errors'] = {'email': [DUPLICATE_EMAIL]}
+            else:
+                result['success'] = False
+                result['errors'] = {'non_field_errors': ['The user could not be created.']}
+
+        created_count = sum(result['success'] for result in results)
+        if created_count == len(results):
+            status_code = status.HTTP_201_CREATED
+        elif created_count:
+            status_code = status.HTTP_207_MULTI_STATUS
+        else:
+            status_code = status.HTTP_400_BAD_REQUEST
+
+        response = {
+            'success': created_count > 0,
+            'statusCode': status_code,
+            'message': '%d of %d users successfully registered' % (created_count, len(results)),
+            'results': results
+        }
+        return Response(response, status=status_code)
+
+
 class AuthUserLoginView(APIView):
     serializer_class = AuthUserLoginSerializer
+    # No authentication, a Basic auth header would hash a password before throttling
+    authentication_classes = ()
     permission_classes = (AllowAny, )
+    throttle_classes = (LoginRateThrottle, )
 
     def post(self, request):
-        serializer = self.serializer_class(data=request.data)
+        serializer = self.serializer_class(data=request.data, context={'request': request})
         valid = serializer.is_valid(raise_exception=True)
 
         if valid:
@@ -61,26 +164,425 @@ class AuthUserLoginView(APIView):
             return Response(response, status=status_code)
         
 class UserListView(APIView):
+    """
+    Lists users one keyset page at a time (``?cursor=&limit=``), or the whole
+    table as a streamed JSON document with ``?stream=true``.
+    Filters: ``role``, ``is_active``, ``created_after``, ``created_before`` and
+    ``email`` (prefix), see api.filters.
+    """
     serializer_class = UserListSerializer
-    permission_classes = (IsAuthenticated,)
+    permission_classes = (CanViewUsers,)
+    renderer_classes = (FastJSONRenderer, BrowsableAPIRenderer)
 
-    def get(self, request):
-        user = request.user
-        if user.role != 2:
+    def handle_exception(self, exc):
+        if isinstance(exc, PermissionDenied):
             response = {
                 'success': False,
                 'status_code': status.HTTP_403_FORBIDDEN,
-                'message': 'You are not authorized to perform this action'
+                'message': str(exc.detail)
             }
             return Response(response, status.HTTP_403_FORBIDDEN)
-        else:
-            users = User.objects.all()
-            serializer = self.serializer_class(users, many=True)
+        return super().handle_exception(exc)
+
+    def get(self, request):
+        # Answer revalidations from the list version alone, without reading rows
+        token, last_modified = get_users_version()
+        variant = variant_key(token, request.query_params)
+        not_modified = get_conditional_response(
+            request, etag='"%s"' % variant, last_modified=int(last_modified.timestamp())
+        )
+        if not_modified is not None:
+            return self.set_validators(not_modified, variant, last_modified)
+
+        paginator = KeysetPaginator(
+            api_setting('USER_LIST', 'PAGE_SIZE'),
+            api_setting('USER_LIST', 'MAX_PAGE_SIZE'),
+        )
+        cursor = request.query_params.get('cursor')
+        try:
+            users = filter_users(User.objects.all(), request.query_params)
+            users = paginator.seek(users, cursor)
+        except (InvalidCursor, InvalidFilter) as e:
+            response = {
+                'success': False,
+                'status_code': status.HTTP_400_BAD_REQUEST,
+                'message': str(e) if isinstance(e, InvalidFilter) else 'Invalid cursor'
+            }
+            return Response(response, status=status.HTTP_400_BAD_REQUEST)
+
+        if request.query_params.get('stream') in ('1', 'true'):
+            return self.set_validators(self.stream(users), variant, last_modified)
+
+        response = get_cached_page(variant)
+        if response is None:
+            limit = paginator.get_limit(request.query_params.get('limit'))
+            fields = self.serializer_class.Meta.fields
+            rows, next_cursor = paginator.paginate_values(users, None, limit, fields)
             response = {
                 'success': True,
                 'status_code': status.HTTP_200_OK,
                 'message': 'Successfully fetched users',
-                'users': serializer.data
+                'next': next_cursor,
+                'users': self.serializer_class.serialize_rows(rows)
+            }
+            set_cached_page(variant, response)
+        return self.set_validators(Response(response, status=status.HTTP_200_OK),
+                                   variant, last_modified)
 
+    def set_validators(self, response, variant, last_modified):
+        response['ETag'] = '"%s"' % variant
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+        return response
+
+    def stream(self, users):
+        chunk_size = api_setting('USER_LIST', 'STREAM_CHUNK_SIZE')
+
+        rows = users.values_list(*self.serializer_class.Meta.fields)
+
+        def chunks():
+            chunk = []
+            for row in rows.iterator(chunk_size=chunk_size):
+                chunk.append(row)
+                if len(chunk) == chunk_size:
+                    yield self.serializer_class.serialize_rows(chunk)
+                    chunk = []
+            yield self.serializer_class.serialize_rows(chunk)
+
+        envelope = {
+            'success': True,
+            'status_code': status.HTTP_200_OK,
+            'message': 'Successfully fetched users',
+        }
+        return StreamingHttpResponse(
+            stream_json_envelope(envelope, 'users', chunks()),
+            content_type='application/json'
+        )
+
+
+class UserStatsView(APIView):
+    """
+    User counts by role and is_active, and signups per day over the last
+    ``?days=`` days, read from the summary table rather than counting users.
+    Restricted to admins.
+    """
+    permission_classes = (IsAdminRole, )
+    renderer_classes = (FastJSONRenderer, BrowsableAPIRenderer)
+
+    def get(self, request):
+        days = request.query_params.get('days')
+        try:
+            days = int(days) if days else api_setting('USER_STATS', 'SIGNUP_DAYS')
+        except ValueError:
+            days = 0
+        max_days = api_setting('USER_STATS', 'MAX_SIGNUP_DAYS')
+        if not 1 <= days <= max_days:
+            response = {
+                'success': False,
+                'status_code': status.HTTP_400_BAD_REQUEST,
+                'message': 'days must be between 1 and %d' % max_days
+            }
+            return Response(response, status=status.HTTP_400_BAD_REQUEST)
+
+        # Counts changed by this process are not left waiting for the buffer
+        user_stats.flush()
+        stats = get_user_stats(days)
+        roles = dict(User.ROLE_CHOICES)
+        by_active = stats[UserStatistic.IS_ACTIVE]
+        response = {
+            'success': True,
+            'status_code': status.HTTP_200_OK,
+            'message': 'Successfully fetched user statistics',
+            'stats': {
+                'total': sum(by_active.values()),
+                'by_role': {roles.get(int(key), key) if key else 'None': count
+                            for key, count in stats[UserStatistic.ROLE].items()},
+                'active': by_active.get('true', 0),
+                'inactive': by_active.get('false', 0),
+                'signups_by_day': stats[UserStatistic.SIGNUP_DAY],
+            }
+        }
+        return Response(response, status=status.HTTP_200_OK)
+
+
+class UserExportView(APIView):
+    """
+    Streams every user as CSV or NDJSON (``?output=csv|ndjson``), gzipped with
+    ``?gzip=true``. ``?after_id=`` resumes an interrupted export.
+    Restricted to admins.
+    """
+    permission_classes = (IsAdminRole, )
+
+    def get(self, request):
+        output = request.query_params.get('output', 'csv')
+        after_id = request.query_params.get('after_id')
+        try:
+            if output not in ENCODERS:
+                raise ValueError('output must be one of %s' % ', '.join(sorted(ENCODERS)))
+            if after_id is not None:
+                if not after_id.isdigit():
+                    raise ValueError('after_id must be a user id')
+                after_id = int(after_id)
+        except ValueError as e:
+            response = {
+                'success': False,
+                'status_code': status.HTTP_400_BAD_REQUEST,
+                'message': str(e)
+            }
+            return Response(response, status=status.HTTP_400_BAD_REQUEST)
+
+        compress = request.query_params.get('gzip') in ('1', 'true')
+        filename = 'users.%s' % output
+        if compress:
+            filename += '.gz'
+        response = StreamingHttpResponse(
+            export_users(output, after_id=after_id, compress=compress),
+            content_type='application/gzip' if compress else CONTENT_TYPES[output]
+        )
+        response['Content-Disposition'] = 'attachment; filename="%s"' % filename
+        return response
+
+
+class AuditLogView(APIView):
+    """
+    Lists authentication audit events, oldest first, one keyset page at a
+    time (``?cursor=&limit=``). Filters: ``user``, ``event``, ``since`` and
+    ``until``, see api.filters. Restricted to admins.
+    """
+    serializer_class = AuthAuditEventSerializer
+    permission_classes = (IsAdminRole, )
+    renderer_classes = (FastJSONRenderer, BrowsableAPIRenderer)
+
+    def get(self, request):
+        paginator = KeysetPaginator(
+            api_setting('AUDIT_LOG', 'PAGE_SIZE'),
+            api_setting('AUDIT_LOG', 'MAX_PAGE_SIZE'),
+        )
+        try:
+            events = filter_audit_events(AuthAuditEvent.objects.all(), request.query_params)
+            events = paginator.seek(events, request.query_params.get('cursor'))
+        except (InvalidCursor, InvalidFilter) as e:
+            response = {
+                'success': False,
+                'status_code': status.HTTP_400_BAD_REQUEST,
+                'message': str(e) if isinstance(e, InvalidFilter) else 'Invalid cursor'
+            }
+            return Response(response, status=status.HTTP_400_BAD_REQUEST)
+
+        limit = paginator.get_limit(request.query_params.get('limit'))
+        rows, next_cursor = paginator.paginate(events, None, limit)
+        response = {
+            'success': True,
+            'status_code': status.HTTP_200_OK,
+            'message': 'Successfully fetched audit events',
+            'next': next_cursor,
+            'events': self.serializer_class(rows, many=True).data
+        }
+        return Response(response, status=status.HTTP_200_OK)
+
+
+class CourseListView(APIView):
+    """
+    Lists the course catalogue; admins add courses
+    """
+    serializer_class = CourseSerializer
+    renderer_classes = (FastJSONRenderer, BrowsableAPIRenderer)
+
+    def get_permissions(self):
+        if self.request.method == 'POST':
+            return [IsAdminRole()]
+        return [IsAuthenticated()]
+
+    def get(self, request):
+        courses = Course.objects.order_by('code')
+        response = {
+            'success': True,
+            'status_code': status.HTTP_200_OK,
+            'message': 'Successfully fetched courses',
+            'courses': self.serializer_class(courses, many=True).data
+        }
+        return Response(response, status=status.HTTP_200_OK)
+
+    def post(self, request):
+        serializer = self.serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        status_code = status.HTTP_201_CREATED
+        response = {
+            'success': True,
+            'status_code': status_code,
+            'message': 'Course successfully created',
+            'course': serializer.data
+        }
+        return Response(response, status=status_code)
+
+
+class SectionListView(APIView):
+    """
+    Lists sections, of one course with ``?course=<code>``; admins add
+    sections, which must not double-book their room
+    """
+    serializer_class = SectionSerializer
+    renderer_classes = (FastJSONRenderer, BrowsableAPIRenderer)
+
+    def get_permissions(self):
+        if self.request.method == 'POST':
+            return [IsAdminRole()]
+        return [IsAuthenticated()]
+
+    def get(self, request):
+        sections = Section.objects.select_related('course').order_by('course__code', 'code')
+        course = request.query_params.get('course')
+        if course:
+            sections = sections.filter(course__code=course)
+        response = {
+            'success': True,
+            'status_code': status.HTTP_200_OK,
+            'message': 'Successfully fetched sections',
+            'sections': self.serializer_class(sections, many=True).data
+        }
+        return Response(response, status=status.HTTP_200_OK)
+
+    def post(self, request):
+        serializer = self.serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        status_code = status.HTTP_201_CREATED
+        response = {
+            'success': True,
+            'status_code': status_code,
+            'message': 'Section successfully created',
+            'section': serializer.data
+        }
+        return Response(response, status=status_code)
+
+
+class EnrollmentView(APIView):
+    """
+    The sections the requesting user is enrolled in, and enrolling in one
+    more with ``{"section": <id>}``
+    """
+    permission_classes = (IsAuthenticated, )
+    renderer_classes = (FastJSONRenderer, BrowsableAPIRenderer)
+
+    def get(self, request):
+        sections = (Section.objects.filter(enrollments__student=request.user)
+                    .select_related('course').order_by('course__code', 'code'))
+        response = {
+            'success': True,
+            'status_code': status.HTTP_200_OK,
+            'message': 'Successfully fetched schedule',
+            'sections': SectionSerializer(sections, many=True).data
+        }
+        return Response(response, status=status.HTTP_200_OK)
+
+    def post(self, request):
+        section = request.data.get('section') if hasattr(request.data, 'get') else None
+        try:
+            section = int(section)
+        except (TypeError, ValueError):
+            error = 'Expected a section id'
+        else:
+            [error] = enroll([(request.user.pk, section)])
+
+        if error:
+            status_code = status.HTTP_400_BAD_REQUEST
+            response = {
+                'success': False,
+                'status_code': status_code,
+                'message': error
+            }
+            return Response(response, status=status_code)
+
+        status_code = status.HTTP_201_CREATED
+        response = {
+            'success': True,
+            'status_code': status_code,
+            'message': 'Successfully enrolled'
+        }
+        return Response(response, status=status_code)
+
+
+class BulkEnrollmentView(APIView):
+    """
+    Enrolls a batch of students, ``{"enrollments": [{"student": <id>,
+    "section": <id>}, ...]}``, reporting success or failure per row.
+    Restricted to admins.
+    """
+    permission_classes = (IsAdminRole, )
+
+    def post(self, request):
+        rows = request.data.get('enrollments') if isinstance(request.data, dict) else None
+        max_rows = api_setting('ENROLLMENT', 'MAX_ROWS')
+        if not isinstance(rows, list) or not rows or len(rows) > max_rows:
+            status_code = status.HTTP_400_BAD_REQUEST
+            response = {
+                'success': False,
+                'status_code': status_code,
+                'message': 'Expected a list of 1 to %d enrollments' % max_rows
+            }
+            return Response(response, status=status_code)
+
+        results = []
+        requests = []
+        for index, row in enumerate(rows):
+            try:
+                pair = (int(row['student']), int(row['section']))
+            except (KeyError, TypeError, ValueError):
+                results.append({'index': index, 'success': False,
+                                'error': 'Expected integer student and section ids'})
+                continue
+            results.append({'index': index, 'student': pair[0], 'section': pair[1]})
+            requests.append(pair)
+
+        errors = iter(enroll(requests, batch_size=api_setting('ENROLLMENT', 'BATCH_SIZE')))
+        for result in results:
+            if 'success' in result:
+                continue
+            error = next(errors)
+            result['success'] = error is None
+            if error:
+                result['error'] = error
+
+        enrolled = sum(result['success'] for result in results)
+        if enrolled == len(results):
+            status_code = status.HTTP_201_CREATED
+        elif enrolled:
+            status_code = status.HTTP_207_MULTI_STATUS
+        else:
+            status_code = status.HTTP_400_BAD_REQUEST
+
+        response = {
+            'success': enrolled > 0,
+            'status_code': status_code,
+            'message': '%d of %d enrollments accepted' % (enrolled, len(results)),
+            'results': results
+        }
+        return Response(response, status=status_code)
+
+
+class TokenObtainPairView(jwt_views.TokenObtainPairView):
+    # No authentication, a Basic auth header would hash a password before throttling
+    authentication_classes = ()
+    throttle_classes = (LoginRateThrottle, )
+
+
+class MetricsView(APIView):
+    """
+    Exposes in-process performance counters. Restricted to admins.
+    """
+    permission_classes = (IsAdminRole, )
+
+    def get(self, request):
+        response = {
+            'success': True,
+            'status_code': status.HTTP_200_OK,
+            'message': 'Successfully fetched metrics',
+            'metrics': {
+                'token_cache': token_cache.stats(),
+                'latency': latency_stats(),
+                'database_pools': pool_stats(),
+                'login_throttle': login_throttle.stats(),
+                'audit_log': audit_log.stats(),
             }
-            return Response(response, status=status.HTTP_200_OK)
\ No newline at end of file
+        }
+        return Response(response, status=status.HTTP_200_OK)
@@ -0,0 +1,169 @@
+"""
+Worker warm-up and import time measurement.
+
+A fresh worker pays for resolving the URLconf, for importing and building
+what the views use (DRF fields, simplejwt's token backend, the password
+validators) and for its first database connections on its first requests.
+``warm_up()`` does all of it up front: lms/wsgi.py and lms/asgi.py build
+what forked workers can share when they import the application, and each
+worker opens its database connections before it serves (see api.lifecycle).
+
+``measure_imports()`` times the imports of a cold start in a fresh
+interpreter (``python -X importtime``), for ``manage.py import_time``.
+"""
+import logging
+import os
+import subprocess
+import sys
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.db import connections
+from django.urls import URLPattern, URLResolver, get_resolver
+
+from .conf import api_setting
+from .password_validation import warm_password_validators
+
+logger = logging.getLogger(__name__)
+
+# One line of -X importtime output, times in seconds. ``depth`` is 0 for
+# imports made by the measured code itself.
+ImportTime = namedtuple('ImportTime', 'module self cumulative depth')
+
+
+def _views(patterns):
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            yield from _views(pattern.url_patterns)
+        elif isinstance(pattern, URLPattern):
+            view_class = getattr(pattern.callback, 'view_class', None)
+            if view_class is not None:
+                yield view_class
+
+
+def warm_urls():
+    """
+    Imports the URLconf and everything it imports, and builds the resolver's
+    lookup tables
+    """
+    resolver = get_resolver()
+    resolver.reverse_dict
+    return resolver
+
+
+def warm_serializers():
+    """
+    Builds the fields of every serializer the routed views use
+    """
+    serializer_classes = set()
+    for view_class in _views(get_resolver().url_patterns):
+        view = view_class()
+        if hasattr(view, 'get_serializer_class'):
+            serializer_class = view.get_serializer_class()
+        else:
+            serializer_class = getattr(view, 'serializer_class', None)
+        if serializer_class is not None:
+            serializer_classes.add(serializer_class)
+    for serializer_class in serializer_classes:
+        serializer_class().fields
+    return len(serializer_classes)
+
+
+def warm_tokens():
+    """
+    Signs a throwaway token, loading the JWT algorithms and signing key
+    """
+    from rest_framework_simplejwt.state import token_backend
+    token_backend.encode({'token_type': 'warm_up'})
+
+
+def warm_databases():
+    """
+    Opens a connection to every database and hands it back. A pooled
+    database keeps it, and fills its pool to MIN_SIZE. Connections belong to
+    the process that opened them, so this step runs in each worker once it
+    is forked (see api.lifecycle), never in a preloading master.
+    """
+    for connection in connections.all():
+        connection.ensure_connection()
+        connection.close()
+
+
+STEPS = (
+    ('urls', warm_urls),
+    ('serializers', warm_serializers),
+    ('tokens', warm_tokens),
+    ('password_validators', warm_password_validators),
+    ('databases', warm_databases),
+)
+
+# Steps whose work a forked worker inherits from a preloading master, run
+# when the application is imported; the others run in each worker
+SHARED_STEPS = ('urls', 'serializers', 'tokens', 'password_validators')
+WORKER_STEPS = ('databases',)
+
+
+def warm_up(steps=None):
+    """
+    Runs the warm-up steps enabled in STARTUP['WARM_UP'], out of ``steps``
+    (names, all by default), returns the seconds each took. A failing step
+    is logged and skipped, the worker still starts.
+    """
+    enabled = api_setting('STARTUP', 'WARM_UP')
+    timings = {}
+    for name, step in STEPS:
+        if steps is not None and name not in steps:
+            continue
+        if enabled is not True and name not in (enabled or ()):
+            continue
+        start = time.perf_counter()
+        try:
+            step()
+        except Exception:
+            logger.exception('Warm-up step %s failed', name)
+            continue
+        timings[name] = time.perf_counter() - start
+    if timings:
+        logger.info('Warmed up in %.3fs: %s', sum(timings.values()),
+                    ', '.join('%s %.3fs' % item for item in timings.items()))
+    return timings
+
+
+def parse_importtime(output):
+    """
+    Parses the stderr of ``python -X importtime`` into ImportTime tuples.
+    Modules loaded with importlib.import_module(), such as the URLconfs
+    include() loads, have no line of their own; their imports do.
+    """
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+        if not self_us.strip().isdigit():
+            # The header
+            continue
+        module = name.strip()
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        imports.append(ImportTime(module, int(self_us) / 1e6, int(cumulative_us) / 1e6, depth))
+    return imports
+
+
+# Imports what a worker imports before serving: the settings, the apps and the URLconf
+STARTUP_CODE = 'import django; django.setup(); from django.urls import get_resolver; get_resolver().url_patterns'
+
+
+def measure_imports(code=STARTUP_CODE):
+    """
+    Runs ``code`` in a fresh interpreter with the current settings and
+    returns its imports as ImportTime tuples
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, sys.path)),
+               DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', settings.SETTINGS_MODULE))
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                            env=env, capture_output=True, text=True, cwd=settings.BASE_DIR)
+    if result.returncode:
+        lines = result.stderr.strip().splitlines()
+        raise RuntimeError('Startup imports failed: %s' % (lines[-1] if lines else result.returncode))
+    return parse_importtime(result.stderr)
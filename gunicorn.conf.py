@@ -0,0 +1,18 @@
+"""
+Gunicorn hooks, loaded from the working directory by ``gunicorn lms.wsgi``.
+
+Each worker starts its background threads and warms its database
+connections once it has loaded the application, before it accepts
+requests, also under --preload, and flushes its buffers when it exits
+(see api.lifecycle).
+"""
+
+
+def post_worker_init(worker):
+    from api.lifecycle import start_worker
+    start_worker()
+
+
+def worker_exit(server, worker):
+    from api.lifecycle import stop_worker
+    stop_worker()
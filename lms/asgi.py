@@ -14,3 +14,20 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'lms.settings')
 
 application = get_asgi_application()
+
+# Refuses to serve with per-process caches holding shared state
+from api.checks import require_shared_caches  # noqa: E402
+
+require_shared_caches()
+
+# Builds what forked workers share before serving any request
+from api.warmup import SHARED_STEPS, warm_up  # noqa: E402
+
+warm_up(SHARED_STEPS)
+
+# Threads and database connections belong to the process serving: each
+# worker starts them once forked, from the server's post-fork hook
+# (gunicorn.conf.py) or on its first request
+from api.lifecycle import start_worker_on_request  # noqa: E402
+
+start_worker_on_request()
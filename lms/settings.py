@@ -15,12 +15,12 @@ import os
 from dotenv import load_dotenv
 from datetime import timedelta
 
-# load env
-load_dotenv()
-
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# load env, from a known path rather than searching for it on every start
+load_dotenv(BASE_DIR / '.env')
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.0/howto/deployment/checklist/
@@ -39,6 +39,9 @@ ALLOWED_HOSTS = []
 # Set your auth user to the new user you have created
 AUTH_USER_MODEL = 'api.User'
 
+# ModelBackend with permissions answered from api.permission_cache
+AUTHENTICATION_BACKENDS = ['api.permission_cache.SnapshotModelBackend']
+
 INSTALLED_APPS = [
     'django.contrib.admin',
     'django.contrib.auth',
@@ -59,10 +62,14 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticated'
     ),
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'api.authentication.CachedJWTAuthentication',
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework.authentication.BasicAuthentication'
+        'api.authentication.CachedBasicAuthentication'
     ),
+    # Reverse proxies in front of the app. Client addresses (login throttling,
+    # audit log) are taken from X-Forwarded-For only behind that many trusted
+    # proxies, from REMOTE_ADDR otherwise: the header is set by the client.
+    'NUM_PROXIES': int(os.environ.get('NUM_PROXIES', '0')),
 }
 
 # Configure the JWT settings
@@ -79,9 +86,197 @@ SIMPLE_JWT = {
     'USER_ID_CLAIM': 'user_id',
     'AUTH_TOKEN_CLASSES': ('rest_framework_simplejwt.tokens.AccessToken',),
     'TOKEN_TYPE_CLAIM': 'token_type',
+    'TOKEN_OBTAIN_SERIALIZER': 'api.serializers.TokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'api.serializers.RevocableTokenRefreshSerializer',
+}
+
+# Revocation of rotated refresh tokens (api.revocation.RevocationRegistry).
+# Use 'api.revocation.InMemoryRevocationStore' for a single process; the cache
+# store shares revocations between workers through OPTIONS['cache'], which
+# must be a cache every worker reaches (see CACHES).
+# SYNC_INTERVAL bounds, in seconds, how long a revocation made by another
+# worker can go unnoticed by this one's Bloom filter.
+TOKEN_REVOCATION = {
+    'STORE': 'api.revocation.CacheRevocationStore',
+    'OPTIONS': {'cache': 'shared'},
+    'BLOOM_CAPACITY': 100000,
+    'BLOOM_ERROR_RATE': 0.01,
+    'SYNC_INTERVAL': 5,
+}
+
+# Login attempt throttling (api.throttling), token buckets per client IP and
+# per email refilled at *_RATE and holding up to *_BURST attempts. A rate of
+# None turns that bucket off. Use 'api.throttling.MemoryBucketStore' for a
+# single process; the cache store shares buckets through OPTIONS['cache'],
+# which must be a cache every worker reaches (see CACHES), updating them under
+# a lock; OPTIONS['lock_wait'] is how long (seconds) an attempt waits for a
+# locked bucket before it is rejected. Client IPs depend on
+# REST_FRAMEWORK['NUM_PROXIES'].
+LOGIN_THROTTLE = {
+    'STORE': 'api.throttling.CacheBucketStore',
+    'OPTIONS': {'cache': 'shared'},
+    'IP_RATE': '30/min',
+    'IP_BURST': 30,
+    'EMAIL_RATE': '5/min',
+    'EMAIL_BURST': 10,
+}
+
+# Authentication audit log (api.audit). Events are queued in memory and written
+# in batches of up to BATCH_SIZE by a background thread, at least every
+# FLUSH_INTERVAL seconds. When MAX_QUEUE events are waiting, DROP_POLICY is
+# 'drop_newest', 'drop_oldest' or 'block' (wait up to BLOCK_TIMEOUT seconds
+# for room, then drop the new event).
+AUDIT_LOG = {
+    'ENABLED': True,
+    'MAX_QUEUE': 10000,
+    'BATCH_SIZE': 500,
+    'FLUSH_INTERVAL': 1.0,
+    'DROP_POLICY': 'drop_newest',
+    'BLOCK_TIMEOUT': 0.05,
+    'PAGE_SIZE': 100,
+    'MAX_PAGE_SIZE': 1000,
+}
+
+# Serve registration, login and the user list from the native async views in
+# api.async_views. Meant for ASGI deployments (lms/asgi.py).
+API_ASYNC_VIEWS = os.environ.get('API_ASYNC_VIEWS', '') == '1'
+
+# User listing (api.views.UserListView). CACHE holds the list version behind
+# ETag/Last-Modified and, when PAGE_CACHE_TTL is set (seconds), whole pages
+# keyed by that version. The version is kept until the next write, so CACHE
+# must be shared by every worker (see CACHES): a per-process one would keep
+# answering 304s and cached pages after writes handled by other workers.
+USER_LIST = {
+    'PAGE_SIZE': 100,
+    'MAX_PAGE_SIZE': 1000,
+    'STREAM_CHUNK_SIZE': 2000,
+    'CACHE': 'shared',
+    'PAGE_CACHE_TTL': 0,
+}
+
+# User exports (api.exports), rows fetched and written per chunk
+EXPORT = {
+    'CHUNK_SIZE': 2000,
+}
+
+# Password hashing. WORKERS sizes the process pool of bulk operations
+# (api.passwords.hash_passwords), THREADS the thread pool the async views hash
+# and check passwords in. Both default to the number of CPUs.
+PASSWORD_HASHING = {
+    'WORKERS': None,
+    'MIN_POOL_BATCH': 16,
+    'THREADS': None,
+}
+
+# Bulk registration (api.views.AuthUserBulkRegistrationView)
+BULK_REGISTRATION = {
+    'BATCH_SIZE': 1000,
+    'MAX_ROWS': 20000,
+}
+
+# Enrollment (api.scheduling.enroll), rows per INSERT and the largest batch
+# api.views.BulkEnrollmentView accepts
+ENROLLMENT = {
+    'BATCH_SIZE': 1000,
+    'MAX_ROWS': 20000,
+}
+
+# Batch jobs over users (api.batch_jobs, manage.py run_batch_job). Each
+# transaction covers CHUNK_SIZE ids, followed by SLEEP seconds, or longer to
+# stay under MAX_ROWS_PER_SECOND changed users when set.
+BATCH_JOBS = {
+    'CHUNK_SIZE': 1000,
+    'SLEEP': 0.1,
+    'MAX_ROWS_PER_SECOND': None,
+}
+
+# CSV imports (api.imports, manage.py import_users), rows per batch
+IMPORT = {
+    'BATCH_SIZE': 5000,
+}
+
+# Caching of successful Basic auth credential checks
+# (api.authentication.CachedBasicAuthentication). TTL is in seconds, 0 disables.
+# A password change invalidates the cached checks in CACHE only, so it must be
+# shared by every worker (see CACHES): with a per-process one the old password
+# keeps working on other workers for up to TTL seconds.
+BASIC_AUTH_CACHE = {
+    'CACHE': 'shared',
+    'TTL': 60,
+}
+
+# Resolution of authenticated user ids to users (api.user_cache.UserResolver).
+# Set CACHE to a shared cache alias to share entries between workers.
+USER_CACHE = {
+    'MAX_ENTRIES': 10000,
+    'LOCAL_TTL': 30,
+    'CACHE': None,
+    'TTL': 300,
+}
+
+# Per-process permission snapshots (api.permission_cache), behind has_perm()
+# and api.permissions. Signals only reach the process making the change, so
+# other workers pick it up after LOCAL_TTL seconds.
+PERMISSION_CACHE = {
+    'MAX_ENTRIES': 10000,
+    'LOCAL_TTL': 30,
+}
+
+# Write-behind batching of last_login updates (api.last_login.LastLoginBuffer).
+# FLUSH_INTERVAL is in seconds.
+LAST_LOGIN_BUFFER = {
+    'FLUSH_INTERVAL': 5,
+    'FLUSH_SIZE': 500,
+}
+
+# Background flushing of the write-behind buffers (api.buffers), started by
+# lms/wsgi.py and lms/asgi.py. Due buffers are flushed every CHECK_INTERVAL
+# seconds even when no request comes in.
+WRITE_BUFFERS = {
+    'CHECK_INTERVAL': 1,
+}
+
+# Discards the writes tests leave buffered before the test databases go
+TEST_RUNNER = 'api.test_runner.DiscoverRunner'
+
+# User counts behind /auth/users/stats (api.user_stats), buffered like
+# last_login. FLUSH_SIZE counts pending (dimension, key) pairs. SIGNUP_DAYS is
+# the default ?days= of signups by day, at most MAX_SIGNUP_DAYS.
+USER_STATS = {
+    'FLUSH_INTERVAL': 5,
+    'FLUSH_SIZE': 500,
+    'SIGNUP_DAYS': 30,
+    'MAX_SIGNUP_DAYS': 366,
+}
+
+# LRU of validated access tokens (api.token_cache.ValidatedTokenCache), 0 disables
+TOKEN_CACHE = {
+    'MAX_ENTRIES': 10000,
+}
+
+# Worker startup (api.warmup). WARM_UP runs every warm-up step before a
+# worker serves (True), none (False) or the listed ones, out of 'urls',
+# 'serializers', 'tokens', 'password_validators' and 'databases'.
+# manage.py import_time fails when startup imports take over IMPORT_BUDGET
+# seconds, and lists the IMPORT_BUDGET_TOP slowest modules.
+STARTUP = {
+    'WARM_UP': True,
+    'IMPORT_BUDGET': 3.0,
+    'IMPORT_BUDGET_TOP': 20,
+}
+
+# Per-request query/latency profiling (api.middleware.RequestTimingMiddleware).
+# SERVER_TIMING sends each request's numbers back in a Server-Timing header:
+# True, False, or None for only when DEBUG is on. Any client can read them,
+# so keep it off in production.
+REQUEST_PROFILING = {
+    'ENABLED': True,
+    'SERVER_TIMING': None,
 }
 
 MIDDLEWARE = [
+    'api.middleware.RequestTimingMiddleware',
+    'api.middleware.ReplicaPinningMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -117,7 +312,8 @@ WSGI_APPLICATION = 'lms.wsgi.application'
 
 DATABASES = {
    'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        # PostgreSQL with pooled connections, see DATABASE_POOL below
+        'ENGINE': 'api.db.backends.pooled_postgresql',
         'NAME': os.environ.get('DB_NAME', 'db'),
         'USER': os.environ.get('DB_USER', 'DB_USER'),
         'PASSWORD': os.environ.get('DB_PASSWORD', 'DB_PASSWORD'),
@@ -126,6 +322,86 @@ DATABASES = {
     }
 }
 
+# Read replicas, comma separated hosts sharing the primary's credentials.
+# Tests read the primary through them.
+for number, host in enumerate(filter(None, os.environ.get('DB_REPLICA_HOSTS', '').split(',')), 1):
+    DATABASES['replica_%d' % number] = dict(DATABASES['default'], HOST=host.strip(),
+                                            TEST={'MIRROR': 'default'})
+
+# Local setup with two SQLite databases, db-replica.sqlite3 standing in for a
+# replica. Run migrate with --database replica too, and copy db.sqlite3 over
+# it to "replicate".
+if os.environ.get('DB_SQLITE_REPLICA', '') == '1':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+        },
+        'replica': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db-replica.sqlite3',
+            'TEST': {'MIRROR': 'default'},
+        },
+    }
+
+# Connection pools of the pooled_postgresql engine, one per database, each
+# holding MIN_SIZE to MAX_SIZE connections. Checkouts wait up to TIMEOUT seconds
+# for a free connection, idle connections above MIN_SIZE are closed after
+# MAX_IDLE seconds and HEALTH_CHECK runs SELECT 1 before handing one out.
+# Leave CONN_MAX_AGE at 0, closing a connection returns it to the pool.
+DATABASE_POOL = {
+    'MIN_SIZE': 2,
+    'MAX_SIZE': 20,
+    'TIMEOUT': 30,
+    'MAX_IDLE': 300,
+    'HEALTH_CHECK': True,
+}
+
+DATABASE_ROUTERS = ['api.routers.PrimaryReplicaRouter']
+
+# Read replica routing (api.routers). Reads go to one of ALIASES, except for
+# PIN_SECONDS after a write by the same client (tracked with PIN_COOKIE).
+READ_REPLICAS = {
+    'ALIASES': [alias for alias in DATABASES if alias != 'default'],
+    'PIN_SECONDS': 5,
+    'PIN_COOKIE': 'lms_primary',
+}
+
+# Caches. 'shared' holds the state every worker must agree on, such as revoked
+# refresh tokens, login throttle buckets and the users list version, and must
+# be reachable by all of them: Redis at REDIS_URL (needs the redis package,
+# and a maxmemory-policy of noeviction so that revocations are not evicted).
+# Without REDIS_URL it falls back to the memory of each process, which only
+# suits runserver and tests: workers refuse to start that way unless DEBUG is
+# on, and `manage.py check --deploy` reports it (api.checks).
+REDIS_URL = os.environ.get('REDIS_URL', '')
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_URL,
+    } if REDIS_URL else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'shared',
+        # Culling would forget revoked tokens
+        'OPTIONS': {'MAX_ENTRIES': 1000000},
+    },
+}
+
+
+# Password hashing
+# https://docs.djangoproject.com/en/5.0/topics/auth/passwords/
+
+PASSWORD_HASHERS = [
+    'api.hashers.ProfiledPBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -138,7 +414,8 @@ AUTH_PASSWORD_VALIDATORS = [
         'NAME': 'django.contrib.auth.password_validation.MinimumLengthValidator',
     },
     {
-        'NAME': 'django.contrib.auth.password_validation.CommonPasswordValidator',
+        # Django's list of common passwords, held as compact fingerprints
+        'NAME': 'api.password_validation.CompactCommonPasswordValidator',
     },
     {
         'NAME': 'django.contrib.auth.password_validation.NumericPasswordValidator',